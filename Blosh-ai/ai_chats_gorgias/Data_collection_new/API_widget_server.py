@@ -3,14 +3,34 @@ Gorgias Widget API Server
 Flask server that provides AI response suggestions for Gorgias tickets
 """
 
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, Response, stream_with_context
 from flask_cors import CORS
 import os
+import hmac
 import logging
 from datetime import datetime
-from improved_response_generator import generate_response
-import base64
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from improved_response_generator import generate_response, generate_response_stream
+from suggestion_cache import create_suggestion_store, make_cache_key, SingleFlight
+from suggestion_jobs import SuggestionJobQueue, QueueFullError, create_job_store
+from gorgias_client import get_default_client
+from openai_limiter import get_limiter
+from response_memo import get_response_memo
+from semantic_cache import get_semantic_cache
+from reply_index import get_reply_index
+from pipeline_metrics import PipelineTrace, get_metrics, record_suggestion
+from feedback_store import get_feedback_store
+from widget_common import (
+    WIDGET_HTML,
+    GENERATION_LEASE_SECONDS,
+    merge_ticket_messages,
+    update_ticket_input,
+    build_response_data,
+    with_request_metrics,
+    store_feedback,
+    feedback_stats,
+    sse_event
+)
 
 # Initialize Flask
 app = Flask(__name__)
@@ -20,6 +40,10 @@ CORS(app)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GORGIAS_AUTH = os.getenv('GORGIAS_AUTH')
 GORGIAS_BASE_URL = os.getenv('GORGIAS_BASE_URL', 'https://freebirdicons.gorgias.com/api')
+GORGIAS_WEBHOOK_SECRET = os.getenv('GORGIAS_WEBHOOK_SECRET')
+
+# Gorgias events that should pre-generate a suggestion
+PREGENERATE_EVENTS = {'ticket-created', 'ticket-message-created'}
 
 # Set OpenAI key for response generator
 os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
@@ -28,106 +52,223 @@ os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Simple cache for suggestions (in production, use Redis)
-suggestions_cache = {}
+# Suggestion cache keyed on ticket id + last customer message.
+# Defaults to a SQLite store shared by all gunicorn workers (SUGGESTION_STORE=memory for per-process)
+suggestions_cache = create_suggestion_store()
+
+# Concurrent requests for the same ticket share one in-flight generation
+suggestion_flights = SingleFlight()
+
+# Background executor for job-based suggestions (POST /api/suggest/jobs)
+suggestion_jobs = SuggestionJobQueue(
+    create_job_store(),
+    max_workers=int(os.getenv('SUGGESTION_JOB_WORKERS', 4)),
+    max_pending=int(os.getenv('SUGGESTION_JOB_QUEUE_SIZE', 50))
+)
 
 # ============================================================================
 # GORGIAS API HELPERS
 # ============================================================================
 
-def get_gorgias_headers():
-    """Get headers for Gorgias API requests"""
-    return {
-        'accept': 'application/json',
-        'authorization': GORGIAS_AUTH,
-        'content-type': 'application/json'
-    }
+# Pooled keep-alive session with 429 Retry-After handling (configured via GORGIAS_* env vars)
+gorgias = get_default_client()
 
 def get_ticket_data(ticket_id):
     """Fetch ticket data from Gorgias API"""
-    try:
-        url = f"{GORGIAS_BASE_URL}/tickets/{ticket_id}"
-        response = requests.get(url, headers=get_gorgias_headers(), timeout=10)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Failed to fetch ticket {ticket_id}: {response.status_code} - {response.text}")
-            return None
-    except Exception as e:
-        logger.error(f"Error fetching ticket: {str(e)}")
-        return None
+    return gorgias.get_json(f"tickets/{ticket_id}")
 
 def get_ticket_messages(ticket_id):
     """Fetch ticket messages from Gorgias API"""
-    try:
-        url = f"{GORGIAS_BASE_URL}/tickets/{ticket_id}/messages"
-        response = requests.get(url, headers=get_gorgias_headers(), timeout=10)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Failed to fetch messages for ticket {ticket_id}: {response.status_code}")
-            return None
-    except Exception as e:
-        logger.error(f"Error fetching messages: {str(e)}")
-        return None
+    return gorgias.get_json(f"tickets/{ticket_id}/messages")
+
+# Small shared pool so ticket + messages are fetched in one round-trip of latency
+gorgias_fetch_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('GORGIAS_FETCH_THREADS', 8)),
+    thread_name_prefix='gorgias-fetch'
+)
+
+def load_ticket_context(ticket_id):
+    """
+    Fetch ticket and its full message thread concurrently and merge them
+    into the structure extract_ticket_info expects
+    """
+    ticket_future = gorgias_fetch_pool.submit(get_ticket_data, ticket_id)
+    messages_future = gorgias_fetch_pool.submit(get_ticket_messages, ticket_id)
+    
+    return merge_ticket_messages(ticket_future.result(), messages_future.result())
+
+# ============================================================================
+# SUGGESTION PIPELINE
+# ============================================================================
+
+def resolve_ticket_input(ticket_id, data, trace=None):
+    """Combine request fields with ticket data from Gorgias when the message is missing"""
+    trace = trace or PipelineTrace()
+    ticket_input = {
+        'customer_name': data.get('customer_name', ''),
+        'message': data.get('message', ''),
+        'order_number': data.get('order_number', ''),
+        'subject': data.get('subject', '')
+    }
+    
+    # If message is empty, try to fetch from Gorgias
+    if not ticket_input['message']:
+        with trace.stage('gorgias_fetch'):
+            ticket_data = load_ticket_context(ticket_id)
+        update_ticket_input(ticket_input, ticket_data)
+    
+    return ticket_input
 
-def extract_ticket_info(ticket_data):
-    """Extract relevant info from Gorgias ticket data"""
-    if not ticket_data:
+def generate_suggestion(ticket_id, ticket_input, cache_key, trace=None):
+    """Generate a suggestion with the AI model and cache it"""
+    result = generate_response(
+        customer_message=ticket_input['message'],
+        customer_name=ticket_input['customer_name'],
+        order_number=ticket_input['order_number'],
+        subject=ticket_input['subject'],
+        trace=trace
+    )
+    
+    if not result:
         return None
     
-    # Get customer info
-    customer = ticket_data.get('customer', {})
-    customer_name = customer.get('firstname', '') or customer.get('name', '').split()[0] if customer.get('name') else ''
+    response_data = build_response_data(ticket_id, result)
+    suggestions_cache.set(cache_key, response_data)
     
-    # Get last message from messages endpoint or from ticket data
-    last_customer_message = ''
-    messages = ticket_data.get('messages', [])
+    logger.info(f"Generated suggestion for {ticket_id} - Quality: {result['quality_score']} - "
+                f"{result['metrics']['timings_ms']['total']:.0f}ms")
     
-    if messages:
-        for msg in reversed(messages):
-            if msg.get('source', {}).get('type') == 'customer':
-                last_customer_message = msg.get('body_text', '')
-                break
+    return response_data
+
+def get_or_generate_suggestion(ticket_id, ticket_input, trace=None):
+    """
+    Return the cached suggestion or generate it exactly once.
+    Concurrent requests for the same ticket + message wait on the in-flight
+    generation (threads via SingleFlight, other workers via a store lease).
+    """
+    trace = trace or PipelineTrace()
     
-    # Fallback: try to get from ticket's last_message
-    if not last_customer_message and 'last_message' in ticket_data:
-        last_customer_message = ticket_data.get('last_message', {}).get('body_text', '')
+    # Check cache - a new customer message changes the key and misses
+    cache_key = make_cache_key(ticket_id, ticket_input['message'])
+    with trace.stage('cache_lookup'):
+        cached = suggestions_cache.get(cache_key)
+    trace.hit('suggestion_store', bool(cached))
+    if cached:
+        logger.info(f"Returning cached suggestion for {ticket_id}")
+        cached['cached'] = True
+        return cached
     
-    # Try to extract order number from tags or subject
-    tags = ticket_data.get('tags', [])
-    order_number = None
+    def generate_once():
+        if suggestions_cache.acquire_lease(cache_key, GENERATION_LEASE_SECONDS):
+            try:
+                return generate_suggestion(ticket_id, ticket_input, cache_key, trace)
+            finally:
+                suggestions_cache.release_lease(cache_key)
+        
+        # Another worker is generating this suggestion - wait for it to land in the store
+        logger.info(f"Waiting for in-flight suggestion for {ticket_id} from another worker")
+        shared = suggestions_cache.wait_for(cache_key, timeout=GENERATION_LEASE_SECONDS)
+        if shared:
+            trace.hit('coalesced')
+            shared['cached'] = True
+            return shared
+        return generate_suggestion(ticket_id, ticket_input, cache_key, trace)
     
-    for tag in tags:
-        if isinstance(tag, dict):
-            tag_name = tag.get('name', '')
-        else:
-            tag_name = str(tag)
+    response_data, shared = suggestion_flights.do(cache_key, generate_once)
+    
+    # The call we waited on gave up (stream client disconnected or generation failed) - lead a new one
+    if shared and response_data is None:
+        logger.info(f"In-flight suggestion for {ticket_id} returned nothing - generating again")
         
-        # Look for order numbers in tags
-        if tag_name.startswith('102') or tag_name.startswith('203'):
-            order_number = tag_name
-            break
-    
-    # Also try to find order number in subject
-    if not order_number:
-        subject = ticket_data.get('subject', '')
-        import re
-        order_match = re.search(r'\b(102\d{6}|203\d{5})\b', subject)
-        if order_match:
-            order_number = order_match.group(1)
-    
-    return {
-        'ticket_id': ticket_data.get('id'),
-        'customer_name': customer_name,
-        'customer_email': customer.get('email', ''),
-        'subject': ticket_data.get('subject', ''),
-        'message': last_customer_message,
-        'order_number': order_number,
-        'channel': ticket_data.get('channel', 'email')
-    }
+        def regenerate():
+            # Another waiter may have regenerated it already
+            stored = suggestions_cache.peek(cache_key)
+            return dict(stored, cached=True) if stored else generate_once()
+        
+        response_data, shared = suggestion_flights.do(cache_key, regenerate)
+    
+    if response_data and shared:
+        trace.hit('coalesced')
+        logger.info(f"Coalesced suggestion request for {ticket_id} with in-flight generation")
+        response_data = dict(response_data, cached=True)
+    
+    return response_data
+
+def run_suggestion_job(ticket_id, data, endpoint='job'):
+    """Background job: resolve ticket input and generate (or reuse) the suggestion"""
+    trace = PipelineTrace()
+    ticket_input = resolve_ticket_input(ticket_id, data, trace)
+    
+    if not ticket_input['message']:
+        raise ValueError('No message found')
+    
+    response_data = get_or_generate_suggestion(ticket_id, ticket_input, trace)
+    record_suggestion(trace, endpoint, response_data)
+    
+    if not response_data:
+        raise RuntimeError('Failed to generate response')
+    
+    return with_request_metrics(response_data, trace)
+
+def stream_suggestion_events(ticket_id, ticket_input, trace=None):
+    """
+    SSE events for a suggestion: 'delta' per streamed token chunk, then 'done'
+    with the validated suggestion, or 'failed' with an error message.
+    """
+    trace = trace or PipelineTrace()
+    if not ticket_input['message']:
+        yield sse_event('failed', {'error': 'No message found'})
+        return
+    
+    cache_key = make_cache_key(ticket_id, ticket_input['message'])
+    with trace.stage('cache_lookup'):
+        cached = suggestions_cache.get(cache_key)
+    trace.hit('suggestion_store', bool(cached))
+    if cached:
+        cached['cached'] = True
+        record_suggestion(trace, 'stream', cached)
+        yield sse_event('done', with_request_metrics(cached, trace))
+        return
+    
+    # Someone is already generating this suggestion - wait for it instead of streaming a duplicate.
+    # The lease covers other workers, the SingleFlight registration other threads in this one.
+    flight = None
+    if suggestions_cache.acquire_lease(cache_key, GENERATION_LEASE_SECONDS):
+        flight = suggestion_flights.lead(cache_key)
+        if flight is None:
+            suggestions_cache.release_lease(cache_key)
+    
+    if flight is None:
+        response_data = get_or_generate_suggestion(ticket_id, ticket_input, trace)
+        record_suggestion(trace, 'stream', response_data)
+        if response_data:
+            yield sse_event('done', with_request_metrics(response_data, trace))
+        else:
+            yield sse_event('failed', {'error': 'Failed to generate response'})
+        return
+    
+    response_data = None
+    try:
+        for kind, payload in generate_response_stream(
+            customer_message=ticket_input['message'],
+            customer_name=ticket_input['customer_name'],
+            order_number=ticket_input['order_number'],
+            subject=ticket_input['subject'],
+            trace=trace
+        ):
+            if kind == 'delta':
+                yield sse_event('delta', {'text': payload})
+            elif kind == 'done':
+                response_data = build_response_data(ticket_id, payload)
+                suggestions_cache.set(cache_key, response_data)
+                logger.info(f"Streamed suggestion for {ticket_id} - Quality: {payload['quality_score']}")
+                yield sse_event('done', with_request_metrics(response_data, trace))
+            else:
+                yield sse_event('failed', {'error': payload})
+    finally:
+        suggestions_cache.release_lease(cache_key)
+        suggestion_flights.finish(cache_key, flight, response_data)
+        record_suggestion(trace, 'stream', response_data)
 
 # ============================================================================
 # API ENDPOINTS
@@ -143,15 +284,43 @@ def root():
         'endpoints': {
             'health': '/health',
             'suggest': '/api/suggest',
+            'suggest_job': '/api/suggest/jobs',
+            'job_status': '/api/suggest/jobs/<job_id>',
+            'suggest_stream': '/api/suggest/stream/<ticket_id>',
+            'gorgias_webhook': '/api/webhooks/gorgias',
+            'metrics': '/metrics',
             'widget': '/widget/<ticket_id>',
-            'feedback': '/api/feedback'
+            'feedback': '/api/feedback',
+            'feedback_stats': '/api/feedback/stats'
         }
     })
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'cache': suggestions_cache.stats(),
+        'in_flight': suggestion_flights.stats(),
+        'jobs': suggestion_jobs.stats(),
+        'gorgias': gorgias.stats(),
+        'openai': get_limiter().stats(),
+        'response_memo': get_response_memo().stats(),
+        'semantic_cache': get_semantic_cache().stats() if get_semantic_cache() else None,
+        'reply_index': get_reply_index().stats() if get_reply_index() else None,
+        'feedback': get_feedback_store().stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: suggestion latency histograms per stage, token and cache counters"""
+    metrics = get_metrics()
+    openai_stats = get_limiter().stats()
+    metrics.set_gauge('openai_in_flight', openai_stats['in_flight'], 'OpenAI requests in flight')
+    metrics.set_gauge('openai_queued', openai_stats['queued'], 'OpenAI requests waiting for the limiter')
+    metrics.set_gauge('suggestion_jobs_active', suggestion_jobs.stats()['active'], 'Suggestion jobs queued or running')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/suggest', methods=['POST'])
 def suggest_response():
@@ -176,473 +345,199 @@ def suggest_response():
         
         logger.info(f"Generating suggestion for ticket {ticket_id}")
         
-        # Check cache first
-        if ticket_id in suggestions_cache:
-            logger.info(f"Returning cached suggestion for {ticket_id}")
-            cached = suggestions_cache[ticket_id]
-            cached['cached'] = True
-            return jsonify(cached)
-        
-        # Extract info
-        customer_name = data.get('customer_name', '')
-        message = data.get('message', '')
-        order_number = data.get('order_number', '')
-        subject = data.get('subject', '')
+        trace = PipelineTrace()
+        ticket_input = resolve_ticket_input(ticket_id, data, trace)
         
-        # If message is empty, try to fetch from Gorgias
-        if not message:
-            ticket_data = get_ticket_data(ticket_id)
-            if ticket_data:
-                info = extract_ticket_info(ticket_data)
-                if info:
-                    customer_name = info['customer_name']
-                    message = info['message']
-                    order_number = info['order_number'] or order_number
-                    subject = info['subject']
-        
-        if not message:
+        if not ticket_input['message']:
             return jsonify({'error': 'No message found'}), 400
         
-        # Generate AI response
-        result = generate_response(
-            customer_message=message,
-            customer_name=customer_name,
-            order_number=order_number,
-            subject=subject
-        )
+        response_data = get_or_generate_suggestion(ticket_id, ticket_input, trace)
+        record_suggestion(trace, 'suggest', response_data)
         
-        if not result:
+        if not response_data:
             return jsonify({'error': 'Failed to generate response'}), 500
         
-        # Prepare response
-        response_data = {
-            'ticket_id': ticket_id,
-            'suggestion': result['response'],
-            'quality_score': result['quality_score'],
-            'confidence': result['quality_score'],
-            'brand': result['brand'],
-            'warnings': result.get('warnings', []),
-            'approved': result['approved'],
-            'timestamp': datetime.now().isoformat(),
-            'cached': False
-        }
-        
-        # Cache it
-        suggestions_cache[ticket_id] = response_data
-        
-        logger.info(f"Generated suggestion for {ticket_id} - Quality: {result['quality_score']}")
-        
-        return jsonify(response_data)
+        return jsonify(with_request_metrics(response_data, trace))
         
     except Exception as e:
         logger.error(f"Error in suggest_response: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/feedback', methods=['POST'])
-def record_feedback():
-    """Record agent feedback on suggestions"""
+@app.route('/api/suggest/jobs', methods=['POST'])
+def submit_suggestion_job():
+    """
+    Queue suggestion generation and return a job id immediately
+    
+    Expects the same JSON as /api/suggest. Poll /api/suggest/jobs/<job_id>
+    until status is "done" (result included) or "error".
+    """
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         ticket_id = data.get('ticket_id')
-        feedback = data.get('feedback')  # 'used', 'edited', 'ignored'
         
-        logger.info(f"Feedback for ticket {ticket_id}: {feedback}")
+        if not ticket_id:
+            return jsonify({'error': 'ticket_id required'}), 400
+        
+        job = suggestion_jobs.submit(ticket_id, run_suggestion_job, ticket_id, data)
         
-        # TODO: Store in database for analytics
+        logger.info(f"Queued suggestion job {job['job_id']} for ticket {ticket_id}")
         
-        return jsonify({'status': 'success'})
+        return jsonify({
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'status_url': f"/api/suggest/jobs/{job['job_id']}"
+        }), 202
         
+    except QueueFullError as e:
+        logger.warning(str(e))
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '2'}
     except Exception as e:
-        logger.error(f"Error recording feedback: {str(e)}")
+        logger.error(f"Error in submit_suggestion_job: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-# ============================================================================
-# WIDGET ENDPOINT
-# ============================================================================
+@app.route('/api/suggest/jobs/<job_id>', methods=['GET'])
+def suggestion_job_status(job_id):
+    """Return job status, plus the suggestion once the job is done"""
+    job = suggestion_jobs.get(job_id)
+    
+    if not job:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    return jsonify(job)
 
-@app.route('/widget/<ticket_id>', methods=['GET'])
-def widget(ticket_id):
+@app.route('/api/suggest/stream/<ticket_id>', methods=['GET'])
+def stream_suggestion(ticket_id):
     """
-    Gorgias sidebar widget - displays AI suggestion in an iframe
-    This endpoint returns full HTML that Gorgias will render in the sidebar
+    Stream an AI suggestion as Server-Sent Events
+    
+    Optional query params: customer_name, message, order_number, subject
+    (fetched from Gorgias when message is missing)
     """
+    logger.info(f"Streaming suggestion for ticket {ticket_id}")
     
-    widget_html = """
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>AI Suggestion</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif;
-            padding: 16px;
-            background: #f8f9fa;
-            font-size: 14px;
-        }
-        .header {
-            display: flex;
-            align-items: center;
-            margin-bottom: 16px;
-            padding-bottom: 12px;
-            border-bottom: 2px solid #e9ecef;
-        }
-        .header h3 {
-            color: #2c3e50;
-            font-size: 16px;
-            flex: 1;
-        }
-        .badge {
-            display: inline-block;
-            padding: 4px 10px;
-            border-radius: 12px;
-            font-size: 11px;
-            font-weight: 600;
-        }
-        .badge-high { background: #d4edda; color: #155724; }
-        .badge-medium { background: #fff3cd; color: #856404; }
-        .badge-low { background: #f8d7da; color: #721c24; }
-        
-        .loading {
-            text-align: center;
-            padding: 40px 20px;
-            color: #6c757d;
-        }
-        .spinner {
-            border: 3px solid #f3f3f3;
-            border-top: 3px solid #2196f3;
-            border-radius: 50%;
-            width: 40px;
-            height: 40px;
-            animation: spin 1s linear infinite;
-            margin: 0 auto 16px;
-        }
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        .suggestion-box {
-            background: white;
-            border: 1px solid #dee2e6;
-            border-radius: 8px;
-            padding: 16px;
-            margin-bottom: 12px;
-        }
-        .suggestion-text {
-            background: #e7f3ff;
-            border-left: 4px solid #2196f3;
-            padding: 12px;
-            border-radius: 4px;
-            white-space: pre-wrap;
-            font-size: 13px;
-            line-height: 1.6;
-            color: #212529;
-            max-height: 400px;
-            overflow-y: auto;
-        }
-        
-        .actions {
-            display: flex;
-            gap: 8px;
-            margin-top: 12px;
-        }
-        .btn {
-            flex: 1;
-            padding: 10px 16px;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            font-size: 13px;
-            font-weight: 500;
-            transition: all 0.2s;
-        }
-        .btn-primary {
-            background: #2196f3;
-            color: white;
-        }
-        .btn-primary:hover {
-            background: #1976d2;
-            transform: translateY(-1px);
-            box-shadow: 0 2px 8px rgba(33,150,243,0.3);
-        }
-        .btn-secondary {
-            background: #e9ecef;
-            color: #495057;
-        }
-        .btn-secondary:hover {
-            background: #dee2e6;
-        }
-        
-        .info {
-            display: flex;
-            gap: 12px;
-            margin-top: 12px;
-            font-size: 12px;
-            color: #6c757d;
-        }
-        .info-item {
-            display: flex;
-            align-items: center;
-            gap: 4px;
-        }
-        
-        .warning {
-            background: #fff3cd;
-            border-left: 4px solid #ffc107;
-            padding: 12px;
-            margin: 12px 0;
-            font-size: 12px;
-            color: #856404;
-            border-radius: 4px;
-        }
-        .warning-title {
-            font-weight: 600;
-            margin-bottom: 4px;
-        }
-        
-        .error {
-            background: #f8d7da;
-            border-left: 4px solid #dc3545;
-            padding: 12px;
-            color: #721c24;
-            border-radius: 4px;
-        }
+    data = request.args.to_dict()
+    
+    def events():
+        try:
+            trace = PipelineTrace()
+            ticket_input = resolve_ticket_input(ticket_id, data, trace)
+            yield from stream_suggestion_events(ticket_id, ticket_input, trace)
+        except Exception as e:
+            logger.error(f"Error in stream_suggestion: {str(e)}", exc_info=True)
+            yield sse_event('failed', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/webhooks/gorgias', methods=['POST'])
+def gorgias_webhook():
+    """
+    Gorgias HTTP integration for ticket-created / ticket-message-created events.
+    Queues suggestion generation so the widget is a cache hit when an agent opens the ticket.
+    
+    Expects JSON (configure this body in the Gorgias HTTP integration):
+    {
+        "event": "{{event.type}}",
+        "ticket_id": "{{ticket.id}}",
+        "from_agent": "{{message.from_agent}}"
+    }
+    A nested {"ticket": {"id": ...}, "message": {"from_agent": ...}} payload also works.
+    """
+    try:
+        if GORGIAS_WEBHOOK_SECRET:
+            token = request.headers.get('X-Webhook-Token') or request.args.get('token', '')
+            if not hmac.compare_digest(token, GORGIAS_WEBHOOK_SECRET):
+                return jsonify({'error': 'Invalid webhook token'}), 401
         
-        .feedback {
-            margin-top: 12px;
-            padding-top: 12px;
-            border-top: 1px solid #e9ecef;
-            text-align: center;
-        }
-        .feedback-label {
-            font-size: 12px;
-            color: #6c757d;
-            margin-bottom: 8px;
-        }
-        .feedback-btns {
-            display: flex;
-            gap: 6px;
-            justify-content: center;
-        }
-        .feedback-btn {
-            padding: 6px 12px;
-            font-size: 12px;
-            background: #f8f9fa;
-            border: 1px solid #dee2e6;
-            border-radius: 4px;
-            cursor: pointer;
-            transition: all 0.2s;
-        }
-        .feedback-btn:hover {
-            background: #e9ecef;
-        }
-        .feedback-btn.active {
-            background: #2196f3;
-            color: white;
-            border-color: #2196f3;
-        }
+        data = request.get_json(silent=True) or {}
+        event = data.get('event') or data.get('type') or 'ticket-message-created'
+        ticket_id = data.get('ticket_id') or (data.get('ticket') or {}).get('id')
+        message = data.get('message') or {}
+        from_agent = data.get('from_agent', message.get('from_agent', False))
         
-        .brand-tag {
-            display: inline-block;
-            background: #e3f2fd;
-            color: #1976d2;
-            padding: 3px 8px;
-            border-radius: 4px;
-            font-size: 11px;
-            font-weight: 500;
-        }
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h3>🤖 AI Suggestion</h3>
-    </div>
-    
-    <div id="content">
-        <div class="loading">
-            <div class="spinner"></div>
-            <div>Generating suggestion...</div>
-        </div>
-    </div>
-
-    <script>
-        const TICKET_ID = "{{ ticket_id }}";
-        const API_URL = window.location.origin;
+        if not ticket_id:
+            return jsonify({'error': 'ticket_id required'}), 400
         
-        let currentSuggestion = null;
+        ticket_id = str(ticket_id)
         
-        async function loadSuggestion() {
-            try {
-                // First, try to fetch from cache or generate new suggestion
-                const response = await fetch(`${API_URL}/api/suggest`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        ticket_id: TICKET_ID
-                    })
-                });
-                
-                if (!response.ok) {
-                    const errorText = await response.text();
-                    throw new Error(`HTTP ${response.status}: ${errorText || response.statusText}`);
-                }
-                
-                const data = await response.json();
-                
-                if (data.error) {
-                    throw new Error(data.error);
-                }
-                
-                currentSuggestion = data;
-                displaySuggestion(data);
-                
-            } catch (error) {
-                console.error('Error loading suggestion:', error);
-                displayError(error.message || 'Failed to load suggestion');
-            }
-        }
+        # An agent reply answers the last customer message: drop the suggestions drafted for it
+        if event == 'ticket-message-created' and str(from_agent).lower() == 'true':
+            suggestions_cache.invalidate_ticket(ticket_id)
+            logger.info(f"Webhook agent reply for ticket {ticket_id} - cached suggestions invalidated")
+            return jsonify({'status': 'invalidated', 'event': event}), 200
         
-        function displaySuggestion(data) {
-            const qualityScore = data.quality_score || data.confidence || 0;
-            const confidenceBadge = qualityScore >= 70 ? 'badge-high' : qualityScore >= 50 ? 'badge-medium' : 'badge-low';
-            const confidenceText = qualityScore >= 70 ? 'High' : qualityScore >= 50 ? 'Medium' : 'Low';
-            
-            const warnings = data.warnings || [];
-            const warningHtml = warnings.length > 0 ? `
-                <div class="warning">
-                    <div class="warning-title">⚠️ Review Needed:</div>
-                    ${warnings.map(w => `<div>• ${w}</div>`).join('')}
-                </div>
-            ` : '';
-            
-            document.getElementById('content').innerHTML = `
-                <div class="suggestion-box">
-                    <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 12px;">
-                        <span class="brand-tag">${data.brand || 'Freebird Icons'}</span>
-                        <span class="badge ${confidenceBadge}">${confidenceText} Quality (${qualityScore}%)</span>
-                    </div>
-                    
-                    ${warningHtml}
-                    
-                    <div class="suggestion-text">${escapeHtml(data.suggestion)}</div>
-                    
-                    <div class="actions">
-                        <button class="btn btn-primary" onclick="useSuggestion()">
-                            ✓ Use Response
-                        </button>
-                        <button class="btn btn-secondary" onclick="copySuggestion()">
-                            📋 Copy
-                        </button>
-                    </div>
-                    
-                    <div class="info">
-                        <div class="info-item">
-                            <span>🎯</span>
-                            <span>Ticket #${TICKET_ID}</span>
-                        </div>
-                        ${data.cached ? '<div class="info-item"><span>💾</span><span>Cached</span></div>' : ''}
-                    </div>
-                </div>
-                
-                <div class="feedback">
-                    <div class="feedback-label">Was this helpful?</div>
-                    <div class="feedback-btns">
-                        <button class="feedback-btn" onclick="sendFeedback('used')">👍 Used It</button>
-                        <button class="feedback-btn" onclick="sendFeedback('edited')">✏️ Edited</button>
-                        <button class="feedback-btn" onclick="sendFeedback('ignored')">👎 Ignored</button>
-                    </div>
-                </div>
-            `;
-        }
+        # Other events don't need a new suggestion
+        if event not in PREGENERATE_EVENTS:
+            return jsonify({'status': 'ignored', 'event': event}), 200
         
-        function displayError(message) {
-            document.getElementById('content').innerHTML = `
-                <div class="error">
-                    <strong>Error:</strong> ${escapeHtml(message)}
-                    <br><br>
-                    <button class="btn btn-secondary" onclick="loadSuggestion()">Try Again</button>
-                </div>
-            `;
-        }
+        job = suggestion_jobs.submit(ticket_id, run_suggestion_job, ticket_id, {}, 'webhook')
         
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
-        }
+        logger.info(f"Webhook {event} for ticket {ticket_id} - queued job {job['job_id']}")
         
-        async function useSuggestion() {
-            if (!currentSuggestion) return;
-            
-            // Copy to clipboard
-            await navigator.clipboard.writeText(currentSuggestion.suggestion);
-            
-            // Visual feedback
-            const btn = event.target;
-            const originalText = btn.innerHTML;
-            btn.innerHTML = '✓ Copied!';
-            btn.style.background = '#4caf50';
-            
-            setTimeout(() => {
-                btn.innerHTML = originalText;
-                btn.style.background = '';
-            }, 2000);
-            
-            // Record feedback
-            sendFeedback('used');
-            
-            alert('Response copied to clipboard! Paste it into your reply field.');
-        }
+        return jsonify({'status': 'queued', 'job_id': job['job_id']}), 202
         
-        async function copySuggestion() {
-            if (!currentSuggestion) return;
-            
-            await navigator.clipboard.writeText(currentSuggestion.suggestion);
-            
-            const btn = event.target;
-            const originalText = btn.innerHTML;
-            btn.innerHTML = '✓ Copied';
-            
-            setTimeout(() => {
-                btn.innerHTML = originalText;
-            }, 2000);
-        }
+    except QueueFullError as e:
+        logger.warning(f"Webhook dropped: {str(e)}")
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '10'}
+    except Exception as e:
+        logger.error(f"Error in gorgias_webhook: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/feedback', methods=['POST'])
+def record_feedback():
+    """
+    Record agent feedback on a suggestion
+    
+    Expects JSON:
+    {
+        "ticket_id": "123456",
+        "feedback": "used",              # 'used', 'edited' or 'ignored'
+        "suggestion_id": "9f1c...",      # from the suggestion response
+        "brand": "Freebird Icons",
+        "intent": "return",
+        "quality_score": 85,
+        "warnings": [],
+        "latency_ms": 2300               # time until the agent saw the suggestion
+    }
+    """
+    try:
+        body, status = store_feedback(request.get_json() or {})
+        return jsonify(body), status
         
-        async function sendFeedback(type) {
-            try {
-                await fetch(`${API_URL}/api/feedback`, {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        ticket_id: TICKET_ID,
-                        feedback: type
-                    })
-                });
-                
-                // Visual feedback
-                document.querySelectorAll('.feedback-btn').forEach(btn => {
-                    btn.classList.remove('active');
-                });
-                event.target.classList.add('active');
-                
-            } catch (error) {
-                console.error('Error sending feedback:', error);
-            }
-        }
+    except Exception as e:
+        logger.error(f"Error recording feedback: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/feedback/stats', methods=['GET'])
+def get_feedback_stats():
+    """
+    Acceptance rate of suggestions
+    
+    Query params: by=brand|intent|day (default brand), days=30
+    """
+    try:
+        body, status = feedback_stats(request.args)
+        return jsonify(body), status
         
-        // Auto-load on page load
-        window.addEventListener('load', loadSuggestion);
-    </script>
-</body>
-</html>
+    except Exception as e:
+        logger.error(f"Error reading feedback stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# ============================================================================
+# WIDGET ENDPOINT
+# ============================================================================
+
+@app.route('/widget/<ticket_id>', methods=['GET'])
+def widget(ticket_id):
+    """
+    Gorgias sidebar widget - displays AI suggestion in an iframe
+    This endpoint returns full HTML that Gorgias will render in the sidebar
     """
     
-    return render_template_string(widget_html, ticket_id=ticket_id)
+    return render_template_string(WIDGET_HTML, ticket_id=ticket_id)
 
 # ============================================================================
 # RUN SERVER
@@ -660,7 +555,13 @@ if __name__ == '__main__':
     logger.info("Endpoints:")
     logger.info("  GET  /health                  - Health check")
     logger.info("  POST /api/suggest             - Generate AI suggestion")
+    logger.info("  POST /api/suggest/jobs        - Queue AI suggestion (returns job id)")
+    logger.info("  GET  /api/suggest/jobs/<id>   - Poll suggestion job")
+    logger.info("  GET  /api/suggest/stream/<id> - Stream AI suggestion (SSE)")
+    logger.info("  POST /api/webhooks/gorgias    - Pre-generate on Gorgias ticket events")
     logger.info("  POST /api/feedback            - Record feedback")
+    logger.info("  GET  /api/feedback/stats      - Acceptance rate by brand/intent/day")
+    logger.info("  GET  /metrics                 - Prometheus metrics")
     logger.info("  GET  /widget/<ticket_id>      - Widget interface")
     logger.info("")
     logger.info("="*60)
@@ -0,0 +1,426 @@
+"""
+Gorgias Widget API Server (asyncio)
+Quart variant of API_widget_server with non-blocking OpenAI and Gorgias I/O,
+so one process keeps hundreds of suggestion requests in flight.
+
+Run with:
+    hypercorn API_widget_server_async:app --bind 0.0.0.0:$PORT
+"""
+
+from quart import Quart, request, jsonify, render_template_string, Response
+from quart_cors import cors
+import os
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from improved_response_generator import generate_response_async, generate_response_stream_async
+from gorgias_client import AsyncGorgiasClient, client_settings_from_env
+from openai_limiter import get_limiter
+from response_memo import get_response_memo
+from semantic_cache import get_semantic_cache
+from reply_index import get_reply_index
+from pipeline_metrics import PipelineTrace, get_metrics, record_suggestion
+from feedback_store import get_feedback_store
+from suggestion_cache import create_suggestion_store, make_cache_key
+from suggestion_jobs import save_job, create_job_store
+
+# Ticket parsing, response shaping and the widget page are the same as the sync server
+from widget_common import (
+    WIDGET_HTML,
+    GENERATION_LEASE_SECONDS,
+    merge_ticket_messages,
+    update_ticket_input,
+    build_response_data,
+    with_request_metrics,
+    store_feedback,
+    feedback_stats,
+    sse_event
+)
+
+# Initialize Quart
+app = cors(Quart(__name__))
+
+# Logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Max background suggestion jobs per process before /api/suggest/jobs returns 503
+MAX_BACKGROUND_JOBS = int(os.getenv('SUGGESTION_JOB_QUEUE_SIZE', 50)) * 4
+
+# Same SUGGESTION_STORE configuration as the sync server, so both can share the SQLite file
+suggestions_cache = create_suggestion_store()
+job_store = create_job_store()
+
+gorgias = None
+in_flight = {}  # cache_key -> asyncio.Task generating that suggestion
+background_jobs = set()
+active_jobs = {}  # ticket_id -> job_id, for jobs not finished yet
+
+@app.before_serving
+async def startup():
+    global gorgias
+    gorgias = AsyncGorgiasClient(**client_settings_from_env())
+
+@app.after_serving
+async def shutdown():
+    await gorgias.aclose()
+
+# ============================================================================
+# SUGGESTION PIPELINE
+# ============================================================================
+# The suggestion and job stores are synchronous (SQLite waits up to busy_timeout on a
+# locked file), so their calls run in a worker thread to keep the event loop free.
+
+async def load_ticket_context(ticket_id):
+    """Fetch ticket and its message thread concurrently"""
+    ticket_data, messages_data = await asyncio.gather(
+        gorgias.get_json(f"tickets/{ticket_id}"),
+        gorgias.get_json(f"tickets/{ticket_id}/messages")
+    )
+    return merge_ticket_messages(ticket_data, messages_data)
+
+async def resolve_ticket_input(ticket_id, data, trace=None):
+    """Combine request fields with ticket data from Gorgias when the message is missing"""
+    trace = trace or PipelineTrace()
+    ticket_input = {
+        'customer_name': data.get('customer_name', ''),
+        'message': data.get('message', ''),
+        'order_number': data.get('order_number', ''),
+        'subject': data.get('subject', '')
+    }
+
+    if not ticket_input['message']:
+        with trace.stage('gorgias_fetch'):
+            ticket_data = await load_ticket_context(ticket_id)
+        update_ticket_input(ticket_input, ticket_data)
+
+    return ticket_input
+
+async def generate_suggestion(ticket_id, ticket_input, cache_key, trace=None):
+    """Generate a suggestion with the AI model and cache it"""
+    result = await generate_response_async(
+        customer_message=ticket_input['message'],
+        customer_name=ticket_input['customer_name'],
+        order_number=ticket_input['order_number'],
+        subject=ticket_input['subject'],
+        trace=trace
+    )
+
+    if not result:
+        return None
+
+    response_data = build_response_data(ticket_id, result)
+    await asyncio.to_thread(suggestions_cache.set, cache_key, response_data)
+
+    logger.info(f"Generated suggestion for {ticket_id} - Quality: {result['quality_score']} - "
+                f"{result['metrics']['timings_ms']['total']:.0f}ms")
+
+    return response_data
+
+async def wait_for_other_worker(cache_key):
+    """Poll the shared store while another worker holds the generation lease"""
+    deadline = asyncio.get_running_loop().time() + GENERATION_LEASE_SECONDS
+    while asyncio.get_running_loop().time() < deadline:
+        value = await asyncio.to_thread(suggestions_cache.peek, cache_key)
+        if value is not None:
+            return value
+        if not await asyncio.to_thread(suggestions_cache.lease_active, cache_key):
+            return await asyncio.to_thread(suggestions_cache.peek, cache_key)
+        await asyncio.sleep(0.25)
+    return None
+
+async def generate_once(ticket_id, ticket_input, cache_key, trace):
+    """Generate under the store lease, or reuse another worker's result"""
+    if await asyncio.to_thread(suggestions_cache.acquire_lease, cache_key, GENERATION_LEASE_SECONDS):
+        try:
+            return await generate_suggestion(ticket_id, ticket_input, cache_key, trace)
+        finally:
+            await asyncio.to_thread(suggestions_cache.release_lease, cache_key)
+
+    logger.info(f"Waiting for in-flight suggestion for {ticket_id} from another worker")
+    shared = await wait_for_other_worker(cache_key)
+    if shared:
+        trace.hit('coalesced')
+        shared['cached'] = True
+        return shared
+    return await generate_suggestion(ticket_id, ticket_input, cache_key, trace)
+
+async def get_or_generate_suggestion(ticket_id, ticket_input, trace=None):
+    """Return the cached suggestion or generate it exactly once (concurrent callers share the task)"""
+    trace = trace or PipelineTrace()
+    cache_key = make_cache_key(ticket_id, ticket_input['message'])
+    with trace.stage('cache_lookup'):
+        cached = await asyncio.to_thread(suggestions_cache.get, cache_key)
+    trace.hit('suggestion_store', bool(cached))
+    if cached:
+        logger.info(f"Returning cached suggestion for {ticket_id}")
+        cached['cached'] = True
+        return cached
+
+    task = in_flight.get(cache_key)
+    if task:
+        logger.info(f"Coalesced suggestion request for {ticket_id} with in-flight generation")
+        trace.hit('coalesced')
+        response_data = await asyncio.shield(task)
+        if response_data:
+            return dict(response_data, cached=True)
+
+        # The call we waited on gave up (stream client disconnected or generation failed) - generate again,
+        # unless another waiter already started that
+        logger.info(f"In-flight suggestion for {ticket_id} returned nothing - generating again")
+        task = in_flight.get(cache_key)
+        if task:
+            response_data = await asyncio.shield(task)
+            return dict(response_data, cached=True) if response_data else None
+
+    task = asyncio.ensure_future(generate_once(ticket_id, ticket_input, cache_key, trace))
+    in_flight[cache_key] = task
+    task.add_done_callback(lambda _: in_flight.pop(cache_key, None))
+
+    # Shield so a disconnecting client doesn't cancel the generation other callers wait on
+    return await asyncio.shield(task)
+
+async def run_suggestion_job(job_id, ticket_id, data):
+    """Background job: resolve ticket input and generate (or reuse) the suggestion"""
+    await asyncio.to_thread(save_job, job_store, job_id, ticket_id, 'running')
+    try:
+        trace = PipelineTrace()
+        ticket_input = await resolve_ticket_input(ticket_id, data, trace)
+
+        if not ticket_input['message']:
+            raise ValueError('No message found')
+
+        response_data = await get_or_generate_suggestion(ticket_id, ticket_input, trace)
+        record_suggestion(trace, 'job', response_data)
+
+        if not response_data:
+            raise RuntimeError('Failed to generate response')
+
+        await asyncio.to_thread(save_job, job_store, job_id, ticket_id, 'done',
+                                result=with_request_metrics(response_data, trace))
+    except Exception as e:
+        logger.error(f"Suggestion job {job_id} for ticket {ticket_id} failed: {str(e)}", exc_info=True)
+        await asyncio.to_thread(save_job, job_store, job_id, ticket_id, 'error', error=str(e))
+    finally:
+        if active_jobs.get(ticket_id) == job_id:
+            del active_jobs[ticket_id]
+
+async def stream_suggestion_events(ticket_id, ticket_input, trace=None):
+    """SSE events: 'delta' per streamed chunk, then 'done' or 'failed'"""
+    trace = trace or PipelineTrace()
+    if not ticket_input['message']:
+        yield sse_event('failed', {'error': 'No message found'})
+        return
+
+    cache_key = make_cache_key(ticket_id, ticket_input['message'])
+    with trace.stage('cache_lookup'):
+        cached = await asyncio.to_thread(suggestions_cache.get, cache_key)
+    trace.hit('suggestion_store', bool(cached))
+    if cached:
+        cached['cached'] = True
+        record_suggestion(trace, 'stream', cached)
+        yield sse_event('done', with_request_metrics(cached, trace))
+        return
+
+    # Someone is already generating this suggestion - wait for it instead of streaming a duplicate
+    if cache_key in in_flight or not await asyncio.to_thread(
+            suggestions_cache.acquire_lease, cache_key, GENERATION_LEASE_SECONDS):
+        response_data = await get_or_generate_suggestion(ticket_id, ticket_input, trace)
+        record_suggestion(trace, 'stream', response_data)
+        if response_data:
+            yield sse_event('done', with_request_metrics(response_data, trace))
+        else:
+            yield sse_event('failed', {'error': 'Failed to generate response'})
+        return
+
+    # Register the stream so concurrent requests for this key wait on it instead of generating
+    flight = asyncio.get_running_loop().create_future()
+    in_flight[cache_key] = flight
+
+    response_data = None
+    try:
+        async for kind, payload in generate_response_stream_async(
+            customer_message=ticket_input['message'],
+            customer_name=ticket_input['customer_name'],
+            order_number=ticket_input['order_number'],
+            subject=ticket_input['subject'],
+            trace=trace
+        ):
+            if kind == 'delta':
+                yield sse_event('delta', {'text': payload})
+            elif kind == 'done':
+                response_data = build_response_data(ticket_id, payload)
+                await asyncio.to_thread(suggestions_cache.set, cache_key, response_data)
+                logger.info(f"Streamed suggestion for {ticket_id} - Quality: {payload['quality_score']}")
+                yield sse_event('done', with_request_metrics(response_data, trace))
+            else:
+                yield sse_event('failed', {'error': payload})
+    finally:
+        in_flight.pop(cache_key, None)
+        try:
+            await asyncio.to_thread(suggestions_cache.release_lease, cache_key)
+        finally:
+            # Wake waiters even if the release was interrupted
+            flight.set_result(response_data)
+            record_suggestion(trace, 'stream', response_data)
+
+# ============================================================================
+# API ENDPOINTS
+# ============================================================================
+
+def store_stats():
+    """Health fields that read the SQLite-backed stores"""
+    return {
+        'cache': suggestions_cache.stats(),
+        'response_memo': get_response_memo().stats(),
+        'semantic_cache': get_semantic_cache().stats() if get_semantic_cache() else None,
+        'reply_index': get_reply_index().stats() if get_reply_index() else None,
+        'feedback': get_feedback_store().stats()
+    }
+
+@app.route('/health', methods=['GET'])
+async def health():
+    """Health check"""
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'in_flight': len(in_flight),
+        'background_jobs': len(background_jobs),
+        'gorgias': gorgias.stats() if gorgias else {},
+        'openai': get_limiter().stats(),
+        **await asyncio.to_thread(store_stats)
+    })
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus metrics (same series as the sync server)"""
+    metrics = get_metrics()
+    openai_stats = get_limiter().stats()
+    metrics.set_gauge('openai_in_flight', openai_stats['in_flight'], 'OpenAI requests in flight')
+    metrics.set_gauge('openai_queued', openai_stats['queued'], 'OpenAI requests waiting for the limiter')
+    metrics.set_gauge('suggestion_jobs_active', len(background_jobs), 'Suggestion jobs queued or running')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/suggest', methods=['POST'])
+async def suggest_response():
+    """Generate AI suggestion for a ticket (same JSON as the sync server)"""
+    try:
+        data = await request.get_json() or {}
+        ticket_id = data.get('ticket_id')
+
+        if not ticket_id:
+            return jsonify({'error': 'ticket_id required'}), 400
+
+        logger.info(f"Generating suggestion for ticket {ticket_id}")
+
+        trace = PipelineTrace()
+        ticket_input = await resolve_ticket_input(ticket_id, data, trace)
+
+        if not ticket_input['message']:
+            return jsonify({'error': 'No message found'}), 400
+
+        response_data = await get_or_generate_suggestion(ticket_id, ticket_input, trace)
+        record_suggestion(trace, 'suggest', response_data)
+
+        if not response_data:
+            return jsonify({'error': 'Failed to generate response'}), 500
+
+        return jsonify(with_request_metrics(response_data, trace))
+
+    except Exception as e:
+        logger.error(f"Error in suggest_response: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/suggest/jobs', methods=['POST'])
+async def submit_suggestion_job():
+    """Queue suggestion generation as an asyncio task and return a job id immediately"""
+    data = await request.get_json() or {}
+    ticket_id = data.get('ticket_id')
+
+    if not ticket_id:
+        return jsonify({'error': 'ticket_id required'}), 400
+
+    # Submitting twice for a ticket while its job is pending returns the same job
+    # (active_jobs only holds unfinished jobs and is claimed before the first await)
+    job_id = active_jobs.get(ticket_id)
+    if job_id:
+        job = await asyncio.to_thread(job_store.peek, job_id) or {'status': 'pending'}
+    else:
+        if len(background_jobs) >= MAX_BACKGROUND_JOBS:
+            return jsonify({'error': 'Suggestion queue full'}), 503, {'Retry-After': '2'}
+
+        job_id = uuid.uuid4().hex
+        active_jobs[ticket_id] = job_id
+        job = await asyncio.to_thread(save_job, job_store, job_id, ticket_id, 'pending')
+
+        task = asyncio.create_task(run_suggestion_job(job_id, ticket_id, data))
+        background_jobs.add(task)
+        task.add_done_callback(background_jobs.discard)
+
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'],
+        'status_url': f"/api/suggest/jobs/{job_id}"
+    }), 202
+
+@app.route('/api/suggest/jobs/<job_id>', methods=['GET'])
+async def suggestion_job_status(job_id):
+    """Return job status, plus the suggestion once the job is done"""
+    job = await asyncio.to_thread(job_store.peek, job_id)
+
+    if not job:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+
+    return jsonify(job)
+
+@app.route('/api/suggest/stream/<ticket_id>', methods=['GET'])
+async def stream_suggestion(ticket_id):
+    """Stream an AI suggestion as Server-Sent Events"""
+    logger.info(f"Streaming suggestion for ticket {ticket_id}")
+
+    data = request.args.to_dict()
+
+    async def events():
+        try:
+            trace = PipelineTrace()
+            ticket_input = await resolve_ticket_input(ticket_id, data, trace)
+            async for event in stream_suggestion_events(ticket_id, ticket_input, trace):
+                yield event
+        except Exception as e:
+            logger.error(f"Error in stream_suggestion: {str(e)}", exc_info=True)
+            yield sse_event('failed', {'error': str(e)})
+
+    response = Response(
+        events(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.timeout = None
+    return response
+
+@app.route('/api/feedback', methods=['POST'])
+async def record_feedback():
+    """Record agent feedback on suggestions (same JSON as the sync server; queued, never waits on disk)"""
+    body, status = store_feedback(await request.get_json() or {})
+    return jsonify(body), status
+
+@app.route('/api/feedback/stats', methods=['GET'])
+async def get_feedback_stats():
+    """Acceptance rate by brand/intent/day, read from the feedback counters"""
+    body, status = feedback_stats(request.args)
+    return jsonify(body), status
+
+@app.route('/widget/<ticket_id>', methods=['GET'])
+async def widget(ticket_id):
+    """Gorgias sidebar widget - same page as the sync server"""
+    return await render_template_string(WIDGET_HTML, ticket_id=ticket_id)
+
+# ============================================================================
+# RUN SERVER
+# ============================================================================
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5000))
+    logger.info(f"🚀 Gorgias AI Widget Server (asyncio) on port {port}")
+    app.run(host='0.0.0.0', port=port)
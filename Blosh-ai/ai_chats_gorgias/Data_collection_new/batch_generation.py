@@ -0,0 +1,302 @@
+"""
+Batch Generation
+Offline generate_response over thousands of tickets through the OpenAI Batch
+API (half price, 24h window) instead of one request per ticket.
+
+Steps:
+    python batch_generation.py build tickets.jsonl batch_dir/      # prompts -> requests.jsonl
+    python batch_generation.py submit batch_dir/                   # upload + create batch
+    python batch_generation.py fetch batch_dir/                    # download output when done
+    python batch_generation.py ingest batch_dir/                   # fixes + quality check -> results.jsonl
+    python batch_generation.py run tickets.jsonl batch_dir/ --mock # all of the above, local mock
+
+Tickets are JSONL or CSV with: ticket_id, message, customer_name, order_number, email, subject
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import datetime
+
+from improved_response_generator import (
+    client,
+    FINETUNED_MODEL_ID,
+    COMPLETION_PARAMS,
+    prepare_generation,
+    finalize_response
+)
+
+REQUESTS_FILE = 'requests.jsonl'
+PREPARED_FILE = 'prepared.jsonl'
+OUTPUT_FILE = 'output.jsonl'
+RESULTS_FILE = 'results.jsonl'
+STATE_FILE = 'batch.json'
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+
+# ============================================================================
+# FILE HELPERS
+# ============================================================================
+
+def read_tickets(path):
+    """Tickets from a JSONL or CSV file"""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def write_jsonl(path, items):
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def load_state(batch_dir):
+    with open(os.path.join(batch_dir, STATE_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(batch_dir, state):
+    with open(os.path.join(batch_dir, STATE_FILE), 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+# ============================================================================
+# BUILD
+# ============================================================================
+
+def build_batch(tickets_path, batch_dir, model_id=FINETUNED_MODEL_ID):
+    """Write Batch API requests plus the prepared context needed at ingest"""
+    os.makedirs(batch_dir, exist_ok=True)
+    tickets = read_tickets(tickets_path)
+
+    requests_out = []
+    prepared_out = []
+    seen_ids = set()
+    for i, ticket in enumerate(tickets):
+        message = (ticket.get('message') or '').strip()
+        if not message:
+            continue
+
+        # The Batch API needs unique custom_ids; a ticket listed twice gets its row index appended
+        ticket_id = str(ticket.get('ticket_id') or f"row-{i}")
+        custom_id = ticket_id if ticket_id not in seen_ids else f"{ticket_id}-row-{i}"
+        seen_ids.add(custom_id)
+        customer_name = ticket.get('customer_name') or ''
+        prepared = prepare_generation(
+            message,
+            customer_name,
+            ticket.get('order_number') or None,
+            ticket.get('email'),
+            ticket.get('subject')
+        )
+
+        requests_out.append({
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': {'model': model_id, 'messages': prepared['messages'], **COMPLETION_PARAMS}
+        })
+        prepared_out.append({
+            'custom_id': custom_id,
+            'ticket_id': ticket_id,
+            'customer_message': message,
+            'customer_name': customer_name,
+            'prepared': {k: prepared[k] for k in ('brand', 'context', 'order_number')}
+        })
+
+    count = write_jsonl(os.path.join(batch_dir, REQUESTS_FILE), requests_out)
+    write_jsonl(os.path.join(batch_dir, PREPARED_FILE), prepared_out)
+    print(f"Built {count} requests from {len(tickets)} tickets → {batch_dir}")
+    return count
+
+# ============================================================================
+# SUBMIT / FETCH
+# ============================================================================
+
+def submit_batch(batch_dir, batch_client=None):
+    """Upload requests.jsonl and create the batch job"""
+    batch_client = batch_client or client
+    with open(os.path.join(batch_dir, REQUESTS_FILE), 'rb') as f:
+        input_file = batch_client.files.create(file=f, purpose='batch')
+
+    batch = batch_client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window='24h'
+    )
+    save_state(batch_dir, {'batch_id': batch.id, 'input_file_id': input_file.id,
+                           'submitted': datetime.now().isoformat()})
+    print(f"Submitted batch {batch.id}")
+    return batch.id
+
+def fetch_batch(batch_dir, batch_client=None, wait=False, poll_seconds=60):
+    """Download the output file once the batch completed; returns the batch status"""
+    batch_client = batch_client or client
+    state = load_state(batch_dir)
+
+    while True:
+        batch = batch_client.batches.retrieve(state['batch_id'])
+        print(f"Batch {batch.id}: {batch.status}")
+        if batch.status == 'completed' or not wait or batch.status in ('failed', 'expired', 'cancelled'):
+            break
+        time.sleep(poll_seconds)
+
+    if batch.status == 'completed' and batch.output_file_id:
+        content = batch_client.files.content(batch.output_file_id)
+        with open(os.path.join(batch_dir, OUTPUT_FILE), 'w', encoding='utf-8') as f:
+            f.write(content.text)
+        state['output_file_id'] = batch.output_file_id
+        save_state(batch_dir, state)
+        print(f"Saved output → {os.path.join(batch_dir, OUTPUT_FILE)}")
+
+    return batch.status
+
+# ============================================================================
+# INGEST
+# ============================================================================
+
+def ingest_batch(batch_dir):
+    """Run validate_and_fix_response + check_response_quality over all outputs"""
+    prepared_by_id = {item['custom_id']: item for item in read_jsonl(os.path.join(batch_dir, PREPARED_FILE))}
+
+    results = []
+    failed = 0
+    for line in read_jsonl(os.path.join(batch_dir, OUTPUT_FILE)):
+        item = prepared_by_id.get(line['custom_id'])
+        response = line.get('response') or {}
+        if item is None or line.get('error') or response.get('status_code') != 200:
+            failed += 1
+            continue
+
+        generated_text = response['body']['choices'][0]['message']['content']
+        result = finalize_response(generated_text, item['customer_message'], item['customer_name'], item['prepared'])
+        result['ticket_id'] = item.get('ticket_id', line['custom_id'])
+        results.append(result)
+
+    write_jsonl(os.path.join(batch_dir, RESULTS_FILE), results)
+
+    approved = sum(1 for r in results if r['approved'])
+    avg_quality = sum(r['quality_score'] for r in results) / len(results) if results else 0
+    print(f"Ingested {len(results)} responses ({failed} failed)")
+    if results:
+        print(f"  Approved: {approved}/{len(results)} ({approved / len(results):.0%})")
+        print(f"  Average quality: {avg_quality:.1f}/100")
+    return results
+
+# ============================================================================
+# LOCAL MOCK
+# ============================================================================
+
+class MockBatchClient:
+    """
+    Stand-in for client.files / client.batches that completes batches locally
+    with a canned reply, for testing the pipeline without API calls.
+    """
+
+    def __init__(self, reply="Bedankt voor je bericht. We gaan dit voor je uitzoeken."):
+        self.files = _MockFiles()
+        self.batches = _MockBatches(self.files, reply)
+
+class _MockFiles:
+    def __init__(self):
+        self._contents = {}
+
+    def create(self, file, purpose):
+        return self.add(file.read().decode('utf-8'))
+
+    def add(self, text):
+        file_id = f"file-mock-{len(self._contents) + 1}"
+        self._contents[file_id] = text
+        return _Obj(id=file_id)
+
+    def content(self, file_id):
+        return _Obj(text=self._contents[file_id])
+
+class _MockBatches:
+    def __init__(self, files, reply):
+        self._files = files
+        self._reply = reply
+        self._batches = {}
+
+    def create(self, input_file_id, endpoint, completion_window):
+        lines = []
+        for line in self._files.content(input_file_id).text.splitlines():
+            request = json.loads(line)
+            lines.append(json.dumps({
+                'id': f"batch_req_{request['custom_id']}",
+                'custom_id': request['custom_id'],
+                'response': {
+                    'status_code': 200,
+                    'body': {'model': request['body']['model'],
+                             'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self._reply}}]}
+                },
+                'error': None
+            }, ensure_ascii=False))
+        output = self._files.add('\n'.join(lines) + '\n')
+
+        batch = _Obj(id=f"batch-mock-{len(self._batches) + 1}", status='completed', output_file_id=output.id)
+        self._batches[batch.id] = batch
+        return batch
+
+    def retrieve(self, batch_id):
+        return self._batches[batch_id]
+
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch response generation via the OpenAI Batch API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Build requests.jsonl from tickets')
+    build.add_argument('tickets')
+    build.add_argument('batch_dir')
+    build.add_argument('--model', default=FINETUNED_MODEL_ID)
+
+    for name, help_text in [('submit', 'Upload and create the batch'),
+                            ('fetch', 'Download results if the batch is done'),
+                            ('ingest', 'Fix + quality check the batch output')]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('batch_dir')
+        if name == 'fetch':
+            command.add_argument('--wait', action='store_true', help='Poll until the batch finishes')
+
+    run = commands.add_parser('run', help='build + submit + wait + fetch + ingest')
+    run.add_argument('tickets')
+    run.add_argument('batch_dir')
+    run.add_argument('--model', default=FINETUNED_MODEL_ID)
+    run.add_argument('--mock', action='store_true', help='Use the local mock instead of the Batch API')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_batch(args.tickets, args.batch_dir, args.model)
+    elif args.command == 'submit':
+        submit_batch(args.batch_dir)
+    elif args.command == 'fetch':
+        fetch_batch(args.batch_dir, wait=args.wait)
+    elif args.command == 'ingest':
+        ingest_batch(args.batch_dir)
+    elif args.command == 'run':
+        batch_client = MockBatchClient() if args.mock else None
+        if build_batch(args.tickets, args.batch_dir, args.model):
+            submit_batch(args.batch_dir, batch_client)
+            if fetch_batch(args.batch_dir, batch_client, wait=True) == 'completed':
+                ingest_batch(args.batch_dir)
+
+if __name__ == "__main__":
+    main()
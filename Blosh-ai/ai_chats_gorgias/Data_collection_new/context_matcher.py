@@ -0,0 +1,165 @@
+"""
+Context Matcher
+One precompiled regex that finds every lexicon keyword and order number in a
+single pass over the lowercased text. Used by extract_context (customer message) and by
+validate_and_fix_response / check_response_quality (model response), so adding
+an intent to the lexicon adds no extra scans per message.
+
+Run directly for a micro-benchmark against the old per-keyword scans:
+    python context_matcher.py
+With the default lexicon both are within a few microseconds per message; the
+per-keyword scans grow with every keyword added, the single pass does not.
+"""
+
+import json
+import os
+import re
+import threading
+
+# intent -> keywords (case-insensitive substring match, like `word in text.lower()`)
+DEFAULT_LEXICON = {
+    # Customer message signals
+    'photo': ['foto', 'photo', 'afbeelding', 'bijlage', 'attachment'],
+    'defect': ['defect', 'kapot', 'beschadigd', 'kwaliteit', 'pilt', 'quality', 'broken'],
+    'return': ['retour', 'return', 'terugsturen', 'terug sturen'],
+    'late_return': ['14 dagen', '15 dagen', 'te laat', 'verlopen', 'expired'],
+
+    # Response signals
+    'photo_request': ['foto', 'photo'],
+    'order_number_request': ['ordernummer'],
+    'order_number_denied': ['ordernummer klopt niet', 'ordernummer is niet']
+}
+
+# Freebird (102xxxxxx) and Simple (203xxxxx) order numbers
+ORDER_NUMBER_PATTERN = r'\b(?:102\d{6}|203\d{5})\b'
+
+# Same match as ORDER_NUMBER_PATTERN, but the word-boundary check only runs after
+# a leading 1/2 instead of at every position of the text
+_ORDER_NUMBER_SCAN = r'(?:1(?<!\w1)02\d{6}|2(?<!\w2)03\d{5})\b'
+
+def _trie_regex(words):
+    """
+    Regex alternation factored into a prefix trie ("foto|fout" -> "fo(?:to|ut)"),
+    so the engine rejects most positions after one character instead of trying
+    every keyword. Longest keyword wins at each position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        end = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if end else body
+
+    return build(trie) if trie else '(?!)'
+
+class ContextMatcher:
+    """Compiled keyword + order number matcher for a lexicon"""
+
+    def __init__(self, lexicon=None):
+        self.lexicon = {intent: list(words) for intent, words in (lexicon or DEFAULT_LEXICON).items()}
+
+        # keyword -> intents; a keyword also carries the intents of keywords it contains,
+        # because the regex reports only the longest match at each position
+        self._intents = {}
+        for intent, words in self.lexicon.items():
+            for word in words:
+                self._intents.setdefault(word.lower(), set()).add(intent)
+        for word in self._intents:
+            for other, intents in self._intents.items():
+                if other != word and other in word:
+                    self._intents[word] = self._intents[word] | intents
+
+        # Applied to lowercased text. The lookahead matches zero-width, so a keyword that
+        # overlaps the previous one ('defecterugsturen') is still found; findall()
+        # returns the one group
+        self._regex = re.compile(f'(?=({_trie_regex(self._intents)}|{_ORDER_NUMBER_SCAN}))')
+
+    def scan(self, text):
+        """Return {'intents': set of matched intents, 'order_number': first order number or None}"""
+        intents = set()
+        order_number = None
+
+        for token in self._regex.findall((text or '').lower()):
+            found = self._intents.get(token)
+            if found:
+                intents |= found
+            elif order_number is None:
+                order_number = token
+
+        return {'intents': intents, 'order_number': order_number}
+
+# ============================================================================
+# SHARED MATCHER
+# ============================================================================
+
+def load_lexicon(path=None):
+    """DEFAULT_LEXICON extended/overridden by a JSON file of {intent: [keywords]}"""
+    lexicon = {intent: list(words) for intent, words in DEFAULT_LEXICON.items()}
+    path = path or os.getenv('CONTEXT_LEXICON_PATH')
+    if path:
+        with open(path, encoding='utf-8') as f:
+            lexicon.update(json.load(f))
+    return lexicon
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+def get_context_matcher():
+    """Process-wide matcher for the configured lexicon (CONTEXT_LEXICON_PATH)"""
+    global _matcher
+    with _matcher_lock:
+        if _matcher is None:
+            _matcher = ContextMatcher(load_lexicon())
+        return _matcher
+
+# ============================================================================
+# MICRO-BENCHMARK
+# ============================================================================
+
+def _scan_naive(text, lexicon):
+    """The previous approach: one substring scan per keyword plus a regex"""
+    lower = text.lower()
+    intents = {intent for intent, words in lexicon.items() if any(word in lower for word in words)}
+    match = re.search(ORDER_NUMBER_PATTERN, text)
+    return {'intents': intents, 'order_number': match.group(0) if match else None}
+
+def main():
+    import timeit
+
+    messages = [
+        "Goedemorgen, Hierbij de foto's van de trui.",
+        "Ik heb 4 truien bij jullie gekocht ordernr 20340520 en 1 trui gaat na 2x dragen al ontzettend pillen. "
+        "Dat moet toch niet zo zijn met een trui van €99,99?",
+        "Ik wil graag een deel van bestelling 10243011 retoureren. Nu probeer ik de retourzending aan te melden, "
+        "maar krijg ik een foutmelding.",
+        "Hoi! Mijn pakket is nog steeds niet aangekomen, kunnen jullie kijken waar het blijft? " * 5
+    ]
+
+    matcher = ContextMatcher()
+    for message in messages:
+        assert matcher.scan(message) == _scan_naive(message, DEFAULT_LEXICON), message
+
+    # A larger lexicon shows how the per-keyword approach scales with new intents
+    big_lexicon = dict(DEFAULT_LEXICON)
+    for i in range(30):
+        big_lexicon[f'intent_{i}'] = [f'keyword{i}a', f'keyword{i}b', f'sleutelwoord{i}']
+    big_matcher = ContextMatcher(big_lexicon)
+
+    runs = 20000
+    print(f"{runs} scans x {len(messages)} messages")
+    for label, lexicon, compiled in [('default lexicon', DEFAULT_LEXICON, matcher),
+                                     ('37 intents', big_lexicon, big_matcher)]:
+        naive = timeit.timeit(lambda: [_scan_naive(m, lexicon) for m in messages], number=runs)
+        single = timeit.timeit(lambda: [compiled.scan(m) for m in messages], number=runs)
+        print(f"  {label:16} naive {naive / runs * 1e6:7.1f} µs   compiled {single / runs * 1e6:7.1f} µs")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Build the reply retrieval index from cleaned conversations.
+
+Reads a cleaned_tickets_*.csv produced by clean_and_prepare_data.py, turns
+every agent reply into an exchange with the customer message(s) before it,
+masks customer names and order numbers, and writes the index used by
+improved_response_generator for few-shot examples.
+
+Usage:
+    python build_reply_index.py cleaned_tickets_20251028_101500.csv [output_dir]
+"""
+
+import json
+import os
+import sys
+
+import pandas as pd
+
+# Index format and masking live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from reply_index import save_index, DEFAULT_INDEX_DIR
+from response_memo import mask_personal
+
+# Long replies make poor examples and bloat the prompt
+MAX_CUSTOMER_CHARS = 600
+MAX_AGENT_CHARS = 900
+
+
+def extract_exchanges(df: pd.DataFrame) -> list:
+    """Customer message(s) + following agent reply, one exchange per agent reply"""
+    exchanges = []
+
+    for _, row in df.iterrows():
+        try:
+            messages = json.loads(row['conversation_thread'])
+        except (json.JSONDecodeError, TypeError):
+            continue
+
+        firstname = row.get('customer_firstname', '')
+        firstname = '' if pd.isna(firstname) else str(firstname).strip()
+
+        customer_parts = []
+        for msg in messages:
+            text = (msg.get('message') or '').strip()
+            if not text:
+                continue
+
+            if msg.get('sender') == 'CUSTOMER':
+                customer_parts.append(text)
+                continue
+
+            if msg.get('sender') == 'AGENT' and customer_parts:
+                customer = mask_personal('\n'.join(customer_parts), firstname)
+                agent = mask_personal(text, firstname)
+                if len(customer) <= MAX_CUSTOMER_CHARS and len(agent) <= MAX_AGENT_CHARS:
+                    exchanges.append({
+                        'ticket_id': str(row.get('ticket_id', '')),
+                        'channel': str(row.get('channel', '')),
+                        'customer': customer,
+                        'agent': agent
+                    })
+                customer_parts = []
+
+    return exchanges
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    cleaned_csv = sys.argv[1]
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_DIR
+
+    print(f"Loading {cleaned_csv}...")
+    df = pd.read_csv(cleaned_csv)
+    print(f"  Loaded {len(df)} conversations")
+
+    exchanges = extract_exchanges(df)
+    print(f"  Extracted {len(exchanges)} customer/agent exchanges")
+
+    count = save_index(exchanges, output_dir)
+    print(f"Saved index with {count} exchanges to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
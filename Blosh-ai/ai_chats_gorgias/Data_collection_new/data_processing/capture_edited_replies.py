@@ -0,0 +1,218 @@
+"""
+Capture the replies agents actually sent after using a suggestion.
+
+For every ticket with recent "edited" feedback (optionally also "used"), pulls
+the thread from Gorgias, takes each agent reply sent after the feedback, diffs
+it against the cached suggestion for the customer message it answers, and
+appends the conversation as an incremental JSONL shard in the same
+{"messages": [...]} format as create_training_json. A manifest next to the
+shards records the message ids already captured, so re-runs never duplicate
+an example.
+
+Output (default training_increments/):
+    edited_replies_YYYYMMDD_HHMMSS.jsonl        training examples
+    edited_replies_YYYYMMDD_HHMMSS.meta.jsonl   ticket/message ids, similarity, diff
+    manifest.json                               captured message ids + shard list
+
+Usage:
+    python capture_edited_replies.py [--hours 24] [--include-used] [--every 30]
+
+Run it at least as often as SUGGESTION_CACHE_TTL (default 1 hour) so the
+suggestion is still cached for the diff; replies are captured either way.
+"""
+
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Shared clients and stores live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gorgias_client import get_default_client
+from feedback_store import get_feedback_store
+from suggestion_cache import create_suggestion_store, make_cache_key
+
+from clean_and_prepare_data import clean_conversation_thread, clean_chat_chains, thread_to_training_example
+
+DEFAULT_OUTPUT_DIR = 'training_increments'
+MANIFEST_FILE = 'manifest.json'
+
+# Agents may send the reply shortly before clicking the feedback button
+SEND_WINDOW = timedelta(minutes=30)
+
+
+# ============================================================================
+# MANIFEST
+# ============================================================================
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'message_ids': [], 'shards': []}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    """Write the manifest atomically so a crash never leaves it half written"""
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+# ============================================================================
+# THREAD -> EXAMPLES
+# ============================================================================
+
+def parse_datetime(value):
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def to_thread(messages):
+    """Gorgias messages -> conversation_thread entries (same shape as collect_mail_data)"""
+    thread = []
+    for msg in sorted(messages, key=lambda m: m.get('created_datetime') or ''):
+        # Internal notes are never part of the conversation with the customer
+        if not msg.get('public', True):
+            continue
+        thread.append({
+            "sender": "AGENT" if msg.get('from_agent', False) else "CUSTOMER",
+            "message": msg.get('body_text', '') or '',
+            "timestamp": msg.get('created_datetime', ''),
+            "message_id": msg.get('id', '')
+        })
+    return thread
+
+
+def suggestion_diff(suggestion, reply):
+    """Similarity ratio and unified diff between the suggestion and the sent reply"""
+    return {
+        'similarity': round(difflib.SequenceMatcher(None, suggestion, reply).ratio(), 3),
+        'diff': list(difflib.unified_diff(
+            suggestion.splitlines(), reply.splitlines(), 'suggestion', 'sent', lineterm=''
+        ))
+    }
+
+
+def capture_ticket(ticket_id, feedback_at, gorgias, suggestions, seen_ids):
+    """(training example, meta) pairs for agent replies on one ticket not captured yet"""
+    ticket = gorgias.get_json(f"tickets/{ticket_id}") or {}
+    messages = (gorgias.get_json(f"tickets/{ticket_id}/messages") or {}).get('data') or []
+    raw_thread = to_thread(messages)
+
+    # Same cleaning as the full pipeline; keeps message_id on every entry
+    thread = json.loads(clean_chat_chains(clean_conversation_thread(json.dumps(raw_thread, ensure_ascii=False))))
+    firstname = ((ticket.get('customer') or {}).get('firstname') or '').strip()
+    since = datetime.fromtimestamp(feedback_at).astimezone() - SEND_WINDOW
+
+    captured = []
+    for i, msg in enumerate(thread):
+        message_id = str(msg.get('message_id', ''))
+        if msg['sender'] != 'AGENT' or not message_id or message_id in seen_ids:
+            continue
+        sent_at = parse_datetime(msg.get('timestamp'))
+        if sent_at is None or sent_at.astimezone() < since:
+            continue
+
+        example = thread_to_training_example(thread[:i + 1], firstname)
+        if not example:
+            continue
+
+        # The suggestion was generated for the raw (uncleaned) customer message this reply answers
+        raw_index = next(j for j, raw in enumerate(raw_thread) if str(raw['message_id']) == message_id)
+        customer_message = next(
+            (raw['message'] for raw in reversed(raw_thread[:raw_index]) if raw['sender'] == 'CUSTOMER'), ''
+        )
+        cached = suggestions.peek(make_cache_key(ticket_id, customer_message)) if customer_message else None
+
+        meta = {
+            'ticket_id': str(ticket_id),
+            'message_id': message_id,
+            'sent_at': msg.get('timestamp'),
+            'suggestion_id': cached.get('suggestion_id') if cached else None,
+            'similarity': None,
+            'diff': None
+        }
+        if cached:
+            meta.update(suggestion_diff(cached['suggestion'], msg['message']))
+
+        captured.append((example, meta))
+    return captured
+
+
+# ============================================================================
+# CAPTURE RUN
+# ============================================================================
+
+def capture_edited_replies(output_dir=DEFAULT_OUTPUT_DIR, hours=24, include_used=False):
+    """Append one shard with new agent replies; returns the number of examples captured"""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    seen_ids = set(manifest['message_ids'])
+
+    feedback_types = ('edited', 'used') if include_used else ('edited',)
+    tickets = get_feedback_store().tickets_with_feedback(time.time() - hours * 3600, feedback_types)
+    print(f"{len(tickets)} tickets with {'/'.join(feedback_types)} feedback in the last {hours}h")
+
+    gorgias = get_default_client()
+    suggestions = create_suggestion_store()
+
+    examples = []
+    metas = []
+    for ticket_id, feedback_at in tickets:
+        try:
+            for example, meta in capture_ticket(ticket_id, feedback_at, gorgias, suggestions, seen_ids):
+                examples.append(example)
+                metas.append(meta)
+                seen_ids.add(meta['message_id'])
+        except Exception as e:
+            print(f"Error capturing ticket {ticket_id}: {e}")
+
+    if not examples:
+        print("No new agent replies")
+        return 0
+
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    shard = f"edited_replies_{ts}.jsonl"
+    for filename, items in [(shard, examples), (f"edited_replies_{ts}.meta.jsonl", metas)]:
+        with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
+            for item in items:
+                json.dump(item, f, ensure_ascii=False)
+                f.write('\n')
+
+    # Manifest last: if the run dies before this, the next run rewrites the same replies
+    manifest['message_ids'] = sorted(seen_ids)
+    manifest['shards'].append(shard)
+    save_manifest(output_dir, manifest)
+
+    diffed = [m['similarity'] for m in metas if m['similarity'] is not None]
+    print(f"Captured {len(examples)} replies → {os.path.join(output_dir, shard)}")
+    if diffed:
+        print(f"  Diffed against {len(diffed)} cached suggestions, average similarity {sum(diffed) / len(diffed):.2f}")
+    return len(examples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture agent-sent replies as incremental training shards")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--hours', type=float, default=24, help='Look back this far for feedback')
+    parser.add_argument('--include-used', action='store_true', help="Also capture replies marked 'used'")
+    parser.add_argument('--every', type=float, help='Repeat every N minutes')
+    args = parser.parse_args()
+
+    while True:
+        capture_edited_replies(args.output_dir, args.hours, args.include_used)
+        if not args.every:
+            break
+        time.sleep(args.every * 60)
+
+
+if __name__ == "__main__":
+    main()
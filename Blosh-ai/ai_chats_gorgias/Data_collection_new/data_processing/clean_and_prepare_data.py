@@ -7,6 +7,12 @@ This script processes raw ticket data (both email and chat channels) and:
 - Creates training datasets in JSONL format
 - Generates both single-example and multiple-example training files
 
+Raw input (CSV, JSONL or Parquet from collect_mail_data.py) is read in chunks,
+so memory use does not grow with the number of tickets.
+
+Usage:
+    python clean_and_prepare_data.py [raw_tickets.csv | raw_mail_data_*.jsonl | *.parquet]
+
 Based on the cleaning logic from 2. clean_data.ipynb
 """
 
@@ -14,11 +20,16 @@ from __future__ import annotations
 
 import json
 import re
+import sys
+from collections import Counter
 from datetime import datetime
 from pathlib import Path
 
 import pandas as pd
 
+# Raw tickets are read and processed this many rows at a time
+RAW_CHUNK_SIZE = 5000
+
 
 def clean_message_text(message: str) -> str:
     """Clean individual message content - MINIMAL cleaning to preserve authentic voice.
@@ -280,26 +291,59 @@ def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     return df_cleaned
 
 
-def create_training_json(df: pd.DataFrame, output_file: str, multiple_training_examples: bool = False) -> int:
+def training_system_message(customer_firstname: str) -> dict:
+    """System message that starts every training example."""
+    return {
+        "role": "system",
+        "content": f"Je bent Freebird klantenservice. Antwoord vriendelijk en in het Nederlands tegen {customer_firstname}. als de naam leeg is begin dan een aanhef zonder de naam"
+    }
+
+
+def thread_to_training_example(messages: list, customer_firstname: str) -> dict | None:
     """
-    Create training JSON file from conversation threads for AI model training.
+    Convert one conversation thread into a single {"messages": [...]} example.
+    A trailing customer message is dropped; returns None if the thread does not
+    end with an agent reply or has no user + assistant exchange.
+    """
+    # Remove last message if it's from customer
+    if messages and messages[-1].get("sender") == "CUSTOMER":
+        messages = messages[:-1]
+    
+    # Skip if no messages remain or doesn't end with agent
+    if not messages or messages[-1].get("sender") != "AGENT":
+        return None
+        
+    # Convert to training format
+    conversation = [training_system_message(customer_firstname)]  # Start with system message
+    for msg in messages:
+        role = "user" if msg.get("sender") == "CUSTOMER" else "assistant"
+        content = (msg.get("message", "") or "") \
+            .replace("\\r\\n", "\n").replace("\\n", "\n").replace("\\r", "\n") \
+            .strip()
+        
+        if content:  # Only add non-empty messages
+            conversation.append({
+                "role": role,
+                "content": content
+            })
+    
+    # Only add if conversation has both user and assistant messages (plus system)
+    if len(conversation) > 2:  # At least system + user + assistant
+        return {"messages": conversation}
+    return None
+
+
+def iter_training_examples(df: pd.DataFrame, multiple_training_examples: bool = False):
+    """
+    Yield training examples for the conversation threads in df.
     Ensures the final message is always from the assistant (agent).
     
     Args:
         df: DataFrame with conversation_thread column
-        output_file: Output JSONL file path
-        multiple_training_examples: If True, create multiple training examples 
-                                   from start to each assistant reply. If False, 
-                                   use entire conversation as one example.
-        
-    Returns:
-        Number of training examples created
+        multiple_training_examples: If True, yield an example from the start to
+                                   each assistant reply. If False, use the
+                                   entire conversation as one example.
     """
-    print(f"Creating {output_file}...")
-    print(f"  Mode: {'multiple examples' if multiple_training_examples else 'single example per conversation'}")
-    
-    training_data = []
-    
     for _, row in df.iterrows():
         try:
             messages = json.loads(row['conversation_thread'])
@@ -316,10 +360,7 @@ def create_training_json(df: pd.DataFrame, output_file: str, multiple_training_e
                 customer_firstname = str(customer_firstname).strip()
             
             # Create system message
-            system_message = {
-                "role": "system",
-                "content": f"Je bent Freebird klantenservice. Antwoord vriendelijk en in het Nederlands tegen {customer_firstname}. als de naam leeg is begin dan een aanhef zonder de naam"
-            }
+            system_message = training_system_message(customer_firstname)
             
             if multiple_training_examples:
                 # Create multiple training examples - from start to each assistant reply
@@ -344,46 +385,68 @@ def create_training_json(df: pd.DataFrame, output_file: str, multiple_training_e
                         # If this is an assistant message, create a training example
                         # Must have at least system + user + assistant AND have seen a user message
                         if role == "assistant" and len(conversation) > 2 and has_user_message:
-                            training_data.append({"messages": conversation.copy()})
+                            yield {"messages": conversation.copy()}
             else:
                 # Original behavior - single training example per conversation
-                # Remove last message if it's from customer
-                if messages and messages[-1].get("sender") == "CUSTOMER":
-                    messages = messages[:-1]
-                
-                # Skip if no messages remain or doesn't end with agent
-                if not messages or messages[-1].get("sender") != "AGENT":
-                    continue
-                    
-                # Convert to training format
-                conversation = [system_message]  # Start with system message
-                for msg in messages:
-                    role = "user" if msg.get("sender") == "CUSTOMER" else "assistant"
-                    content = (msg.get("message", "") or "") \
-                        .replace("\\r\\n", "\n").replace("\\n", "\n").replace("\\r", "\n") \
-                        .strip()
-                    
-                    if content:  # Only add non-empty messages
-                        conversation.append({
-                            "role": role,
-                            "content": content
-                        })
-                
-                # Only add if conversation has both user and assistant messages (plus system)
-                if len(conversation) > 2:  # At least system + user + assistant
-                    training_data.append({"messages": conversation})
+                example = thread_to_training_example(messages, customer_firstname)
+                if example:
+                    yield example
                 
         except (json.JSONDecodeError, TypeError) as e:
             continue
+
+
+def create_training_json(df: pd.DataFrame, output_file: str, multiple_training_examples: bool = False,
+                         append: bool = False) -> int:
+    """
+    Create training JSON file from conversation threads for AI model training.
+    Ensures the final message is always from the assistant (agent).
+    
+    Args:
+        df: DataFrame with conversation_thread column
+        output_file: Output JSONL file path
+        multiple_training_examples: If True, create multiple training examples 
+                                   from start to each assistant reply. If False, 
+                                   use entire conversation as one example.
+        append: Add to an existing file (used when processing in chunks)
+        
+    Returns:
+        Number of training examples created
+    """
+    if not append:
+        print(f"Creating {output_file}...")
+        print(f"  Mode: {'multiple examples' if multiple_training_examples else 'single example per conversation'}")
+    
+    count = 0
     
     # Save to JSONL file (one JSON object per line)
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for item in training_data:
+    with open(output_file, 'a' if append else 'w', encoding='utf-8') as f:
+        for item in iter_training_examples(df, multiple_training_examples):
             json.dump(item, f, ensure_ascii=False)
             f.write('\n')
+            count += 1
     
-    print(f"  Created {len(training_data)} training examples")
-    return len(training_data)
+    if not append:
+        print(f"  Created {count} training examples")
+    return count
+
+
+def read_raw_tickets(path: str, chunksize: int = RAW_CHUNK_SIZE):
+    """
+    Yield DataFrames of at most `chunksize` raw tickets.
+    Reads CSV, JSONL (one ticket per line) or Parquet (needs pyarrow) lazily.
+    """
+    suffix = Path(path).suffix.lower()
+    
+    if suffix == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif suffix in ('.jsonl', '.json'):
+        with pd.read_json(path, lines=True, chunksize=chunksize, dtype=False, convert_dates=False) as reader:
+            yield from reader
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
 
 
 def main():
@@ -396,102 +459,94 @@ def main():
     print()
     
     # Load raw tickets data
-    raw_file = "raw_tickets.csv"
+    raw_file = sys.argv[1] if len(sys.argv) > 1 else "raw_tickets.csv"
     if not Path(raw_file).exists():
         print(f"ERROR: {raw_file} not found!")
-        print("Please ensure raw_tickets.csv exists in the current directory.")
+        print("Pass the raw data file (CSV, JSONL or Parquet) or put raw_tickets.csv in the current directory.")
         return
     
-    print(f"Loading {raw_file}...")
-    df = pd.read_csv(raw_file)
-    print(f"  Loaded {len(df)} tickets")
-    print()
-    
-    # Show channel distribution
-    if 'channel' in df.columns:
-        print("Channel distribution:")
-        print(df['channel'].value_counts())
-        print()
-    
-    # Filter out system senders
-    print("Filtering system senders...")
-    df = filter_system_senders(df)
-    print(f"  Kept {len(df)} tickets after filtering")
-    print()
-    
-    # Clean all data
-    df_cleaned = clean_dataframe(df)
-    print()
-    
-    # Save cleaned data
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     cleaned_csv = f"cleaned_tickets_{timestamp}.csv"
-    df_cleaned.to_csv(cleaned_csv, index=False, encoding="utf-8")
-    print(f"Saved cleaned data: {cleaned_csv}")
-    print()
-    
-    # Process CHAT data
-    print("="*70)
-    print("PROCESSING CHAT DATA")
-    print("="*70)
-    df_chat = df_cleaned[df_cleaned["channel"] == "chat"].reset_index(drop=True)
-    print(f"Found {len(df_chat)} chat conversations")
-    
-    if len(df_chat) > 0:
-        chat_single_file = f"training_chat_single_{timestamp}.jsonl"
-        chat_multiple_file = f"training_chat_multiple_{timestamp}.jsonl"
+    training_files = {
+        ("chat", False): f"training_chat_single_{timestamp}.jsonl",
+        ("chat", True): f"training_chat_multiple_{timestamp}.jsonl",
+        ("email", False): f"training_mail_single_{timestamp}.jsonl",
+        ("email", True): f"training_mail_multiple_{timestamp}.jsonl",
+    }
+    
+    loaded = 0
+    kept = 0
+    cleaned = 0
+    channel_distribution = Counter()
+    conversations = Counter()
+    examples = Counter()
+    
+    # Process chunk by chunk: clean, append to the cleaned CSV and training files
+    print(f"Loading {raw_file} in chunks of {RAW_CHUNK_SIZE}...")
+    for chunk in read_raw_tickets(raw_file):
+        loaded += len(chunk)
+        if 'channel' in chunk.columns:
+            channel_distribution.update(chunk['channel'].fillna('').tolist())
         
-        n_chat_single = create_training_json(df_chat, chat_single_file, multiple_training_examples=False)
-        n_chat_multiple = create_training_json(df_chat, chat_multiple_file, multiple_training_examples=True)
+        # Filter out system senders
+        chunk = filter_system_senders(chunk)
+        kept += len(chunk)
         
-        print()
-        print(f"Chat training files created:")
-        print(f"  Single: {chat_single_file} ({n_chat_single} examples)")
-        print(f"  Multiple: {chat_multiple_file} ({n_chat_multiple} examples)")
-    else:
-        print("  No chat conversations to process")
-    
+        # Clean all data
+        chunk_cleaned = clean_dataframe(chunk)
+        chunk_cleaned.to_csv(cleaned_csv, mode='a', header=not Path(cleaned_csv).exists(),
+                             index=False, encoding="utf-8")
+        cleaned += len(chunk_cleaned)
+        
+        for channel in ("chat", "email"):
+            df_channel = chunk_cleaned[chunk_cleaned["channel"] == channel].reset_index(drop=True)
+            conversations[channel] += len(df_channel)
+            if len(df_channel) == 0:
+                continue
+            for multiple in (False, True):
+                output_file = training_files[(channel, multiple)]
+                examples[output_file] += create_training_json(
+                    df_channel, output_file, multiple_training_examples=multiple, append=True
+                )
     print()
     
-    # Process EMAIL data
-    print("="*70)
-    print("PROCESSING EMAIL DATA")
-    print("="*70)
-    df_email = df_cleaned[df_cleaned["channel"] == "email"].reset_index(drop=True)
-    print(f"Found {len(df_email)} email conversations")
+    print(f"  Loaded {loaded} tickets")
+    if channel_distribution:
+        print("Channel distribution:")
+        for channel, count in channel_distribution.most_common():
+            print(f"  {channel}: {count}")
+    print(f"  Kept {kept} tickets after filtering system senders")
+    print(f"  Kept {cleaned}/{kept} conversations with valid messages")
+    print(f"Saved cleaned data: {cleaned_csv}")
+    print()
     
-    if len(df_email) > 0:
-        email_single_file = f"training_mail_single_{timestamp}.jsonl"
-        email_multiple_file = f"training_mail_multiple_{timestamp}.jsonl"
-        
-        n_email_single = create_training_json(df_email, email_single_file, multiple_training_examples=False)
-        n_email_multiple = create_training_json(df_email, email_multiple_file, multiple_training_examples=True)
-        
+    for channel, label in (("chat", "Chat"), ("email", "Email")):
+        print("="*70)
+        print(f"{label.upper()} DATA")
+        print("="*70)
+        print(f"Found {conversations[channel]} {channel} conversations")
+        if conversations[channel] > 0:
+            print(f"{label} training files created:")
+            print(f"  Single: {training_files[(channel, False)]} ({examples[training_files[(channel, False)]]} examples)")
+            print(f"  Multiple: {training_files[(channel, True)]} ({examples[training_files[(channel, True)]]} examples)")
+        else:
+            print(f"  No {channel} conversations to process")
         print()
-        print(f"Email training files created:")
-        print(f"  Single: {email_single_file} ({n_email_single} examples)")
-        print(f"  Multiple: {email_multiple_file} ({n_email_multiple} examples)")
-    else:
-        print("  No email conversations to process")
     
-    print()
     print("="*70)
     print("PROCESSING COMPLETE!")
     print("="*70)
     print()
     print("Summary:")
-    print(f"  Total conversations processed: {len(df_cleaned)}")
-    print(f"  Chat conversations: {len(df_chat)}")
-    print(f"  Email conversations: {len(df_email)}")
+    print(f"  Total conversations processed: {cleaned}")
+    print(f"  Chat conversations: {conversations['chat']}")
+    print(f"  Email conversations: {conversations['email']}")
     print()
     print("Output files:")
     print(f"  Cleaned data: {cleaned_csv}")
-    if len(df_chat) > 0:
-        print(f"  Chat single: {chat_single_file}")
-        print(f"  Chat multiple: {chat_multiple_file}")
-    if len(df_email) > 0:
-        print(f"  Email single: {email_single_file}")
-        print(f"  Email multiple: {email_multiple_file}")
+    for (channel, multiple), output_file in training_files.items():
+        if conversations[channel] > 0:
+            print(f"  {channel.capitalize()} {'multiple' if multiple else 'single'}: {output_file}")
     print()
 
 
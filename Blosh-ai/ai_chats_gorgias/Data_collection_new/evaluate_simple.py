@@ -6,7 +6,7 @@ import json
 import pandas as pd
 from openai import OpenAI
 from datetime import datetime
-import time
+from openai_limiter import limited_create
 
 # Read API key
 try:
@@ -27,7 +27,8 @@ FINETUNED_MODEL_ID = "ft:gpt-4.1-mini-2025-04-14:personal:blosh-mail-v3-optimize
 def translate_to_english(dutch_text):
     """Translate Dutch text to English using GPT"""
     try:
-        response = client.chat.completions.create(
+        response = limited_create(
+            client,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a translator. Translate the following Dutch text to English. Only provide the translation, no explanations."},
@@ -51,7 +52,8 @@ def get_ai_response(customer_message, customer_name, model_id):
     try:
         system_msg = get_system_message(customer_name)
         
-        response = client.chat.completions.create(
+        response = limited_create(
+            client,
             model=model_id,
             messages=[
                 {"role": "system", "content": system_msg},
@@ -131,8 +133,6 @@ def evaluate_model(csv_path, model_id, num_cases=15):
             'ai_response_en': ai_response_en,
             'category': row.contact_reason if hasattr(row, 'contact_reason') else "Unknown",
         })
-        
-        time.sleep(0.5)
     
     return results
 
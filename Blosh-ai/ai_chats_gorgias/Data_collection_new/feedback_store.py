@@ -0,0 +1,267 @@
+"""
+Feedback Store
+Agent feedback on suggestions (used / edited / ignored) persisted to SQLite.
+The request path only puts events on an in-memory queue; a writer thread
+flushes them in batches (write-behind). Acceptance counters per brand, intent
+and day are updated in the same transaction, so stats queries read a few
+counter rows instead of scanning every event.
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_FEEDBACK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feedback.db')
+
+FEEDBACK_TYPES = ('used', 'edited', 'ignored')
+
+# ============================================================================
+# STORE
+# ============================================================================
+
+class FeedbackStore:
+    """SQLite feedback events + incremental counters behind a write-behind queue"""
+
+    def __init__(self, path=DEFAULT_FEEDBACK_PATH, batch_size=100, flush_seconds=1.0, max_queue=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS feedback_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ticket_id TEXT,
+                suggestion_id TEXT,
+                feedback TEXT NOT NULL,
+                brand TEXT,
+                intent TEXT,
+                quality_score INTEGER,
+                warnings TEXT,
+                latency_ms REAL,
+                day TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_suggestion ON feedback_events(suggestion_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_created ON feedback_events(created_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS feedback_counters (
+                dimension TEXT NOT NULL,
+                value TEXT NOT NULL,
+                day TEXT NOT NULL,
+                feedback TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                quality_sum REAL NOT NULL,
+                latency_sum REAL NOT NULL,
+                PRIMARY KEY (dimension, value, day, feedback)
+            )
+        """)
+
+        self._writer = threading.Thread(target=self._write_loop, name='feedback-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        """One connection per thread; sqlite3 connections are not thread-safe"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, counter, amount=1):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    # ------------------------------------------------------------------------
+    # Write path
+    # ------------------------------------------------------------------------
+
+    def record(self, feedback, ticket_id=None, suggestion_id=None, brand=None, intent=None,
+               quality_score=None, warnings=None, latency_ms=None):
+        """Queue one feedback event; never blocks. Returns False if the queue is full."""
+        if feedback not in FEEDBACK_TYPES:
+            raise ValueError(f"Unknown feedback type: {feedback}")
+
+        now = time.time()
+        event = (
+            str(ticket_id) if ticket_id is not None else None,
+            suggestion_id,
+            feedback,
+            brand or 'unknown',
+            intent or 'unknown',
+            int(quality_score) if quality_score is not None else None,
+            json.dumps(warnings or [], ensure_ascii=False),
+            float(latency_ms) if latency_ms is not None else None,
+            datetime.fromtimestamp(now).strftime('%Y-%m-%d'),
+            now
+        )
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('recorded')
+        return True
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"Error writing feedback batch ({len(batch)} events): {str(e)}")
+                self._count('dropped', len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch):
+        """Insert events and bump their counters in one transaction"""
+        counters = {}  # dimension 'all' keeps the per-day totals
+        for ticket_id, suggestion_id, feedback, brand, intent, quality, warnings, latency, day, created in batch:
+            for dimension, value in (('all', 'all'), ('brand', brand), ('intent', intent)):
+                totals = counters.setdefault((dimension, value, day, feedback), [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += quality or 0
+                totals[2] += latency or 0
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("""
+                INSERT INTO feedback_events
+                    (ticket_id, suggestion_id, feedback, brand, intent, quality_score, warnings, latency_ms, day, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+            conn.executemany("""
+                INSERT INTO feedback_counters (dimension, value, day, feedback, count, quality_sum, latency_sum)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (dimension, value, day, feedback) DO UPDATE SET
+                    count = count + excluded.count,
+                    quality_sum = quality_sum + excluded.quality_sum,
+                    latency_sum = latency_sum + excluded.latency_sum
+            """, [key + tuple(totals) for key, totals in counters.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._count('written', len(batch))
+        self._count('flushes')
+
+    def flush(self, timeout=5):
+        """Wait (up to `timeout` seconds) until queued events are on disk"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    # ------------------------------------------------------------------------
+    # Queries (counter rows only)
+    # ------------------------------------------------------------------------
+
+    def acceptance(self, by='brand', days=30):
+        """
+        Acceptance per brand / intent / day over the last `days` days:
+        {value: {used, edited, ignored, total, acceptance_rate, used_as_is_rate, avg_quality, avg_latency_ms}}
+        acceptance_rate counts used + edited; used_as_is_rate only used.
+        """
+        if by not in ('brand', 'intent', 'day'):
+            raise ValueError(f"Unknown feedback dimension: {by}")
+
+        since = datetime.fromtimestamp(time.time() - days * 86400).strftime('%Y-%m-%d')
+        dimension = 'all' if by == 'day' else by
+        rows = self._connect().execute(
+            "SELECT value, day, feedback, count, quality_sum, latency_sum FROM feedback_counters "
+            "WHERE dimension = ? AND day >= ?",
+            (dimension, since)
+        ).fetchall()
+
+        groups = {}
+        for value, day, feedback, count, quality_sum, latency_sum in rows:
+            group = groups.setdefault(day if by == 'day' else value, {
+                'used': 0, 'edited': 0, 'ignored': 0, 'quality_sum': 0.0, 'latency_sum': 0.0
+            })
+            group[feedback] += count
+            group['quality_sum'] += quality_sum
+            group['latency_sum'] += latency_sum
+
+        for group in groups.values():
+            total = group['used'] + group['edited'] + group['ignored']
+            quality_sum = group.pop('quality_sum')
+            latency_sum = group.pop('latency_sum')
+            group['total'] = total
+            group['acceptance_rate'] = round((group['used'] + group['edited']) / total, 3) if total else 0.0
+            group['used_as_is_rate'] = round(group['used'] / total, 3) if total else 0.0
+            group['avg_quality'] = round(quality_sum / total, 1) if total else 0.0
+            group['avg_latency_ms'] = round(latency_sum / total, 1) if total else 0.0
+
+        return dict(sorted(groups.items()))
+
+    def tickets_with_feedback(self, since, feedback_types=FEEDBACK_TYPES):
+        """[(ticket_id, first feedback time)] for feedback recorded after `since` (epoch seconds)"""
+        placeholders = ','.join('?' * len(feedback_types))
+        return self._connect().execute(
+            "SELECT ticket_id, MIN(created_at) FROM feedback_events "
+            f"WHERE created_at >= ? AND ticket_id IS NOT NULL AND feedback IN ({placeholders}) "
+            "GROUP BY ticket_id ORDER BY MIN(created_at)",
+            (since, *feedback_types)
+        ).fetchall()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'path': self.path,
+                'queued': self._queue.qsize(),
+                'recorded': self.recorded,
+                'written': self.written,
+                'dropped': self.dropped,
+                'flushes': self.flushes
+            }
+
+# ============================================================================
+# SHARED STORE
+# ============================================================================
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_feedback_store():
+    """Process-wide store configured from FEEDBACK_* environment variables"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FeedbackStore(
+                path=os.getenv('FEEDBACK_STORE_PATH', DEFAULT_FEEDBACK_PATH),
+                batch_size=int(os.getenv('FEEDBACK_BATCH_SIZE', 100)),
+                flush_seconds=float(os.getenv('FEEDBACK_FLUSH_SECONDS', 1.0)),
+                max_queue=int(os.getenv('FEEDBACK_QUEUE_SIZE', 10000))
+            )
+        return _store
@@ -0,0 +1,166 @@
+"""
+Generation Strategies
+How many model candidates to run for one suggestion and how to pick the result:
+- single:   one candidate (default)
+- fallback: run the next candidate only if the previous one fails the quality gate
+- race:     run all candidates concurrently, return the first that passes the
+            quality gate and cancel the others
+
+Strategies only see three callables, so they work with any client:
+    complete(candidate, cancel_event) -> generated text
+    finalize(text) -> result dict with 'approved' and 'quality_score' (no side effects)
+    remember(text, result) -> caches the generation; called for the returned result only
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+STRATEGIES = ('single', 'fallback', 'race')
+
+class CandidateCancelled(Exception):
+    """Raised by complete() when another candidate already won the race"""
+
+def get_strategy_name():
+    """Configured strategy (GENERATION_STRATEGY=single|fallback|race)"""
+    name = os.getenv('GENERATION_STRATEGY', 'single').lower()
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown generation strategy: {name}")
+    return name
+
+def _better(best, attempt):
+    """Of two (text, result) attempts prefer approved results, then the higher quality score"""
+    if best is None:
+        return attempt
+    return max(best, attempt, key=lambda a: (a[1]['approved'], a[1]['quality_score']))
+
+def _label(result, candidate, strategy, attempts):
+    result['model'] = candidate['model']
+    result['strategy'] = strategy
+    result['candidates_tried'] = attempts
+    return result
+
+# ============================================================================
+# SYNC STRATEGIES
+# ============================================================================
+
+_race_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('GENERATION_RACE_THREADS', 8)),
+    thread_name_prefix='generation-race'
+)
+
+def _attempt(candidate, complete, finalize, cancel=None):
+    """Generate and finalize one candidate; (text, result) or None if it failed or was cancelled"""
+    try:
+        text = complete(candidate, cancel)
+        if cancel is not None and cancel.is_set():
+            return None
+        return text, finalize(text)
+    except CandidateCancelled:
+        return None
+    except Exception as e:
+        print(f"Error generating response ({candidate['model']}): {str(e)}")
+        return None
+
+def _remember(best, remember):
+    """Cache the chosen generation and return its result"""
+    if best is None:
+        return None
+    text, result = best
+    if remember:
+        remember(text, result)
+    return result
+
+def run_strategy(strategy, candidates, complete, finalize, remember=None):
+    """Run candidates with the given strategy; best result or None if every candidate failed"""
+    if strategy == 'single' or len(candidates) == 1:
+        attempt = _attempt(candidates[0], complete, finalize)
+        if attempt:
+            _label(attempt[1], candidates[0], strategy, 1)
+        return _remember(attempt, remember)
+
+    if strategy == 'fallback':
+        best = None
+        for attempts, candidate in enumerate(candidates, 1):
+            attempt = _attempt(candidate, complete, finalize)
+            if attempt is None:
+                continue
+            _label(attempt[1], candidate, strategy, attempts)
+            best = _better(best, attempt)
+            if attempt[1]['approved']:
+                break
+        return _remember(best, remember)
+
+    # race
+    cancel = threading.Event()
+    futures = {
+        _race_pool.submit(_attempt, candidate, complete, finalize, cancel): candidate
+        for candidate in candidates
+    }
+    best = None
+    try:
+        for future in as_completed(futures):
+            attempt = future.result()
+            if attempt is None:
+                continue
+            _label(attempt[1], futures[future], strategy, len(candidates))
+            best = _better(best, attempt)
+            if attempt[1]['approved']:
+                break
+    finally:
+        # Losers notice between stream chunks and close their connection
+        cancel.set()
+    return _remember(best, remember)
+
+# ============================================================================
+# ASYNC STRATEGIES
+# ============================================================================
+
+async def _attempt_async(candidate, complete, finalize):
+    try:
+        text = await complete(candidate)
+        return text, finalize(text)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Error generating response ({candidate['model']}): {str(e)}")
+        return None
+
+async def _remember_async(best, remember):
+    """_remember off the event loop (remember writes to the SQLite response memo)"""
+    return await asyncio.to_thread(_remember, best, remember)
+
+async def run_strategy_async(strategy, candidates, complete, finalize, remember=None):
+    """asyncio counterpart of run_strategy; race losers are cancelled as tasks"""
+    if strategy != 'race' or len(candidates) == 1:
+        best = None
+        for attempts, candidate in enumerate(candidates[:1] if strategy == 'single' else candidates, 1):
+            attempt = await _attempt_async(candidate, complete, finalize)
+            if attempt is None:
+                continue
+            _label(attempt[1], candidate, strategy, attempts)
+            best = _better(best, attempt)
+            if attempt[1]['approved']:
+                break
+        return await _remember_async(best, remember)
+
+    tasks = {
+        asyncio.ensure_future(_attempt_async(candidate, complete, finalize)): candidate
+        for candidate in candidates
+    }
+    pending = set(tasks)
+    best = None
+    try:
+        while pending and not (best and best[1]['approved']):
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                attempt = task.result()
+                if attempt is None:
+                    continue
+                _label(attempt[1], tasks[task], strategy, len(candidates))
+                best = _better(best, attempt)
+    finally:
+        for task in pending:
+            task.cancel()
+    return await _remember_async(best, remember)
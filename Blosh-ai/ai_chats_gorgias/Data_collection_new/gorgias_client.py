@@ -0,0 +1,329 @@
+"""
+Gorgias API Client
+Shared keep-alive HTTP session for the Gorgias REST API with a retry budget:
+429 responses honour Retry-After, 5xx/connection errors back off with jitter,
+and every call is bounded by a per-request deadline.
+
+Optionally every thread/task using a client shares one request budget: a
+token bucket (requests_per_second + burst) and a client-wide pause after a
+429 with Retry-After, so concurrent callers stop together instead of each
+hitting the limit.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://freebirdicons.gorgias.com/api'
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# ============================================================================
+# CLIENT
+# ============================================================================
+
+class _GorgiasClientBase:
+    """Configuration and retry policy shared by the sync and async clients"""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, auth=None, pool_size=10, timeout=10,
+                 max_retries=3, deadline=30, backoff_base=1.0, max_backoff=30,
+                 requests_per_second=None, burst=None):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.headers = {
+            'accept': 'application/json',
+            'content-type': 'application/json'
+        }
+        if auth:
+            self.headers['authorization'] = auth
+
+        # Shared request budget (None = unlimited) and client-wide 429 pause
+        self.requests_per_second = requests_per_second
+        self.burst = burst or (max(1, int(requests_per_second)) if requests_per_second else 0)
+        self._tokens = float(self.burst)
+        self._tokens_updated = time.monotonic()
+        self._paused_until = 0.0
+        self._throttle_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.pauses = 0
+
+    def url(self, path):
+        """Absolute URL for an API path (full URLs are passed through)"""
+        if path.startswith(('http://', 'https://')):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _reserve_request(self):
+        """Take a request slot, or return seconds to wait (client-wide 429 pause, then token bucket)"""
+        with self._throttle_lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if not self.requests_per_second:
+                return 0.0
+
+            self._tokens = min(self.burst, self._tokens + (now - self._tokens_updated) * self.requests_per_second)
+            self._tokens_updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.requests_per_second
+
+    def _pause_all(self, seconds):
+        """Hold every request on this client for `seconds` (Gorgias said Retry-After)"""
+        with self._throttle_lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._count('pauses')
+
+    def _attempt_timeout(self, started, deadline):
+        """Per-attempt timeout, capped by what is left of the deadline"""
+        if not deadline:
+            return self.timeout
+        remaining = deadline - (time.monotonic() - started)
+        return max(0.1, min(self.timeout, remaining))
+
+    def _next_wait(self, method, url, status_code, headers, error, attempt, max_retries, started, deadline):
+        """Seconds to sleep before retrying, or None to give up"""
+        if attempt >= max_retries:
+            return None
+
+        wait = self._retry_wait(status_code, headers, attempt)
+        if deadline and (time.monotonic() - started) + wait >= deadline:
+            logger.warning(f"Gorgias {method} {url}: retry budget exhausted after {attempt + 1} attempts")
+            return None
+
+        reason = f"HTTP {status_code}" if status_code is not None else str(error)
+        logger.warning(f"Gorgias {method} {url}: {reason} - retrying in {wait:.1f}s ({attempt + 1}/{max_retries})")
+        self._count('retries')
+        return wait
+
+    def _retry_wait(self, status_code, headers, attempt):
+        """Seconds to wait before the next attempt"""
+        if status_code == 429:
+            self._count('rate_limited')
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            if retry_after is not None:
+                self._pause_all(retry_after)
+                # Small jitter so parallel workers don't retry in lockstep
+                return retry_after + random.uniform(0, 1)
+
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.max_backoff, self.backoff_base * (2 ** attempt)))
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'requests_sent': self.requests_sent,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'pauses': self.pauses
+            }
+
+class GorgiasClient(_GorgiasClientBase):
+    """Pooled, thread-safe Gorgias API client"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(self.headers)
+
+    def request(self, method, path, max_retries=None, deadline=None, **kwargs):
+        """
+        Send a request, retrying 429/5xx/connection errors within the retry budget.
+        Returns the last response; raises requests.RequestException if no response arrived.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        deadline = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        url = self.url(path)
+
+        attempt = 0
+        while True:
+            wait = self._reserve_request()
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._reserve_request()
+
+            try:
+                self._count('requests_sent')
+                response = self.session.request(
+                    method, url, timeout=self._attempt_timeout(started, deadline), **kwargs
+                )
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                return response
+
+            wait = self._next_wait(
+                method, url,
+                response.status_code if response is not None else None,
+                response.headers if response is not None else {},
+                error, attempt, max_retries, started, deadline
+            )
+            if wait is None:
+                break
+            time.sleep(wait)
+            attempt += 1
+
+        if response is None:
+            raise error
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def get_json(self, path, params=None, **kwargs):
+        """GET and decode JSON; logs and returns None on any failure"""
+        try:
+            response = self.get(path, params=params, **kwargs)
+            if response.status_code == 200:
+                return response.json()
+            logger.error(f"Gorgias GET {path} failed: {response.status_code} - {response.text[:200]}")
+            return None
+        except Exception as e:
+            logger.error(f"Error calling Gorgias GET {path}: {str(e)}")
+            return None
+
+class AsyncGorgiasClient(_GorgiasClientBase):
+    """asyncio Gorgias API client on a pooled httpx.AsyncClient (same retry policy)"""
+
+    def __init__(self, *args, **kwargs):
+        # Only the optional async server needs httpx; the sync server and the collector don't
+        import httpx
+
+        super().__init__(*args, **kwargs)
+        self._transport_error = httpx.TransportError
+        self.http = httpx.AsyncClient(
+            headers=self.headers,
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+
+    async def request(self, method, path, max_retries=None, deadline=None, **kwargs):
+        """Async counterpart of GorgiasClient.request; raises httpx.TransportError if no response arrived"""
+        max_retries = self.max_retries if max_retries is None else max_retries
+        deadline = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        url = self.url(path)
+
+        attempt = 0
+        while True:
+            wait = self._reserve_request()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._reserve_request()
+
+            try:
+                self._count('requests_sent')
+                response = await self.http.request(
+                    method, url, timeout=self._attempt_timeout(started, deadline), **kwargs
+                )
+                error = None
+            except self._transport_error as e:
+                response, error = None, e
+
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                return response
+
+            wait = self._next_wait(
+                method, url,
+                response.status_code if response is not None else None,
+                response.headers if response is not None else {},
+                error, attempt, max_retries, started, deadline
+            )
+            if wait is None:
+                break
+            await asyncio.sleep(wait)
+            attempt += 1
+
+        if response is None:
+            raise error
+        return response
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def get_json(self, path, params=None, **kwargs):
+        """GET and decode JSON; logs and returns None on any failure"""
+        try:
+            response = await self.get(path, params=params, **kwargs)
+            if response.status_code == 200:
+                return response.json()
+            logger.error(f"Gorgias GET {path} failed: {response.status_code} - {response.text[:200]}")
+            return None
+        except Exception as e:
+            logger.error(f"Error calling Gorgias GET {path}: {str(e)}")
+            return None
+
+    async def aclose(self):
+        await self.http.aclose()
+
+def parse_retry_after(value):
+    """Retry-After header as seconds (delta-seconds or HTTP date), None if absent/invalid"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# ============================================================================
+# SHARED DEFAULT CLIENT
+# ============================================================================
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def client_settings_from_env():
+    """Client keyword arguments from GORGIAS_* environment variables"""
+    return {
+        'base_url': os.getenv('GORGIAS_BASE_URL', DEFAULT_BASE_URL),
+        'auth': os.getenv('GORGIAS_AUTH'),
+        'pool_size': int(os.getenv('GORGIAS_POOL_SIZE', 10)),
+        'timeout': float(os.getenv('GORGIAS_TIMEOUT', 10)),
+        'max_retries': int(os.getenv('GORGIAS_MAX_RETRIES', 3)),
+        'deadline': float(os.getenv('GORGIAS_DEADLINE', 30)),
+        'requests_per_second': float(os.getenv('GORGIAS_RPS', 0)) or None,
+        'burst': int(os.getenv('GORGIAS_BURST', 0)) or None
+    }
+
+def get_default_client():
+    """Process-wide client configured from GORGIAS_* environment variables"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = GorgiasClient(**client_settings_from_env())
+        return _default_client
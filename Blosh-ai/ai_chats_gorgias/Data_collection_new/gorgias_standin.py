@@ -0,0 +1,432 @@
+"""
+Gorgias + OpenAI Stand-in
+Local Flask server that imitates the parts of the Gorgias REST API and the
+OpenAI chat-completions API used by this repo, for offline integration tests
+and benchmarks of the collector and widget servers on a laptop.
+
+Gorgias (under /api):
+    GET    /api/tickets                 limit, cursor, order_by, view_id
+    GET    /api/tickets/<id>            ticket with embedded messages
+    GET    /api/tickets/<id>/messages
+    POST   /api/views                   channel / created_datetime filters
+    DELETE /api/views/<id>
+OpenAI (under /v1):
+    POST   /v1/chat/completions         plain and stream=True (SSE)
+Stand-in:
+    GET    /standin/stats               requests served, 429s injected
+
+Tickets are synthetic (seeded, reproducible) or replayed from a file written by
+data_processing/collect_mail_data.py (CSV or JSONL). Every Gorgias request
+waits a configurable latency, and 429s with Retry-After are injected at random
+and/or by a Gorgias-like rate limit (e.g. 40 requests per 20 seconds).
+
+Usage:
+    python gorgias_standin.py --tickets 5000 --latency-ms 80 --rate-limit 40/20
+    GORGIAS_BASE_URL=http://localhost:8900/api OPENAI_BASE_URL=http://localhost:8900/v1 ...
+"""
+
+import argparse
+import base64
+import csv
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+CHANNEL_WEIGHTS = {'email': 0.5, 'chat': 0.3, 'facebook': 0.1, 'instagram': 0.1}
+
+CUSTOMER_MESSAGES = [
+    "Hoi, mijn bestelling {order} is nog niet binnen. Kunnen jullie kijken waar hij is?",
+    "Ik wil graag mijn schoenen retourneren, ze zijn te klein. Hoe werkt dat?",
+    "De zool van mijn sneakers laat los na twee weken. Wat kan ik doen?",
+    "Kan ik mijn bestelling {order} nog omruilen voor een maat groter?",
+    "Ik heb een retour gestuurd maar nog geen geld terug ontvangen.",
+    "Hebben jullie dit model ook in het zwart?",
+]
+
+AGENT_MESSAGES = [
+    "Hoi {name},\n\nBedankt voor je bericht. Ik heb je bestelling opgezocht en kijk het voor je na.\n\nMet vriendelijke groet,\nFreebird",
+    "Hoi {name},\n\nVervelend om te horen! Stuur je een foto mee, dan lossen we het zo snel mogelijk op.\n\nGroetjes,\nFreebird",
+    "Hoi {name},\n\nJe kunt je retour aanmelden via ons retourportaal. Het geld staat binnen 5 werkdagen op je rekening.\n\nGroetjes,\nFreebird",
+]
+
+FIRST_NAMES = ['Sanne', 'Lisa', 'Emma', 'Daan', 'Julia', 'Noor', 'Tess', 'Anna', 'Sophie', 'Fleur']
+
+# No greeting: the response generator's post-processing adds one with the customer's name
+DEFAULT_REPLY = "Bedankt voor je bericht. We gaan dit direct voor je uitzoeken en laten je zo snel mogelijk iets weten.\n\nMet vriendelijke groet,\nFreebird"
+
+# ============================================================================
+# TICKET DATA
+# ============================================================================
+
+def iso(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+
+def make_message(ticket_id, index, from_agent, body, created, channel):
+    return {
+        'id': ticket_id * 100 + index,
+        'ticket_id': ticket_id,
+        'channel': channel,
+        'from_agent': from_agent,
+        'public': True,
+        'body_text': body,
+        'source': {'type': 'helpdesk' if from_agent else 'customer'},
+        'created_datetime': iso(created)
+    }
+
+def synthetic_tickets(count=2000, days=365, seed=42):
+    """Reproducible tickets spread over the last `days` days, newest ticket last"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    channels, weights = zip(*CHANNEL_WEIGHTS.items())
+
+    tickets = []
+    for i in range(count):
+        ticket_id = 100000 + i
+        created = now - timedelta(seconds=days * 86400 * (count - i) / count)
+        name = rng.choice(FIRST_NAMES)
+        order = f"102{rng.randint(100000, 999999)}"
+        channel = rng.choices(channels, weights)[0]
+
+        messages = []
+        at = created
+        for index in range(rng.randint(1, 3) * 2):
+            from_agent = index % 2 == 1
+            template = rng.choice(AGENT_MESSAGES if from_agent else CUSTOMER_MESSAGES)
+            messages.append(make_message(ticket_id, index, from_agent, template.format(name=name, order=order), at, channel))
+            at = min(now, at + timedelta(minutes=rng.randint(5, 600)))
+
+        tickets.append({
+            'id': ticket_id,
+            'subject': f"Vraag over bestelling {order}" if rng.random() < 0.5 else "Vraag",
+            'status': rng.choice(['closed', 'closed', 'open']),
+            'channel': channel,
+            'via': channel,
+            'language': 'nl',
+            'priority': 'normal',
+            'spam': False,
+            'customer': {'id': 5000 + i, 'email': f"{name.lower()}{i}@example.com", 'firstname': name,
+                         'lastname': 'Jansen', 'name': f"{name} Jansen"},
+            'tags': [],
+            'created_datetime': iso(created),
+            'updated_datetime': messages[-1]['created_datetime'],
+            'last_message_datetime': messages[-1]['created_datetime'],
+            'last_received_message_datetime': messages[-2 if len(messages) > 1 else -1]['created_datetime'],
+            'closed_datetime': None,
+            'messages': messages
+        })
+    return tickets
+
+def replayed_tickets(path):
+    """Tickets from a collect_mail_data.py output file (CSV or JSONL rows with conversation_thread)"""
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    tickets = []
+    for row in rows:
+        ticket_id = int(row['ticket_id'])
+        thread = json.loads(row.get('conversation_thread') or '[]')
+        messages = []
+        for index, entry in enumerate(thread):
+            created = datetime.fromisoformat(entry['timestamp'].replace('Z', '+00:00')) if entry.get('timestamp') \
+                else datetime.now(timezone.utc)
+            message = make_message(ticket_id, index, entry['sender'] == 'AGENT', entry.get('message', ''),
+                                   created, row.get('channel') or 'email')
+            message['id'] = entry.get('message_id') or message['id']
+            messages.append(message)
+
+        ticket = {key: row.get(key) for key in (
+            'subject', 'status', 'channel', 'via', 'language', 'priority', 'created_datetime',
+            'updated_datetime', 'last_message_datetime', 'last_received_message_datetime', 'closed_datetime'
+        )}
+        ticket.update({
+            'id': ticket_id,
+            'spam': str(row.get('spam')).lower() == 'true',
+            'customer': {'email': row.get('customer_email'), 'firstname': row.get('customer_firstname'),
+                         'lastname': row.get('customer_lastname')},
+            'tags': [],
+            'messages': messages
+        })
+        tickets.append(ticket)
+    return tickets
+
+# ============================================================================
+# VIEWS (filter subset used by collect_mail_data.view_filters)
+# ============================================================================
+
+def parse_view_filters(filters):
+    """{'channels': set or None, 'gte': datetime, 'lt': datetime} from a Gorgias filter expression"""
+    channels = set(re.findall(r"eq\(ticket\.channel,\s*'([^']+)'\)", filters or ''))
+    parsed = {'channels': channels or None}
+    for op in ('gte', 'lt'):
+        match = re.search(rf"{op}\(ticket\.created_datetime,\s*'([^']+)'\)", filters or '')
+        parsed[op] = datetime.fromisoformat(match.group(1).replace('Z', '+00:00')) if match else None
+    return parsed
+
+def matches_view(ticket, view):
+    if view['channels'] and ticket.get('channel') not in view['channels']:
+        return False
+    if view['gte'] or view['lt']:
+        created = datetime.fromisoformat(str(ticket.get('created_datetime')).replace('Z', '+00:00'))
+        if view['gte'] and created < view['gte']:
+            return False
+        if view['lt'] and created >= view['lt']:
+            return False
+    return True
+
+# ============================================================================
+# STAND-IN
+# ============================================================================
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({'offset': offset}).encode()).decode()
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))['offset']
+
+class StandIn:
+    """Ticket data, injected latency / 429s and request counters shared by all request threads"""
+
+    def __init__(self, tickets, latency_ms=50, jitter_ms=20, error_rate=0.0, retry_after=2,
+                 rate_limit=None, openai_latency_ms=500, token_delay_ms=10, reply=DEFAULT_REPLY, seed=None):
+        self.tickets = {ticket['id']: ticket for ticket in tickets}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit  # (requests, seconds) or None
+        self.openai_latency_ms = openai_latency_ms
+        self.token_delay_ms = token_delay_ms
+        self.reply = reply
+        self.views = {}
+        self._random = random.Random(seed)
+        self._window = []
+        self._lock = threading.Lock()
+        self.counters = {'gorgias_requests': 0, 'openai_requests': 0, 'injected_429': 0, 'rate_limited_429': 0}
+
+        # Sorted once per order so listing a page is a slice
+        self._orders = {}
+        for field in ('created_datetime', 'updated_datetime'):
+            ordered = sorted(self.tickets.values(), key=lambda t: (t.get(field) or '', t['id']))
+            self._orders[f"{field}:asc"] = ordered
+            self._orders[f"{field}:desc"] = ordered[::-1]
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def throttle(self):
+        """Seconds the client must wait (a 429 is returned) or None; then the configured latency"""
+        self._count('gorgias_requests')
+        with self._lock:
+            if self.rate_limit:
+                limit, seconds = self.rate_limit
+                now = time.monotonic()
+                self._window = [t for t in self._window if now - t < seconds]
+                if len(self._window) >= limit:
+                    self.counters['rate_limited_429'] += 1
+                    return max(1, round(seconds - (now - self._window[0])))
+                self._window.append(now)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.counters['injected_429'] += 1
+                return self.retry_after
+            delay = max(0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms))
+        time.sleep(delay / 1000)
+        return None
+
+    def list_tickets(self, limit=30, cursor=None, order_by='created_datetime:desc', view_id=None):
+        ordered = self._orders.get(order_by) or self._orders['created_datetime:desc']
+        view = self.views.get(view_id) if view_id else None
+        if view:
+            ordered = [ticket for ticket in ordered if matches_view(ticket, view)]
+
+        offset = decode_cursor(cursor) if cursor else 0
+        page = ordered[offset:offset + limit]
+        next_offset = offset + limit
+        return {
+            'data': [{k: v for k, v in ticket.items() if k != 'messages'} for ticket in page],
+            'meta': {
+                'next_cursor': encode_cursor(next_offset) if next_offset < len(ordered) else None,
+                'prev_cursor': encode_cursor(max(0, offset - limit)) if offset else None
+            }
+        }
+
+    def create_view(self, body):
+        view_id = len(self.views) + 1
+        self.views[view_id] = parse_view_filters(body.get('filters'))
+        return {'id': view_id, 'name': body.get('name'), 'type': body.get('type', 'ticket-list'),
+                'filters': body.get('filters')}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, tickets=len(self.tickets), views=len(self.views))
+
+# ============================================================================
+# FAKE OPENAI
+# ============================================================================
+
+def chat_completion(standin, body):
+    standin._count('openai_requests')
+    messages = body.get('messages') or []
+    content = standin.reply
+    prompt_tokens = sum(len(m.get('content') or '') for m in messages) // 4
+    completion_id = f"chatcmpl-standin-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    model = body.get('model', 'standin')
+
+    if not body.get('stream'):
+        time.sleep(standin.openai_latency_ms / 1000)
+        return jsonify({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content) // 4,
+                      'total_tokens': prompt_tokens + len(content) // 4}
+        })
+
+    def events():
+        # Time to first token, then one word per chunk
+        time.sleep(standin.openai_latency_ms / 1000)
+        words = re.findall(r'\S+\s*|\s+', content)
+        for i, word in enumerate([None] + words + [None]):
+            if i == 0:
+                delta, finish = {'role': 'assistant', 'content': ''}, None
+            elif word is None:
+                delta, finish = {}, 'stop'
+            else:
+                delta, finish = {'content': word}, None
+                time.sleep(standin.token_delay_ms / 1000)
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream')
+
+# ============================================================================
+# FLASK APP
+# ============================================================================
+
+def create_app(standin):
+    app = Flask(__name__)
+
+    def rate_limited(retry_after):
+        response = jsonify({'error': {'msg': 'Too many requests'}})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    @app.before_request
+    def gorgias_throttle():
+        if request.path.startswith('/api/'):
+            retry_after = standin.throttle()
+            if retry_after is not None:
+                return rate_limited(retry_after)
+
+    @app.route('/api/tickets', methods=['GET'])
+    def list_tickets():
+        view_id = request.args.get('view_id', type=int)
+        if view_id and view_id not in standin.views:
+            return jsonify({'error': {'msg': f"View {view_id} not found"}}), 404
+        try:
+            return jsonify(standin.list_tickets(
+                limit=min(request.args.get('limit', 30, type=int), 100),
+                cursor=request.args.get('cursor'),
+                order_by=request.args.get('order_by', 'created_datetime:desc'),
+                view_id=view_id
+            ))
+        except (ValueError, KeyError):
+            return jsonify({'error': {'msg': 'Invalid cursor'}}), 400
+
+    @app.route('/api/tickets/<int:ticket_id>', methods=['GET'])
+    def get_ticket(ticket_id):
+        ticket = standin.tickets.get(ticket_id)
+        if not ticket:
+            return jsonify({'error': {'msg': 'Ticket not found'}}), 404
+        return jsonify(ticket)
+
+    @app.route('/api/tickets/<int:ticket_id>/messages', methods=['GET'])
+    def get_messages(ticket_id):
+        ticket = standin.tickets.get(ticket_id)
+        if not ticket:
+            return jsonify({'error': {'msg': 'Ticket not found'}}), 404
+        return jsonify({'data': ticket['messages'], 'meta': {'next_cursor': None, 'prev_cursor': None}})
+
+    @app.route('/api/views', methods=['POST'])
+    def create_view():
+        return jsonify(standin.create_view(request.get_json(silent=True) or {})), 201
+
+    @app.route('/api/views/<int:view_id>', methods=['DELETE'])
+    def delete_view(view_id):
+        if standin.views.pop(view_id, None) is None:
+            return jsonify({'error': {'msg': 'View not found'}}), 404
+        return '', 204
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    def completions():
+        return chat_completion(standin, request.get_json(silent=True) or {})
+
+    @app.route('/standin/stats', methods=['GET'])
+    def stats():
+        return jsonify(standin.stats())
+
+    return app
+
+def parse_rate_limit(value):
+    """'40/20' -> (40, 20.0): at most 40 requests per 20 seconds"""
+    if not value:
+        return None
+    requests_allowed, seconds = value.split('/')
+    return int(requests_allowed), float(seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Gorgias + OpenAI stand-in for offline testing")
+    parser.add_argument('--port', type=int, default=int(os.getenv('STANDIN_PORT', 8900)))
+    parser.add_argument('--tickets', type=int, default=int(os.getenv('STANDIN_TICKETS', 2000)),
+                        help='Synthetic tickets to generate')
+    parser.add_argument('--days', type=int, default=365, help='Spread synthetic tickets over this many days')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--replay', help='Serve tickets from a collect_mail_data.py CSV/JSONL instead')
+    parser.add_argument('--latency-ms', type=float, default=float(os.getenv('STANDIN_LATENCY_MS', 50)))
+    parser.add_argument('--jitter-ms', type=float, default=float(os.getenv('STANDIN_JITTER_MS', 20)))
+    parser.add_argument('--error-rate', type=float, default=float(os.getenv('STANDIN_429_RATE', 0)),
+                        help='Fraction of Gorgias requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=2, help='Retry-After seconds on injected 429s')
+    parser.add_argument('--rate-limit', default=os.getenv('STANDIN_RATE_LIMIT'),
+                        help="Gorgias-like limit, e.g. 40/20 (requests/seconds)")
+    parser.add_argument('--openai-latency-ms', type=float, default=float(os.getenv('STANDIN_OPENAI_LATENCY_MS', 500)),
+                        help='Time to first token of the fake completions')
+    parser.add_argument('--token-delay-ms', type=float, default=10, help='Delay between streamed words')
+    args = parser.parse_args()
+
+    tickets = replayed_tickets(args.replay) if args.replay else synthetic_tickets(args.tickets, args.days, args.seed)
+    standin = StandIn(
+        tickets,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        rate_limit=parse_rate_limit(args.rate_limit),
+        openai_latency_ms=args.openai_latency_ms,
+        token_delay_ms=args.token_delay_ms,
+        seed=args.seed
+    )
+
+    print(f"Serving {len(standin.tickets)} tickets on http://localhost:{args.port}")
+    print(f"  GORGIAS_BASE_URL=http://localhost:{args.port}/api")
+    print(f"  OPENAI_BASE_URL=http://localhost:{args.port}/v1")
+    create_app(standin).run(host='0.0.0.0', port=args.port, threaded=True)
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,27 @@ Combines all best practices to achieve 70-80% excellent responses WITHOUT retrai
 """
 
 import os
-import re
+import asyncio
 import json
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from datetime import datetime
+from openai_limiter import get_limiter, estimate_tokens, limited_create, limited_create_async
+from response_memo import get_response_memo, personalize
+from semantic_cache import get_semantic_cache
+from reply_index import get_reply_index
+from context_matcher import get_context_matcher
+from response_rules import get_response_rules
+from generation_strategies import get_strategy_name, run_strategy, run_strategy_async, CandidateCancelled
+from pipeline_metrics import PipelineTrace, estimate_completion_tokens
 
-# Initialize client
+# Initialize clients (async client is used by the asyncio widget server)
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+async_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 FINETUNED_MODEL_ID = "ft:gpt-4.1-mini-2025-04-14:personal:blosh-mail-v3-optimized:CVTnPZJB"
 
+# Second candidate for the fallback/race strategies (GENERATION_STRATEGY)
+FALLBACK_MODEL_ID = os.getenv('FALLBACK_MODEL_ID', 'gpt-4.1-mini-2025-04-14')
+
 # ============================================================================
 # KNOWLEDGE BASE
 # ============================================================================
@@ -63,39 +75,35 @@ def detect_brand(order_number=None, email=None, subject=None):
 # ============================================================================
 
 def extract_context(customer_message):
-    """Extract key context from customer message"""
-    message_lower = customer_message.lower()
+    """Extract key context from customer message (one pass of the shared context matcher)"""
+    signals = get_context_matcher().scan(customer_message)
+    intents = signals['intents']
     
     context = {
-        'order_number': None,
-        'has_photos': False,
-        'mentions_defect': False,
-        'mentions_return': False,
-        'mentions_late_return': False,
+        'order_number': signals['order_number'],
+        'has_photos': 'photo' in intents,
+        'mentions_defect': 'defect' in intents,
+        'mentions_return': 'return' in intents,
+        'mentions_late_return': 'late_return' in intents,
         'asks_question': '?' in customer_message,
-        'message_length': len(customer_message)
+        'message_length': len(customer_message),
+        'intents': sorted(intents)
     }
     
-    # Extract order number
-    order_match = re.search(r'\b(102\d{6}|203\d{5})\b', customer_message)
-    if order_match:
-        context['order_number'] = order_match.group(1)
-    
-    # Detect patterns
-    context['has_photos'] = any(word in message_lower for word in 
-        ['foto', 'photo', 'afbeelding', 'bijlage', 'attachment'])
-    
-    context['mentions_defect'] = any(word in message_lower for word in 
-        ['defect', 'kapot', 'beschadigd', 'kwaliteit', 'pilt', 'quality', 'broken'])
-    
-    context['mentions_return'] = any(word in message_lower for word in 
-        ['retour', 'return', 'terugsturen', 'terug sturen'])
-    
-    context['mentions_late_return'] = any(phrase in message_lower for phrase in 
-        ['14 dagen', '15 dagen', 'te laat', 'verlopen', 'expired'])
-    
     return context
 
+def primary_intent(context):
+    """Single label for a ticket, used to break down feedback and stats"""
+    if context['mentions_defect']:
+        return 'defect'
+    if context['mentions_late_return']:
+        return 'late_return'
+    if context['mentions_return']:
+        return 'return'
+    if context['has_photos']:
+        return 'photo'
+    return 'general'
+
 # ============================================================================
 # KNOWLEDGE INJECTION
 # ============================================================================
@@ -115,11 +123,25 @@ def get_relevant_knowledge(context):
     
     return '\n\n'.join(knowledge_parts) if knowledge_parts else ""
 
+def get_similar_exchanges(customer_message, customer_name="", order_number=None, k=None):
+    """Top-k similar historical customer/agent exchanges, personalized for this ticket"""
+    index = get_reply_index()
+    if not index:
+        return []
+    k = k or int(os.getenv('REPLY_INDEX_TOP_K', 3))
+    return [
+        {
+            'customer': personalize(exchange['customer'], customer_name, order_number),
+            'agent': personalize(exchange['agent'], customer_name, order_number)
+        }
+        for _, exchange in index.search(customer_message, k)
+    ]
+
 # ============================================================================
 # ENHANCED SYSTEM PROMPT
 # ============================================================================
 
-def build_system_prompt(customer_name, brand, context, knowledge):
+def build_system_prompt(customer_name, brand, context, knowledge, examples=None):
     """Build comprehensive system prompt"""
     
     # Build context summary
@@ -152,6 +174,15 @@ def build_system_prompt(customer_name, brand, context, knowledge):
     knowledge_section = f"RELEVANTE KENNIS:{newline}{knowledge}" if knowledge else ""
     instructions_section = f"ACTIES VOOR DIT BERICHT:{newline}{instructions_text}" if specific_instructions else ""
     
+    # Similar past exchanges (names/order numbers are masked in the index)
+    examples_section = ""
+    if examples:
+        example_texts = [
+            f"Klant: {example['customer']}{newline}Antwoord: {example['agent']}"
+            for example in examples
+        ]
+        examples_section = f"VERGELIJKBARE EERDERE GESPREKKEN (stijlvoorbeeld, NIET letterlijk overnemen):{newline}" + f"{newline}---{newline}".join(example_texts)
+    
     prompt = f"""Je bent {brand} klantenservice medewerker.
 
 {context_summary}
@@ -160,6 +191,8 @@ def build_system_prompt(customer_name, brand, context, knowledge):
 
 {instructions_section}
 
+{examples_section}
+
 ALGEMENE REGELS (ALTIJD VOLGEN):
 1. Begin ALTIJD met "Hi {customer_name}," (of "Hi," als naam leeg/onbekend is)
 2. Bedank voor bericht: "Bedankt voor je bericht."
@@ -181,9 +214,18 @@ BELANGRIJKSTE REGEL: Als je iets niet zeker weet - vraag om verduidelijking of b
 # RESPONSE GENERATION
 # ============================================================================
 
-def generate_response(customer_message, customer_name="", order_number=None, 
-                     email=None, subject=None):
-    """Generate improved response"""
+# Optimal generation parameters for the fine-tuned model
+COMPLETION_PARAMS = {
+    'temperature': 0.3,  # Lower for consistency
+    'max_tokens': 500,
+    'top_p': 0.9,
+    'presence_penalty': 0.1,
+    'frequency_penalty': 0.1
+}
+
+def prepare_generation(customer_message, customer_name="", order_number=None,
+                       email=None, subject=None):
+    """Steps 1-4: brand, context, knowledge and system prompt"""
     
     # Step 1: Brand detection
     brand = detect_brand(order_number, email, subject)
@@ -198,143 +240,347 @@ def generate_response(customer_message, customer_name="", order_number=None,
     # Step 3: Get relevant knowledge
     knowledge = get_relevant_knowledge(context)
     
+    # Step 3b: Similar historical exchanges as few-shot examples
+    examples = get_similar_exchanges(customer_message, customer_name, order_number)
+    
     # Step 4: Build system prompt
-    system_prompt = build_system_prompt(customer_name, brand, context, knowledge)
+    system_prompt = build_system_prompt(customer_name, brand, context, knowledge, examples)
     
-    # Step 5: Generate response with optimal parameters
-    try:
-        response = client.chat.completions.create(
-            model=FINETUNED_MODEL_ID,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": customer_message}
-            ],
-            temperature=0.3,  # Lower for consistency
-            max_tokens=500,
-            top_p=0.9,
-            presence_penalty=0.1,
-            frequency_penalty=0.1
-        )
-        
-        generated_text = response.choices[0].message.content
-        
-    except Exception as e:
-        print(f"Error generating response: {str(e)}")
-        return None
+    return {
+        'brand': brand,
+        'context': context,
+        'order_number': order_number,
+        'messages': [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": customer_message}
+        ]
+    }
+
+def finalize_response(generated_text, customer_message, customer_name, prepared):
+    """Steps 6-7: post-processing fixes and quality check"""
     
     # Step 6: Post-processing validation and fixes
     final_response, fixes = validate_and_fix_response(
         generated_text, 
         customer_name, 
-        brand, 
-        order_number,
-        context
+        prepared['brand'], 
+        prepared['order_number'],
+        prepared['context']
     )
     
     # Step 7: Quality check
-    quality = check_response_quality(final_response, customer_message, context)
+    quality = check_response_quality(final_response, customer_message, prepared['context'], prepared['brand'])
     
     return {
         'response': final_response,
-        'brand': brand,
+        'brand': prepared['brand'],
+        'intent': primary_intent(prepared['context']),
         'quality_score': quality['quality_score'],
         'fixes_applied': fixes,
         'warnings': quality['warnings'],
         'approved': quality['approved']
     }
 
-# ============================================================================
-# POST-PROCESSING & VALIDATION
-# ============================================================================
+def generation_candidates():
+    """Model + parameters per candidate, in preference order"""
+    return [
+        {'model': FINETUNED_MODEL_ID, **COMPLETION_PARAMS},
+        {'model': FALLBACK_MODEL_ID, **COMPLETION_PARAMS,
+         'temperature': float(os.getenv('FALLBACK_TEMPERATURE', COMPLETION_PARAMS['temperature']))}
+    ]
 
-def validate_and_fix_response(response, customer_name, brand, order_number, context):
-    """Validate and auto-fix common issues"""
-    fixes = []
-    
-    # Fix 1: Ensure proper greeting
-    if not response.strip().startswith(('Hi ', 'Hallo ', 'Beste ')):
-        greeting = f"Hi {customer_name}," if customer_name else "Hi,"
-        response = f"{greeting}\n\n" + response
-        fixes.append("Added greeting")
-    
-    # Fix 2: Ensure correct brand signature
-    wrong_signatures = {
-        "Freebird Icons": ["Team Simple the Brand", "Simple the Brand"],
-        "Simple the Brand": ["Team Freebird Icons", "Team Freebird\n020"]
+def complete_candidate(messages, candidate, cancel=None, trace=None):
+    """
+    Generated text for one candidate. With a cancel event the completion is
+    streamed so a losing race candidate can close its connection early.
+    """
+    trace = trace or PipelineTrace()
+    if cancel is None:
+        with trace.stage('openai'):
+            response = limited_create(client, messages=messages, **candidate)
+        trace.add_usage(response.usage)
+        return response.choices[0].message.content
+    
+    parts = []
+    with get_limiter().acquire(estimate_tokens(messages, candidate['max_tokens'])), trace.stage('openai'):
+        stream = client.chat.completions.create(messages=messages, stream=True, **candidate)
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    raise CandidateCancelled()
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+        finally:
+            stream.close()
+            # Streams carry no usage object - estimate what was generated so far
+            trace.add_usage(prompt_tokens=estimate_tokens(messages),
+                            completion_tokens=estimate_completion_tokens(''.join(parts)))
+    return ''.join(parts)
+
+async def complete_candidate_async(messages, candidate, trace=None):
+    """Async generated text for one candidate (race losers are cancelled as tasks)"""
+    trace = trace or PipelineTrace()
+    with trace.stage('openai'):
+        response = await limited_create_async(async_client, messages=messages, **candidate)
+    trace.add_usage(response.usage)
+    return response.choices[0].message.content
+
+def lookup_memoized(prepared, customer_message, customer_name="", trace=None):
+    """
+    Return (memo_key, personalized generation or None) for a prepared request.
+    Exact memo first, then the semantic cache for paraphrases.
+    """
+    trace = trace or PipelineTrace()
+    memo = get_response_memo()
+    key = memo.make_key(prepared, customer_message, customer_name)
+    generated_text = memo.lookup(key, customer_name, prepared['order_number'])
+    trace.hit('response_memo', generated_text is not None)
+    
+    semantic = get_semantic_cache()
+    if generated_text is None and semantic:
+        generated_text = semantic.lookup(
+            customer_message, prepared['brand'], prepared['context'], customer_name, prepared['order_number']
+        )
+        trace.hit('semantic_cache', generated_text is not None)
+    
+    return key, generated_text
+
+def prepare_traced(trace, customer_message, customer_name, order_number, email, subject):
+    """prepare_generation + memo lookup, timed as the 'prepare' and 'cache_lookup' stages"""
+    with trace.stage('prepare'):
+        prepared = prepare_generation(customer_message, customer_name, order_number, email, subject)
+    with trace.stage('cache_lookup'):
+        memo_key, memoized = lookup_memoized(prepared, customer_message, customer_name, trace)
+    return prepared, memo_key, memoized
+
+def attach_metrics(result, trace):
+    """Add the trace summary (timings_ms, usage, cache) to a result"""
+    if result:
+        result['metrics'] = trace.as_dict()
+    return result
+
+def remember_generation(memo_key, generated_text, customer_message, customer_name, prepared, result):
+    """Cache a fresh generation in the response memo and semantic cache if it passed the quality gate"""
+    if not result['approved']:
+        return
+    get_response_memo().remember(memo_key, generated_text, customer_name, prepared['order_number'])
+    semantic = get_semantic_cache()
+    if semantic:
+        semantic.add(
+            customer_message, generated_text, prepared['brand'], prepared['context'],
+            customer_name, prepared['order_number']
+        )
+
+def finalize_generation(memo_key, generated_text, customer_message, customer_name, prepared,
+                        memoized=False, trace=None, remember=True):
+    """finalize_response, then (with remember) cache fresh generations that pass the quality gate"""
+    trace = trace or PipelineTrace()
+    with trace.stage('postprocess'):
+        result = finalize_response(generated_text, customer_message, customer_name, prepared)
+    result['memoized'] = memoized
+    
+    if remember and not memoized:
+        remember_generation(memo_key, generated_text, customer_message, customer_name, prepared, result)
+    return result
+
+def strategy_callbacks(memo_key, customer_message, customer_name, prepared, trace):
+    """finalize / remember for run_strategy: every candidate is scored, only the chosen one is cached"""
+    return {
+        'finalize': lambda text: finalize_generation(
+            memo_key, text, customer_message, customer_name, prepared, trace=trace, remember=False
+        ),
+        'remember': lambda text, result: remember_generation(
+            memo_key, text, customer_message, customer_name, prepared, result
+        )
     }
+
+def generate_response(customer_message, customer_name="", order_number=None, 
+                     email=None, subject=None, trace=None):
+    """Generate improved response (stage timings, token usage and cache flags in result['metrics'])"""
     
-    if brand in wrong_signatures:
-        for wrong in wrong_signatures[brand]:
-            if wrong in response:
-                response = response.replace(wrong, f"Team {brand}")
-                fixes.append(f"Fixed brand signature")
+    trace = trace or PipelineTrace()
+    prepared, memo_key, memoized = prepare_traced(
+        trace, customer_message, customer_name, order_number, email, subject
+    )
     
-    # Fix 3: Remove false order number errors
-    if order_number:
-        # Don't claim customer's order number is wrong
-        if 'ordernummer klopt niet' in response.lower() or 'ordernummer is niet' in response.lower():
-            response = re.sub(r'.*ordernummer.*\(klopt\)?\s*niet.*\n?', '', response, flags=re.IGNORECASE)
-            fixes.append("Removed false order number error")
-    
-    # Fix 4: Remove made-up discount codes
-    code_pattern = re.search(r'Code:\s*(\w+\d+)', response)
-    if code_pattern:
-        code = code_pattern.group(1)
-        # If code looks personalized (has name/order), it's likely made up
-        if customer_name and customer_name.lower() in code.lower():
-            response = re.sub(r'Code:.*?\n', '', response)
-            response = re.sub(r'kortingscode.*?\n', '', response, flags=re.IGNORECASE)
-            fixes.append("Removed made-up discount code")
-    
-    # Fix 5: Ensure proper closing
-    if "Met vriendelijke groet" not in response:
-        response += f"\n\nMet vriendelijke groet,\n\nTeam {brand}\n020 8081004"
-        fixes.append("Added closing signature")
-    
-    return response, fixes
-
-def check_response_quality(response, customer_message, context):
-    """Check response quality and flag issues"""
-    issues = []
-    warnings = []
-    
-    # Critical checks
-    if not response.strip().startswith(('Hi ', 'Hallo ', 'Beste ')):
-        issues.append("Missing greeting")
-    
-    if "Met vriendelijke groet" not in response:
-        issues.append("Missing closing")
-    
-    if not any(team in response for team in ["Team Freebird", "Team Simple"]):
-        issues.append("Missing team signature")
-    
-    # Context-based warnings
-    if context['mentions_defect'] and not context['has_photos']:
-        if 'foto' not in response.lower() and 'photo' not in response.lower():
-            warnings.append("Customer mentions defect but response doesn't ask for photos")
+    # Near-identical ticket seen before - reuse that generation
+    if memoized:
+        return attach_metrics(finalize_generation(
+            memo_key, memoized, customer_message, customer_name, prepared, memoized=True, trace=trace
+        ), trace)
+    
+    # Step 5: Generate with the configured strategy (single / fallback / race)
+    return attach_metrics(run_strategy(
+        get_strategy_name(),
+        generation_candidates(),
+        complete=lambda candidate, cancel: complete_candidate(prepared['messages'], candidate, cancel, trace),
+        **strategy_callbacks(memo_key, customer_message, customer_name, prepared, trace)
+    ), trace)
+
+def generate_response_stream(customer_message, customer_name="", order_number=None,
+                             email=None, subject=None, trace=None):
+    """
+    Streaming variant of generate_response.
+    Yields ('delta', text) while the model writes, then ('done', result) with the
+    validated and quality-checked response, or ('error', message) on failure.
+    """
+    
+    trace = trace or PipelineTrace()
+    prepared, memo_key, memoized = prepare_traced(
+        trace, customer_message, customer_name, order_number, email, subject
+    )
     
-    if context['mentions_return'] and not context['order_number']:
-        if 'ordernummer' not in response.lower():
-            warnings.append("Customer wants return but no order number - response should ask for it")
+    if memoized:
+        trace.mark('first_token')
+        yield 'delta', memoized
+        yield 'done', attach_metrics(finalize_generation(
+            memo_key, memoized, customer_message, customer_name, prepared, memoized=True, trace=trace
+        ), trace)
+        return
     
-    # General checks
-    if len(response) < 50:
-        warnings.append("Response seems too short")
+    parts = []
+    estimated = estimate_tokens(prepared['messages'], COMPLETION_PARAMS['max_tokens'])
+    try:
+        # Hold the limiter slot until the stream is fully consumed
+        with get_limiter().acquire(estimated), trace.stage('openai'):
+            stream = client.chat.completions.create(
+                model=FINETUNED_MODEL_ID,
+                messages=prepared['messages'],
+                stream=True,
+                **COMPLETION_PARAMS
+            )
+            
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    trace.mark('first_token')
+                    parts.append(delta)
+                    yield 'delta', delta
+        
+    except Exception as e:
+        print(f"Error generating response: {str(e)}")
+        yield 'error', str(e)
+        return
+    
+    generated_text = ''.join(parts)
+    trace.add_usage(prompt_tokens=estimate_tokens(prepared['messages']),
+                    completion_tokens=estimate_completion_tokens(generated_text))
+    result = finalize_generation(memo_key, generated_text, customer_message, customer_name, prepared, trace=trace)
+    result['model'] = FINETUNED_MODEL_ID
+    
+    # Streamed text failed the quality gate - let the other candidates try (widget shows the 'done' text)
+    if not result['approved'] and get_strategy_name() != 'single':
+        retry = run_strategy(
+            'fallback',
+            generation_candidates()[1:],
+            complete=lambda candidate, cancel: complete_candidate(prepared['messages'], candidate, cancel, trace),
+            **strategy_callbacks(memo_key, customer_message, customer_name, prepared, trace)
+        )
+        if retry and retry['quality_score'] > result['quality_score']:
+            result = retry
     
-    if len(response) > 800:
-        warnings.append("Response is quite long")
+    yield 'done', attach_metrics(result, trace)
+
+async def generate_response_async(customer_message, customer_name="", order_number=None,
+                                  email=None, subject=None, trace=None):
+    """Non-blocking generate_response for asyncio servers"""
     
-    # Calculate quality score
-    quality_score = 100
-    quality_score -= len(issues) * 30  # Critical issues
-    quality_score -= len(warnings) * 10  # Warnings
+    trace = trace or PipelineTrace()
+    prepared, memo_key, memoized = await asyncio.to_thread(
+        prepare_traced, trace, customer_message, customer_name, order_number, email, subject
+    )
     
-    return {
-        'quality_score': max(0, quality_score),
-        'issues': issues,
-        'warnings': warnings,
-        'approved': len(issues) == 0 and quality_score >= 70
-    }
+    if memoized:
+        return attach_metrics(await asyncio.to_thread(
+            finalize_generation, memo_key, memoized, customer_message, customer_name, prepared,
+            memoized=True, trace=trace
+        ), trace)
+    
+    return attach_metrics(await run_strategy_async(
+        get_strategy_name(),
+        generation_candidates(),
+        complete=lambda candidate: complete_candidate_async(prepared['messages'], candidate, trace),
+        **strategy_callbacks(memo_key, customer_message, customer_name, prepared, trace)
+    ), trace)
+
+async def generate_response_stream_async(customer_message, customer_name="", order_number=None,
+                                         email=None, subject=None, trace=None):
+    """Non-blocking generate_response_stream for asyncio servers (same events)"""
+    
+    trace = trace or PipelineTrace()
+    prepared, memo_key, memoized = await asyncio.to_thread(
+        prepare_traced, trace, customer_message, customer_name, order_number, email, subject
+    )
+    
+    if memoized:
+        trace.mark('first_token')
+        yield 'delta', memoized
+        yield 'done', attach_metrics(await asyncio.to_thread(
+            finalize_generation, memo_key, memoized, customer_message, customer_name, prepared,
+            memoized=True, trace=trace
+        ), trace)
+        return
+    
+    parts = []
+    estimated = estimate_tokens(prepared['messages'], COMPLETION_PARAMS['max_tokens'])
+    try:
+        # Hold the limiter slot until the stream is fully consumed
+        async with get_limiter().acquire_async(estimated):
+            with trace.stage('openai'):
+                stream = await async_client.chat.completions.create(
+                    model=FINETUNED_MODEL_ID,
+                    messages=prepared['messages'],
+                    stream=True,
+                    **COMPLETION_PARAMS
+                )
+                
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        trace.mark('first_token')
+                        parts.append(delta)
+                        yield 'delta', delta
+        
+    except Exception as e:
+        print(f"Error generating response: {str(e)}")
+        yield 'error', str(e)
+        return
+    
+    generated_text = ''.join(parts)
+    trace.add_usage(prompt_tokens=estimate_tokens(prepared['messages']),
+                    completion_tokens=estimate_completion_tokens(generated_text))
+    result = await asyncio.to_thread(
+        finalize_generation, memo_key, generated_text, customer_message, customer_name, prepared, trace=trace
+    )
+    result['model'] = FINETUNED_MODEL_ID
+    
+    if not result['approved'] and get_strategy_name() != 'single':
+        retry = await run_strategy_async(
+            'fallback',
+            generation_candidates()[1:],
+            complete=lambda candidate: complete_candidate_async(prepared['messages'], candidate, trace),
+            **strategy_callbacks(memo_key, customer_message, customer_name, prepared, trace)
+        )
+        if retry and retry['quality_score'] > result['quality_score']:
+            result = retry
+    
+    yield 'done', attach_metrics(result, trace)
+
+# ============================================================================
+# POST-PROCESSING & VALIDATION
+# ============================================================================
+
+def validate_and_fix_response(response, customer_name, brand, order_number, context):
+    """Validate and auto-fix common issues (rules in response_rules.py)"""
+    return get_response_rules(brand).fix(response, customer_name, order_number, context)
+
+def check_response_quality(response, customer_message, context, brand="Freebird Icons"):
+    """Check response quality and flag issues (rules in response_rules.py)"""
+    return get_response_rules(brand).check(response, context)
 
 # ============================================================================
 # EXAMPLE USAGE
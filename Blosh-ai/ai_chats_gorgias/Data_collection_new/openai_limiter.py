@@ -0,0 +1,241 @@
+"""
+OpenAI Rate Limiter
+Process-wide governor for OpenAI calls: a semaphore caps in-flight requests and
+token buckets keep requests/minute and estimated tokens/minute under the account
+limits. Callers queue instead of failing with 429s.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+# ============================================================================
+# TOKEN BUCKET
+# ============================================================================
+
+class TokenBucket:
+    """Refills `capacity` units per minute, continuously"""
+
+    def __init__(self, capacity_per_minute):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (0 if available now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+# ============================================================================
+# LIMITER
+# ============================================================================
+
+def estimate_tokens(messages, max_tokens=None):
+    """Rough prompt + completion token estimate (~4 characters per token)"""
+    prompt_chars = sum(len(message.get('content') or '') for message in messages)
+    return prompt_chars // 4 + (max_tokens or 0)
+
+class OpenAIRateLimiter:
+    """Concurrency slots + request/token buckets, shared by every thread (and event loop) in the process"""
+
+    def __init__(self, max_concurrency=8, requests_per_minute=500, tokens_per_minute=200000):
+        self.max_concurrency = max_concurrency
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+
+        # Concurrency slots: threads wait on the condition, coroutines on a future that
+        # _release_slot resolves on their own loop (freed slots go to coroutines first)
+        self._free_slots = max_concurrency
+        self._slot_freed = threading.Condition(self._lock)
+        self._async_waiters = deque()  # (loop, future)
+
+        self.in_flight = 0
+        self.queued = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _take_slot(self):
+        with self._slot_freed:
+            while self._free_slots == 0:
+                self._slot_freed.wait()
+            self._free_slots -= 1
+
+    async def _take_slot_async(self):
+        with self._lock:
+            if self._free_slots > 0:
+                self._free_slots -= 1
+                return
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._async_waiters.append((loop, waiter))
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = (loop, waiter) in self._async_waiters
+                if queued:
+                    self._async_waiters.remove((loop, waiter))
+            # Cancelled right after the slot was handed over - pass it on
+            if not queued and waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self):
+        with self._lock:
+            if not self._async_waiters:
+                self._free_slots += 1
+                self._slot_freed.notify()
+                return
+            loop, waiter = self._async_waiters.popleft()
+        try:
+            loop.call_soon_threadsafe(self._hand_over, waiter)
+        except RuntimeError:
+            # The waiter's loop is closed - give the slot to the next caller
+            self._release_slot()
+
+    def _hand_over(self, waiter):
+        """Runs on the waiter's loop; a waiter cancelled meanwhile passes the slot on"""
+        if waiter.cancelled():
+            self._release_slot()
+        else:
+            waiter.set_result(None)
+
+    def _reserve(self, estimated_tokens):
+        """Take budget for one request, or return seconds to wait before trying again"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(estimated_tokens, now))
+            if wait == 0:
+                self._requests.take(1)
+                self._tokens.take(estimated_tokens)
+            return wait
+
+    def _record_start(self, started):
+        waited = time.monotonic() - started
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+            self.calls += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def _record_end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def acquire(self, estimated_tokens=0):
+        """Block until a concurrency slot and rate budget are available"""
+        started = time.monotonic()
+        with self._lock:
+            self.queued += 1
+
+        self._take_slot()
+        try:
+            wait = self._reserve(estimated_tokens)
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._reserve(estimated_tokens)
+        except BaseException:
+            self._release_slot()
+            with self._lock:
+                self.queued -= 1
+            raise
+
+        self._record_start(started)
+        try:
+            yield
+        finally:
+            self._record_end()
+            self._release_slot()
+
+    @asynccontextmanager
+    async def acquire_async(self, estimated_tokens=0):
+        """Non-blocking acquire for asyncio code (shares the same slots and buckets)"""
+        started = time.monotonic()
+        with self._lock:
+            self.queued += 1
+
+        try:
+            await self._take_slot_async()
+            try:
+                wait = self._reserve(estimated_tokens)
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = self._reserve(estimated_tokens)
+            except BaseException:
+                self._release_slot()
+                raise
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            raise
+
+        self._record_start(started)
+        try:
+            yield
+        finally:
+            self._record_end()
+            self._release_slot()
+
+    def stats(self):
+        """Queue depth and wait-time metrics for health reporting"""
+        with self._lock:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'requests_per_minute': int(self._requests.capacity),
+                'tokens_per_minute': int(self._tokens.capacity),
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'calls': self.calls,
+                'avg_wait_seconds': round(self.total_wait / self.calls, 3) if self.calls else 0.0,
+                'max_wait_seconds': round(self.max_wait, 3)
+            }
+
+# ============================================================================
+# SHARED LIMITER
+# ============================================================================
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter():
+    """Process-wide limiter configured from OPENAI_MAX_CONCURRENCY / OPENAI_RPM / OPENAI_TPM"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = OpenAIRateLimiter(
+                max_concurrency=int(os.getenv('OPENAI_MAX_CONCURRENCY', 8)),
+                requests_per_minute=int(os.getenv('OPENAI_RPM', 500)),
+                tokens_per_minute=int(os.getenv('OPENAI_TPM', 200000))
+            )
+        return _limiter
+
+def limited_create(client, **kwargs):
+    """client.chat.completions.create(**kwargs) under the shared limiter"""
+    estimated = estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens'))
+    with get_limiter().acquire(estimated):
+        return client.chat.completions.create(**kwargs)
+
+async def limited_create_async(async_client, **kwargs):
+    """Async client.chat.completions.create(**kwargs) under the shared limiter"""
+    estimated = estimate_tokens(kwargs.get('messages', []), kwargs.get('max_tokens'))
+    async with get_limiter().acquire_async(estimated):
+        return await async_client.chat.completions.create(**kwargs)
@@ -0,0 +1,213 @@
+"""
+Pipeline Metrics
+Per-request stage timings, OpenAI token usage and cache-hit flags for the
+suggestion pipeline (PipelineTrace), plus a small process-wide registry of
+Prometheus histograms and counters rendered by the widget servers at /metrics.
+
+Stages: gorgias_fetch, prepare, cache_lookup, openai, postprocess, first_token
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds (upper bounds), covering cache hits up to slow generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+# ============================================================================
+# PER-REQUEST TRACE
+# ============================================================================
+
+class PipelineTrace:
+    """
+    Timings (ms), token usage and cache flags for one suggestion request.
+    Thread-safe: race candidates add to the same trace from pool threads, so
+    'openai' is the summed model time of every candidate that ran.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'estimated': False}
+        self.cache = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Add the duration of the with-block to stage `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds * 1000
+
+    def mark(self, name):
+        """Record the time since the trace started (e.g. first_token), once"""
+        with self._lock:
+            if name not in self.timings:
+                self.timings[name] = (time.perf_counter() - self.started) * 1000
+
+    def add_usage(self, usage=None, prompt_tokens=0, completion_tokens=0):
+        """Token usage from an OpenAI response (`response.usage`) or an estimate"""
+        with self._lock:
+            if usage is not None:
+                self.usage['prompt_tokens'] += usage.prompt_tokens or 0
+                self.usage['completion_tokens'] += usage.completion_tokens or 0
+            else:
+                self.usage['prompt_tokens'] += prompt_tokens
+                self.usage['completion_tokens'] += completion_tokens
+                self.usage['estimated'] = True
+
+    def hit(self, cache_name, hit=True):
+        """Flag whether a cache layer answered this request"""
+        with self._lock:
+            self.cache[cache_name] = hit
+
+    def as_dict(self):
+        with self._lock:
+            timings = {name: round(ms, 1) for name, ms in self.timings.items()}
+            timings['total'] = round((time.perf_counter() - self.started) * 1000, 1)
+            usage = dict(self.usage, total_tokens=self.usage['prompt_tokens'] + self.usage['completion_tokens'])
+            return {'timings_ms': timings, 'usage': usage, 'cache': dict(self.cache)}
+
+def estimate_completion_tokens(text):
+    """Rough token count for streamed text (~4 characters per token)"""
+    return len(text or '') // 4
+
+# ============================================================================
+# PROMETHEUS REGISTRY
+# ============================================================================
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """Histograms, counters and gauges keyed by (name, sorted labels); text exposition format"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._help = {}
+        self._types = {}
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def _declare(self, name, kind, help_text):
+        self._types.setdefault(name, kind)
+        self._help.setdefault(name, help_text)
+
+    def observe(self, name, value, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'histogram', help_text)
+            series = self._histograms.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def inc(self, name, amount=1, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'counter', help_text)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, help_text='', **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'gauge', help_text)
+            self._gauges[key] = value
+
+    def render(self):
+        """Prometheus text exposition (version 0.0.4)"""
+        with self._lock:
+            series_by_name = {}
+            for (name, labels), series in self._histograms.items():
+                series_by_name.setdefault(name, []).append((labels, list(series)))
+            for (name, labels), value in list(self._counters.items()) + list(self._gauges.items()):
+                series_by_name.setdefault(name, []).append((labels, value))
+
+            lines = []
+            for name in sorted(series_by_name):
+                if self._help.get(name):
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {self._types[name]}")
+                for labels, value in sorted(series_by_name[name]):
+                    if self._types[name] != 'histogram':
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                        continue
+                    for bound, count in zip(self.buckets + (math.inf,), value[:len(self.buckets)] + [value[-1]]):
+                        bucket_labels = labels + (('le', _format_value(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {round(value[-2], 6)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+            return '\n'.join(lines) + '\n'
+
+# ============================================================================
+# SHARED REGISTRY
+# ============================================================================
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_metrics():
+    """Process-wide registry (each gunicorn worker keeps its own; scrape per worker or use 1 worker)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+def suggestion_source(trace, response_data):
+    """Where a suggestion came from: cached, coalesced, memoized, semantic, generated or failed"""
+    if not response_data:
+        return 'failed'
+    if trace.cache.get('suggestion_store'):
+        return 'cached'
+    if trace.cache.get('coalesced'):
+        return 'coalesced'
+    if trace.cache.get('response_memo'):
+        return 'memoized'
+    if trace.cache.get('semantic_cache'):
+        return 'semantic'
+    return 'generated'
+
+def record_suggestion(trace, endpoint, response_data=None):
+    """Feed a finished request's trace into the histograms/counters"""
+    if os.getenv('PIPELINE_METRICS', 'on').lower() == 'off':
+        return
+    metrics = get_metrics()
+    summary = trace.as_dict()
+
+    for stage, ms in summary['timings_ms'].items():
+        if stage == 'total':
+            metrics.observe('suggestion_duration_seconds', ms / 1000,
+                            'End-to-end suggestion latency', endpoint=endpoint)
+        else:
+            metrics.observe('suggestion_stage_duration_seconds', ms / 1000,
+                            'Suggestion pipeline stage latency', endpoint=endpoint, stage=stage)
+
+    metrics.inc('suggestion_requests_total', 1, 'Suggestion requests by result source',
+                endpoint=endpoint, source=suggestion_source(trace, response_data))
+
+    for kind in ('prompt', 'completion'):
+        tokens = summary['usage'][f'{kind}_tokens']
+        if tokens:
+            metrics.inc('openai_tokens_total', tokens, 'OpenAI tokens used by suggestions', kind=kind)
@@ -122,7 +122,7 @@ def generate_better_response(client, model_id, customer_message, customer_name="
             order_number="102345678"
         )
     """
-    import re
+    from response_rules import get_response_rules
     
     # Brand detection
     brand = "Simple the Brand" if order_number and str(order_number).startswith('203') else "Freebird Icons"
@@ -170,22 +170,9 @@ TONE: Vriendelijk, behulpzaam, professioneel maar persoonlijk"""
     
     result = response.choices[0].message.content
     
-    # Quick fixes
-    if not result.strip().startswith(('Hi ', 'Hallo ', 'Beste ')):
-        result = f"Hi {customer_name or ''},\n\n" + result
-    
-    # Fix brand confusion
-    wrong_brands = {
-        "Freebird Icons": ["Team Simple the Brand", "Simple the Brand"],
-        "Simple the Brand": ["Team Freebird Icons", "Team Freebird\n020"]
-    }
-    for wrong in wrong_brands.get(brand, []):
-        if wrong in result:
-            result = result.replace(wrong, f"Team {brand}")
-    
-    # Remove made-up codes
-    if customer_name and customer_name.lower() in result.lower():
-        result = re.sub(r'Code:\s*[\w\d]+', '', result)
+    # Quick fixes: greeting, brand confusion, made-up codes, closing
+    # (same rules as the widget, see response_rules.py)
+    result, _ = get_response_rules(brand).fix(result, customer_name, order_number)
     
     return result
 
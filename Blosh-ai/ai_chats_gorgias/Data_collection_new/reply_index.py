@@ -0,0 +1,126 @@
+"""
+Reply Index
+Retrieval over historical customer/agent exchanges for few-shot prompting.
+The index is built offline (data_processing/build_reply_index.py) into a
+float32 .npy matrix of hashed n-gram embeddings plus a JSON file with the
+exchanges. The matrix is memory-mapped on first query, so startup stays fast
+and every worker shares the same pages.
+"""
+
+import json
+import os
+import threading
+
+# Optional dependency: without NumPy the feature is disabled instead of breaking imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from semantic_cache import HashingVectorizer
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reply_index')
+
+MATRIX_FILE = 'embeddings.npy'
+EXCHANGES_FILE = 'exchanges.json'
+
+# Smaller than the semantic cache: the index holds thousands of rows and is scanned per query
+INDEX_DIM = 1024
+
+# ============================================================================
+# BUILD
+# ============================================================================
+
+def save_index(exchanges, index_dir=DEFAULT_INDEX_DIR, dim=INDEX_DIM):
+    """
+    Embed exchanges ({'customer', 'agent', ...} dicts) on the customer side
+    and write the matrix + exchanges to index_dir. Returns the row count.
+    """
+    vectorizer = HashingVectorizer(dim=dim)
+    matrix = np.zeros((len(exchanges), dim), dtype=np.float32)
+    for row, exchange in enumerate(exchanges):
+        matrix[row] = vectorizer.transform(exchange['customer'])
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, MATRIX_FILE), matrix)
+    with open(os.path.join(index_dir, EXCHANGES_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'dim': dim, 'exchanges': exchanges}, f, ensure_ascii=False)
+
+    return len(exchanges)
+
+# ============================================================================
+# SEARCH
+# ============================================================================
+
+class ReplyIndex:
+    """Lazily loaded, memory-mapped top-k search over historical exchanges"""
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR, min_similarity=0.3):
+        self.index_dir = index_dir
+        self.min_similarity = min_similarity
+        self._matrix = None
+        self._exchanges = None
+        self._vectorizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            matrix_path = os.path.join(self.index_dir, MATRIX_FILE)
+            exchanges_path = os.path.join(self.index_dir, EXCHANGES_FILE)
+
+            if os.path.exists(matrix_path) and os.path.exists(exchanges_path):
+                with open(exchanges_path, encoding='utf-8') as f:
+                    data = json.load(f)
+                self._matrix = np.load(matrix_path, mmap_mode='r')
+                self._exchanges = data['exchanges']
+                self._vectorizer = HashingVectorizer(dim=data['dim'])
+            self._loaded = True
+
+    @property
+    def available(self):
+        self._load()
+        return self._matrix is not None and len(self._exchanges) > 0
+
+    def search(self, customer_message, k=3):
+        """Top-k exchanges similar to the message as (similarity, exchange), best first"""
+        if not self.available or not customer_message:
+            return []
+
+        similarities = self._matrix @ self._vectorizer.transform(customer_message)
+        k = min(k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [
+            (float(similarities[row]), self._exchanges[row])
+            for row in top if similarities[row] >= self.min_similarity
+        ]
+
+    def stats(self):
+        return {
+            'loaded': self._loaded,
+            'size': len(self._exchanges) if self._exchanges else 0,
+            'index_dir': self.index_dir
+        }
+
+# ============================================================================
+# SHARED INDEX
+# ============================================================================
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_reply_index():
+    """Process-wide index from REPLY_INDEX_DIR (None if retrieval is disabled or NumPy is missing)"""
+    global _index
+    if np is None or os.getenv('REPLY_INDEX', '1') in ('0', 'false', 'off'):
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = ReplyIndex(
+                index_dir=os.getenv('REPLY_INDEX_DIR', DEFAULT_INDEX_DIR),
+                min_similarity=float(os.getenv('REPLY_INDEX_MIN_SIMILARITY', 0.3))
+            )
+        return _index
@@ -0,0 +1,116 @@
+"""
+Response Memo
+Disk-backed memoization of model generations for near-identical tickets.
+Key = built system prompt + normalized customer message, with the customer's
+name and order numbers masked, so "ik wil retour doen 102345678" from Petra
+reuses the generation for the same request from Dana.
+"""
+
+import hashlib
+import os
+import re
+import threading
+
+from suggestion_cache import SQLiteSuggestionStore
+
+DEFAULT_MEMO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'response_memo.db')
+
+NAME_PLACEHOLDER = '<NAME>'
+ORDER_PLACEHOLDER = '<ORDER>'
+
+# Freebird (102xxxxxx) and Simple (203xxxxx) order numbers - same as extract_context
+ORDER_PATTERN = re.compile(r'\b(?:102\d{6}|203\d{5})\b')
+
+# ============================================================================
+# NORMALIZATION
+# ============================================================================
+
+def _name_pattern(customer_name):
+    """Regex for the full name and its first part, or None if there is no name"""
+    parts = [p for p in {(customer_name or '').strip(), (customer_name or '').strip().split(' ')[0]} if len(p) >= 2]
+    if not parts:
+        return None
+    alternatives = '|'.join(re.escape(p) for p in sorted(parts, key=len, reverse=True))
+    return re.compile(rf'\b(?:{alternatives})\b', re.IGNORECASE)
+
+def mask_personal(text, customer_name='', order_number=None):
+    """Replace the customer's name and order numbers with placeholders"""
+    if order_number:
+        text = text.replace(str(order_number).strip(), ORDER_PLACEHOLDER)
+    text = ORDER_PATTERN.sub(ORDER_PLACEHOLDER, text)
+
+    pattern = _name_pattern(customer_name)
+    if pattern:
+        text = pattern.sub(NAME_PLACEHOLDER, text)
+    return text
+
+def normalize_message(customer_message, customer_name='', order_number=None):
+    """Masked, lowercased, whitespace-collapsed message"""
+    text = mask_personal(customer_message or '', customer_name, order_number)
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    return text.rstrip('.!?, ')
+
+def personalize(template, customer_name='', order_number=None):
+    """Fill placeholders in a memoized generation for the current ticket"""
+    text = template.replace(ORDER_PLACEHOLDER, str(order_number or 'je bestelling'))
+    first_name = (customer_name or '').strip().split(' ')[0]
+    return text.replace(NAME_PLACEHOLDER, first_name)
+
+# ============================================================================
+# MEMO
+# ============================================================================
+
+class ResponseMemo:
+    """Size-bounded SQLite memo of generations (hit/miss counters via the store)"""
+
+    def __init__(self, path=DEFAULT_MEMO_PATH, max_entries=5000, ttl_seconds=7 * 24 * 3600, enabled=True):
+        self.enabled = enabled
+        self.store = SQLiteSuggestionStore(path=path, max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    def make_key(self, prepared, customer_message, customer_name=''):
+        """Hash of the masked system prompt and the normalized customer message"""
+        system_prompt = prepared['messages'][0]['content']
+        masked_prompt = mask_personal(system_prompt, customer_name, prepared['order_number'])
+        message = normalize_message(customer_message, customer_name, prepared['order_number'])
+        digest = hashlib.sha256(f"{masked_prompt}\n\n{message}".encode('utf-8')).hexdigest()
+        return f"memo:{digest[:32]}"
+
+    def lookup(self, key, customer_name='', order_number=None):
+        """Personalized generation text for this ticket, or None"""
+        if not self.enabled:
+            return None
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        return personalize(entry['template'], customer_name, order_number)
+
+    def remember(self, key, generated_text, customer_name='', order_number=None):
+        """Store a generation with the customer's name and order number masked"""
+        if not self.enabled:
+            return
+        self.store.set(key, {'template': mask_personal(generated_text, customer_name, order_number)})
+
+    def stats(self):
+        stats = self.store.stats()
+        stats['enabled'] = self.enabled
+        return stats
+
+# ============================================================================
+# SHARED MEMO
+# ============================================================================
+
+_memo = None
+_memo_lock = threading.Lock()
+
+def get_response_memo():
+    """Process-wide memo configured from RESPONSE_MEMO* environment variables"""
+    global _memo
+    with _memo_lock:
+        if _memo is None:
+            _memo = ResponseMemo(
+                path=os.getenv('RESPONSE_MEMO_PATH', DEFAULT_MEMO_PATH),
+                max_entries=int(os.getenv('RESPONSE_MEMO_SIZE', 5000)),
+                ttl_seconds=int(os.getenv('RESPONSE_MEMO_TTL', 7 * 24 * 3600)),
+                enabled=os.getenv('RESPONSE_MEMO', '1') not in ('0', 'false', 'off')
+            )
+        return _memo
@@ -0,0 +1,263 @@
+"""
+Response Rules
+Declarative post-processing fixes and quality checks for generated responses.
+Rules are plain dicts (DEFAULT_RULES, optionally overridden per brand from a
+JSON file), compiled once per brand and shared by improved_response_generator
+and quick_improvements.
+
+Rule file format (RESPONSE_RULES_PATH), rules are matched by id:
+    {
+        "default": {"checks": [{"id": "too_long", "max_length": 1000}]},
+        "Simple the Brand": {"fixes": [{"id": "discount_code", "enabled": false}]}
+    }
+"""
+
+import copy
+import json
+import os
+import re
+import threading
+
+from context_matcher import get_context_matcher
+
+# ============================================================================
+# DEFAULT RULES
+# ============================================================================
+# Fix types:   prefix, replace, remove, suffix
+# Check types: prefix, contains, intent, min_length, max_length
+# `when` lists facts that must be truthy ("!fact" = must be falsy). Facts are the
+# extract_context flags plus customer_name / order_number.
+
+GREETING_PREFIXES = ['Hi ', 'Hallo ', 'Beste ']
+CLOSING = 'Met vriendelijke groet'
+
+DEFAULT_RULES = {
+    'default': {
+        'fixes': [
+            {'id': 'greeting', 'type': 'prefix', 'prefixes': GREETING_PREFIXES,
+             'template': '{greeting}\n\n', 'fix': 'Added greeting'},
+            {'id': 'brand_signature', 'type': 'replace', 'find': [],
+             'template': 'Team {brand}', 'fix': 'Fixed brand signature'},
+            {'id': 'false_order_number_error', 'type': 'remove', 'when': ['order_number'],
+             'pattern': r'.*ordernummer\s+(?:klopt|is)\s+niet.*\n?', 'flags': 'i',
+             'fix': 'Removed false order number error'},
+            {'id': 'discount_code', 'type': 'remove', 'when': ['customer_name'],
+             'pattern': r'Code:\s*(\w+\d+).*\n?', 'only_if_group_contains_name': True,
+             'also_remove': [r'kortingscode.*\n?'],
+             'fix': 'Removed made-up discount code'},
+            {'id': 'closing', 'type': 'suffix', 'contains': CLOSING,
+             'template': '\n\n' + CLOSING + ',\n\nTeam {brand}\n020 8081004',
+             'fix': 'Added closing signature'}
+        ],
+        'checks': [
+            {'id': 'greeting', 'type': 'prefix', 'prefixes': GREETING_PREFIXES,
+             'severity': 'issue', 'message': 'Missing greeting'},
+            {'id': 'closing', 'type': 'contains', 'any': [CLOSING],
+             'severity': 'issue', 'message': 'Missing closing'},
+            {'id': 'team_signature', 'type': 'contains', 'any': ['Team Freebird', 'Team Simple'],
+             'severity': 'issue', 'message': 'Missing team signature'},
+            {'id': 'ask_photos', 'type': 'intent', 'intent': 'photo_request',
+             'when': ['mentions_defect', '!has_photos'], 'severity': 'warning',
+             'message': "Customer mentions defect but response doesn't ask for photos"},
+            {'id': 'ask_order_number', 'type': 'intent', 'intent': 'order_number_request',
+             'when': ['mentions_return', '!order_number'], 'severity': 'warning',
+             'message': 'Customer wants return but no order number - response should ask for it'},
+            {'id': 'too_short', 'type': 'min_length', 'min_length': 50,
+             'severity': 'warning', 'message': 'Response seems too short'},
+            {'id': 'too_long', 'type': 'max_length', 'max_length': 800,
+             'severity': 'warning', 'message': 'Response is quite long'}
+        ],
+        'scoring': {'issue_penalty': 30, 'warning_penalty': 10, 'approve_min_score': 70}
+    },
+    'Freebird Icons': {
+        'fixes': [{'id': 'brand_signature', 'find': ['Team Simple the Brand', 'Simple the Brand']}]
+    },
+    'Simple the Brand': {
+        'fixes': [{'id': 'brand_signature', 'find': ['Team Freebird Icons', 'Team Freebird\n020']}]
+    }
+}
+
+# ============================================================================
+# ENGINE
+# ============================================================================
+
+def _merge_rules(rules, overrides, drop_disabled=True):
+    """Override rules by id; unknown ids are appended, `enabled: false` drops a rule"""
+    merged = [dict(rule) for rule in rules]
+    by_id = {rule['id']: rule for rule in merged}
+    for override in overrides:
+        if override['id'] in by_id:
+            by_id[override['id']].update(override)
+        else:
+            merged.append(dict(override))
+            by_id[override['id']] = merged[-1]
+    if not drop_disabled:
+        return merged
+    return [rule for rule in merged if rule.get('enabled', True)]
+
+def _conditions_met(rule, facts):
+    for fact in rule.get('when', []):
+        if fact.startswith('!'):
+            if facts.get(fact[1:]):
+                return False
+        elif not facts.get(fact):
+            return False
+    return True
+
+class ResponseRules:
+    """Compiled fix and check rules for one brand"""
+
+    def __init__(self, brand, fixes, checks, scoring):
+        self.brand = brand
+        self.fixes = [self._compile(rule) for rule in fixes]
+        self.checks = checks
+        self.scoring = scoring
+
+    @staticmethod
+    def _compile(rule):
+        """
+        Precompile a rule's patterns. The strings of a `replace` rule and the `also_remove`
+        patterns of a `remove` rule become one alternation each, so each is a single pass
+        """
+        rule = dict(rule)
+        if rule['type'] == 'replace':
+            # Longest first, so 'Team Simple the Brand' wins over 'Simple the Brand'
+            finds = sorted(rule['find'], key=len, reverse=True)
+            rule['find_regex'] = re.compile('|'.join(map(re.escape, finds))) if finds else None
+        elif rule['type'] == 'remove':
+            flags = re.IGNORECASE if 'i' in rule.get('flags', '') else 0
+            rule['regex'] = re.compile(rule['pattern'], flags)
+            also = rule.get('also_remove', [])
+            rule['also_regex'] = re.compile('|'.join(f'(?:{p})' for p in also), re.IGNORECASE) if also else None
+        return rule
+
+    def fix(self, response, customer_name='', order_number=None, context=None):
+        """Apply fix rules in order; returns (response, descriptions of fixes applied)"""
+        facts = dict(context or {}, customer_name=customer_name, order_number=order_number)
+        values = {
+            'brand': self.brand,
+            'customer_name': customer_name or '',
+            'greeting': f"Hi {customer_name}," if customer_name else "Hi,"
+        }
+        applied = []
+
+        for rule in self.fixes:
+            if not _conditions_met(rule, facts):
+                continue
+            kind = rule['type']
+
+            if kind == 'prefix':
+                if not response.strip().startswith(tuple(rule['prefixes'])):
+                    response = rule['template'].format(**values) + response
+                    applied.append(rule['fix'])
+
+            elif kind == 'replace':
+                if rule['find_regex'] is None:
+                    continue
+                replacement = rule['template'].format(**values)
+                response, count = rule['find_regex'].subn(lambda _: replacement, response)
+                if count:
+                    applied.append(rule['fix'])
+
+            elif kind == 'remove':
+                match = rule['regex'].search(response)
+                if not match:
+                    continue
+                if rule.get('only_if_group_contains_name'):
+                    # A code containing the customer's name is almost certainly made up
+                    if not customer_name or customer_name.lower() not in match.group(1).lower():
+                        continue
+                response = rule['regex'].sub('', response)
+                if rule['also_regex']:
+                    response = rule['also_regex'].sub('', response)
+                applied.append(rule['fix'])
+
+            elif kind == 'suffix':
+                if rule['contains'] not in response:
+                    response += rule['template'].format(**values)
+                    applied.append(rule['fix'])
+
+        return response, applied
+
+    def check(self, response, context=None):
+        """Run check rules; returns quality_score, issues, warnings, approved"""
+        facts = context or {}
+        issues = []
+        warnings = []
+        response_intents = get_context_matcher().scan(response)['intents']
+        stripped = response.strip()
+
+        for rule in self.checks:
+            if not _conditions_met(rule, facts):
+                continue
+            kind = rule['type']
+
+            if kind == 'prefix':
+                passed = stripped.startswith(tuple(rule['prefixes']))
+            elif kind == 'contains':
+                passed = any(text in response for text in rule['any'])
+            elif kind == 'intent':
+                passed = rule['intent'] in response_intents
+            elif kind == 'min_length':
+                passed = len(response) >= rule['min_length']
+            elif kind == 'max_length':
+                passed = len(response) <= rule['max_length']
+            else:
+                continue
+
+            if not passed:
+                (issues if rule['severity'] == 'issue' else warnings).append(rule['message'])
+
+        quality_score = 100
+        quality_score -= len(issues) * self.scoring['issue_penalty']
+        quality_score -= len(warnings) * self.scoring['warning_penalty']
+
+        return {
+            'quality_score': max(0, quality_score),
+            'issues': issues,
+            'warnings': warnings,
+            'approved': len(issues) == 0 and quality_score >= self.scoring['approve_min_score']
+        }
+
+# ============================================================================
+# PER-BRAND RULES
+# ============================================================================
+
+def load_rule_config(path=None):
+    """DEFAULT_RULES plus the sections of RESPONSE_RULES_PATH (if set)"""
+    config = copy.deepcopy(DEFAULT_RULES)
+    path = path or os.getenv('RESPONSE_RULES_PATH')
+    if path:
+        with open(path, encoding='utf-8') as f:
+            for section, rules in json.load(f).items():
+                target = config.setdefault(section, {})
+                for key in ('fixes', 'checks'):
+                    target[key] = _merge_rules(target.get(key, []), rules.get(key, []), drop_disabled=False)
+                if 'scoring' in rules:
+                    target['scoring'] = dict(target.get('scoring', {}), **rules['scoring'])
+    return config
+
+def build_rules(brand, config):
+    """Default rules with the brand's overrides applied"""
+    default = config['default']
+    section = config.get(brand, {})
+    return ResponseRules(
+        brand,
+        _merge_rules(default['fixes'], section.get('fixes', [])),
+        _merge_rules(default['checks'], section.get('checks', [])),
+        dict(default['scoring'], **section.get('scoring', {}))
+    )
+
+_rules = {}
+_rules_config = None
+_rules_lock = threading.Lock()
+
+def get_response_rules(brand):
+    """Compiled rules for a brand (built once per process)"""
+    global _rules_config
+    with _rules_lock:
+        if brand not in _rules:
+            if _rules_config is None:
+                _rules_config = load_rule_config()
+            _rules[brand] = build_rules(brand, _rules_config)
+        return _rules[brand]
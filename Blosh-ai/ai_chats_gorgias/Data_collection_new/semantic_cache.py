@@ -0,0 +1,171 @@
+"""
+Semantic Response Cache
+Catches paraphrases the exact-match memo misses ("ik wil retourneren" vs
+"graag retour aanmelden"). Messages are embedded locally with a hashing
+character n-gram vectorizer (no network, no model download) into a NumPy
+matrix; lookups are one matrix-vector product plus a top-k partition.
+A cached template is only reused when brand and extract_context flags match.
+"""
+
+import os
+import re
+import threading
+import zlib
+
+# Optional dependency: without NumPy the feature is disabled instead of breaking imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from response_memo import mask_personal, personalize
+
+# ============================================================================
+# VECTORIZER
+# ============================================================================
+
+class HashingVectorizer:
+    """Character n-grams hashed into a fixed number of buckets, L2-normalized"""
+
+    def __init__(self, dim=4096, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def transform(self, text):
+        text = ' ' + re.sub(r'\s+', ' ', text.lower()).strip() + ' '
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            for i in range(len(text) - n + 1):
+                # crc32 is stable across processes, unlike hash()
+                vector[zlib.crc32(text[i:i + n].encode('utf-8')) % self.dim] += 1.0
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+# The extract_context flags that change the system prompt
+CONTEXT_FLAGS = ('has_photos', 'mentions_defect', 'mentions_return', 'mentions_late_return')
+
+def cache_group(brand, context, customer_name=''):
+    """Entries are only comparable within the same brand, context flags and name/order presence"""
+    flags = tuple(bool(context.get(flag)) for flag in CONTEXT_FLAGS)
+    return (brand, flags, bool(context.get('order_number')), bool((customer_name or '').strip()))
+
+class SemanticResponseCache:
+    """
+    Fixed-size NumPy matrix of message embeddings with per-row templates.
+    When full, the least recently used row is overwritten.
+    """
+
+    def __init__(self, max_entries=2000, threshold=0.85, dim=4096):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.vectorizer = HashingVectorizer(dim=dim)
+
+        self._matrix = np.zeros((max_entries, dim), dtype=np.float32)
+        self._groups = np.full(max_entries, -1, dtype=np.int64)  # -1 = empty row
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._templates = [None] * max_entries
+        self._group_ids = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _group_id(self, group):
+        return self._group_ids.setdefault(group, len(self._group_ids))
+
+    def _search(self, vector, group, k):
+        """Top-k (similarity, row) within a group, best first; caller holds the lock"""
+        group_id = self._group_ids.get(group)
+        if group_id is None:
+            return []
+
+        similarities = self._matrix @ vector
+        similarities[self._groups != group_id] = -1.0
+
+        k = min(k, self.max_entries)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [(float(similarities[row]), int(row)) for row in top if similarities[row] > 0]
+
+    def search(self, customer_message, brand, context, customer_name='', order_number=None, k=5):
+        """Top-k (similarity, masked template) for comparable cached messages, best first"""
+        vector = self.vectorizer.transform(mask_personal(customer_message, customer_name, order_number))
+        with self._lock:
+            matches = self._search(vector, cache_group(brand, context, customer_name), k)
+            return [(similarity, self._templates[row]) for similarity, row in matches]
+
+    def lookup(self, customer_message, brand, context, customer_name='', order_number=None):
+        """Personalized template of the closest cached message above the threshold, or None"""
+        vector = self.vectorizer.transform(mask_personal(customer_message, customer_name, order_number))
+        with self._lock:
+            matches = self._search(vector, cache_group(brand, context, customer_name), 1)
+            if not matches or matches[0][0] < self.threshold:
+                self.misses += 1
+                return None
+
+            row = matches[0][1]
+            self._clock += 1
+            self._last_used[row] = self._clock
+            self.hits += 1
+            template = self._templates[row]
+
+        return personalize(template, customer_name, order_number)
+
+    def add(self, customer_message, generated_text, brand, context, customer_name='', order_number=None):
+        """Cache a vetted generation (name and order number masked)"""
+        vector = self.vectorizer.transform(mask_personal(customer_message, customer_name, order_number))
+        template = mask_personal(generated_text, customer_name, order_number)
+
+        with self._lock:
+            empty = np.flatnonzero(self._groups == -1)
+            if len(empty):
+                row = int(empty[0])
+            else:
+                row = int(np.argmin(self._last_used))
+                self.evictions += 1
+
+            self._clock += 1
+            self._matrix[row] = vector
+            self._groups[row] = self._group_id(cache_group(brand, context, customer_name))
+            self._last_used[row] = self._clock
+            self._templates[row] = template
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': int(np.count_nonzero(self._groups != -1)),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+# ============================================================================
+# SHARED CACHE
+# ============================================================================
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_semantic_cache():
+    """Process-wide cache configured from SEMANTIC_CACHE* environment variables (None if disabled or NumPy is missing)"""
+    global _cache
+    if np is None or os.getenv('SEMANTIC_CACHE', '1') in ('0', 'false', 'off'):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticResponseCache(
+                max_entries=int(os.getenv('SEMANTIC_CACHE_SIZE', 2000)),
+                threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.85))
+            )
+        return _cache
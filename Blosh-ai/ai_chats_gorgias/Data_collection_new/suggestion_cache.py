@@ -0,0 +1,424 @@
+"""
+Suggestion Cache
+Pluggable stores for generated ticket suggestions:
+- InMemorySuggestionStore: per-process LRU with per-entry TTL
+- SQLiteSuggestionStore: shared by all workers on a host, survives restarts
+- SingleFlight: coalesces concurrent generations for the same key
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'suggestions_cache.db')
+
+# ============================================================================
+# CACHE KEYS
+# ============================================================================
+
+def make_cache_key(ticket_id, customer_message):
+    """Build cache key from ticket id and a hash of the last customer message"""
+    message_hash = hashlib.sha256((customer_message or '').strip().encode('utf-8')).hexdigest()[:16]
+    return f"{ticket_id}:{message_hash}"
+
+# ============================================================================
+# STORE INTERFACE
+# ============================================================================
+
+class SuggestionStore:
+    """Interface for suggestion stores - values are JSON-serializable dicts"""
+
+    backend = 'base'
+
+    def __init__(self, max_entries=1000, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached value or None (expired entries count as a miss)"""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Store value, evicting least recently used entries above the size cap"""
+        raise NotImplementedError
+
+    def peek(self, key):
+        """Like get(), but without touching counters or recency"""
+        raise NotImplementedError
+
+    def invalidate_ticket(self, ticket_id):
+        """Drop every cached suggestion for a ticket"""
+        raise NotImplementedError
+
+    def acquire_lease(self, key, ttl_seconds):
+        """Claim the right to generate `key`; False if another worker holds it"""
+        return True
+
+    def release_lease(self, key):
+        """Give up a lease taken with acquire_lease()"""
+
+    def lease_active(self, key):
+        """True while some worker holds an unexpired lease on `key`"""
+        return False
+
+    def wait_for(self, key, timeout, poll_interval=0.25):
+        """Poll until the lease holder stores `key`, gives up, or the timeout passes"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            value = self.peek(key)
+            if value is not None:
+                return value
+            if not self.lease_active(key):
+                return self.peek(key)
+            time.sleep(poll_interval)
+        return None
+
+    def clear(self):
+        """Remove all entries"""
+        raise NotImplementedError
+
+    def size(self):
+        """Number of stored entries"""
+        raise NotImplementedError
+
+    def _count(self, counter, amount=1):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def stats(self):
+        """Hit/miss/eviction counters for health reporting"""
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            counters = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+        return {
+            'backend': self.backend,
+            'size': self.size(),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            **counters
+        }
+
+# ============================================================================
+# IN-PROCESS STORE
+# ============================================================================
+
+class InMemorySuggestionStore(SuggestionStore):
+    """Thread-safe LRU cache where every entry expires after `ttl_seconds`"""
+
+    backend = 'memory'
+
+    def __init__(self, max_entries=1000, ttl_seconds=3600):
+        super().__init__(max_entries, ttl_seconds)
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._count('misses')
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._count('expirations')
+                self._count('misses')
+                return None
+
+            self._entries.move_to_end(key)
+            self._count('hits')
+            return dict(value)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, dict(value))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count('evictions')
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return dict(entry[1])
+
+    def invalidate_ticket(self, ticket_id):
+        prefix = f"{ticket_id}:"
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+# ============================================================================
+# SHARED SQLITE STORE
+# ============================================================================
+
+class SQLiteSuggestionStore(SuggestionStore):
+    """
+    SQLite-backed store in WAL mode, safe for concurrent gunicorn workers.
+    Hit/miss counters are per process; size and contents are shared.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_entries=1000, ttl_seconds=3600):
+        super().__init__(max_entries, ttl_seconds)
+        self.path = path
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS suggestions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_suggestions_last_access ON suggestions(last_access)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS generation_leases (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self):
+        """One connection per thread; sqlite3 connections are not thread-safe"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at FROM suggestions WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+            self._count('misses')
+            return None
+
+        value, expires_at = row
+        if expires_at <= now:
+            conn.execute("DELETE FROM suggestions WHERE key = ? AND expires_at <= ?", (key, now))
+            self._count('expirations')
+            self._count('misses')
+            return None
+
+        conn.execute("UPDATE suggestions SET last_access = ? WHERE key = ?", (now, key))
+        self._count('hits')
+        return json.loads(value)
+
+    def set(self, key, value):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO suggestions (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl_seconds, now)
+            )
+            conn.execute("DELETE FROM suggestions WHERE expires_at <= ?", (now,))
+
+            overflow = conn.execute("SELECT COUNT(*) FROM suggestions").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute("""
+                    DELETE FROM suggestions WHERE key IN (
+                        SELECT key FROM suggestions ORDER BY last_access LIMIT ?
+                    )
+                """, (overflow,))
+                self._count('evictions', overflow)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def peek(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM suggestions WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def acquire_lease(self, key, ttl_seconds):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM generation_leases WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO generation_leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self._owner(), now + ttl_seconds)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def release_lease(self, key):
+        self._connect().execute(
+            "DELETE FROM generation_leases WHERE key = ? AND owner = ?", (key, self._owner())
+        )
+
+    def lease_active(self, key):
+        row = self._connect().execute(
+            "SELECT 1 FROM generation_leases WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def _owner(self):
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def invalidate_ticket(self, ticket_id):
+        prefix = f"{ticket_id}:"
+        self._connect().execute(
+            "DELETE FROM suggestions WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+        )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM suggestions")
+
+    def size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM suggestions").fetchone()[0]
+
+    def stats(self):
+        stats = super().stats()
+        stats['path'] = self.path
+        stats['worker_pid'] = os.getpid()
+        return stats
+
+# ============================================================================
+# REQUEST COALESCING
+# ============================================================================
+
+class _Call:
+    """An in-flight call that followers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Per-key request coalescing: while fn() runs for a key, concurrent callers
+    for the same key wait for that result instead of starting their own call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return (result, shared) where shared is True for followers"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    def lead(self, key):
+        """
+        Register the caller as the running call for `key` without a function,
+        e.g. a streamed generation; returns a call for finish(), or None if
+        another call for `key` is already in flight
+        """
+        with self._lock:
+            if key in self._calls:
+                return None
+            call = _Call()
+            self._calls[key] = call
+            return call
+
+    def finish(self, key, call, result=None, error=None):
+        """Hand the result of a lead() call to its followers"""
+        call.result = result
+        call.error = error
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    def in_flight(self, key):
+        """True while a call for `key` is running in this process"""
+        with self._lock:
+            return key in self._calls
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._calls), 'coalesced': self.coalesced}
+
+# ============================================================================
+# FACTORY
+# ============================================================================
+
+def create_suggestion_store(backend=None, max_entries=None, ttl_seconds=None, path=None):
+    """Create the configured store (SUGGESTION_STORE=sqlite|memory)"""
+    backend = (backend or os.getenv('SUGGESTION_STORE', 'sqlite')).lower()
+    max_entries = max_entries or int(os.getenv('SUGGESTION_CACHE_SIZE', 1000))
+    ttl_seconds = ttl_seconds or int(os.getenv('SUGGESTION_CACHE_TTL', 3600))
+
+    if backend == 'memory':
+        return InMemorySuggestionStore(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend == 'sqlite':
+        return SQLiteSuggestionStore(
+            path=path or os.getenv('SUGGESTION_STORE_PATH', DEFAULT_STORE_PATH),
+            max_entries=max_entries,
+            ttl_seconds=ttl_seconds
+        )
+    raise ValueError(f"Unknown suggestion store backend: {backend}")
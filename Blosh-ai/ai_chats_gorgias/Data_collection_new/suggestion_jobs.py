@@ -0,0 +1,122 @@
+"""
+Suggestion Jobs
+Bounded background executor for suggestion generation.
+Job state lives in its own store (separate size cap and TTL from cached
+suggestions) so any worker can answer a poll.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from suggestion_cache import create_suggestion_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'suggestion_jobs.db')
+
+def create_job_store():
+    """Store for job records, same backend as SUGGESTION_STORE; jobs never evict cached suggestions"""
+    return create_suggestion_store(
+        max_entries=int(os.getenv('SUGGESTION_JOB_STORE_SIZE', 10000)),
+        ttl_seconds=int(os.getenv('SUGGESTION_JOB_TTL', 900)),
+        path=os.getenv('SUGGESTION_JOB_STORE_PATH', DEFAULT_JOB_STORE_PATH)
+    )
+
+def save_job(store, job_id, ticket_id, status, result=None, error=None):
+    """Write a job record where any worker can read it"""
+    job = {
+        'job_id': job_id,
+        'ticket_id': ticket_id,
+        'status': status,
+        'result': result,
+        'error': error,
+        'updated': datetime.now().isoformat()
+    }
+    store.set(job_id, job)
+    return job
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity"""
+
+class SuggestionJobQueue:
+    """
+    Runs suggestion jobs on a fixed pool of threads with a bounded backlog.
+    Submitting twice for a ticket while its job is pending returns the same job.
+    """
+
+    def __init__(self, store, max_workers=4, max_pending=50):
+        self.store = store
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='suggestion-job')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._active = {}  # ticket_id -> job_id, for jobs not finished yet
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, ticket_id, fn, *args):
+        """Queue fn(*args) for a ticket and return the job record"""
+        with self._lock:
+            job_id = self._active.get(ticket_id)
+            if job_id:
+                job = self.get(job_id)
+                if job and job['status'] in ('pending', 'running'):
+                    return job
+
+            if not self._slots.acquire(blocking=False):
+                self.rejected += 1
+                raise QueueFullError(f"Suggestion queue full ({self.max_workers + self.max_pending} jobs)")
+
+            job_id = uuid.uuid4().hex
+            self._active[ticket_id] = job_id
+            self.submitted += 1
+
+            # Written under the lock so a concurrent submit for the ticket finds the pending job
+            job = self._save(job_id, ticket_id, 'pending')
+
+        self._executor.submit(self._run, job_id, ticket_id, fn, args)
+        return job
+
+    def get(self, job_id):
+        """Return the job record or None if unknown/expired"""
+        return self.store.peek(job_id)
+
+    def _run(self, job_id, ticket_id, fn, args):
+        self._save(job_id, ticket_id, 'running')
+        try:
+            result = fn(*args)
+            self._save(job_id, ticket_id, 'done', result=result)
+            with self._lock:
+                self.completed += 1
+        except Exception as e:
+            logger.error(f"Suggestion job {job_id} for ticket {ticket_id} failed: {str(e)}", exc_info=True)
+            self._save(job_id, ticket_id, 'error', error=str(e))
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                if self._active.get(ticket_id) == job_id:
+                    del self._active[ticket_id]
+            self._slots.release()
+
+    def _save(self, job_id, ticket_id, status, result=None, error=None):
+        return save_job(self.store, job_id, ticket_id, status, result, error)
+
+    def stats(self):
+        """Queue counters for health reporting"""
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'active': len(self._active),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
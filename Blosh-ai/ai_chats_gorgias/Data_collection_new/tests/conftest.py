@@ -0,0 +1,11 @@
+"""
+Test setup: the server modules are flat scripts, so their directories go on sys.path
+"""
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'data_processing'))
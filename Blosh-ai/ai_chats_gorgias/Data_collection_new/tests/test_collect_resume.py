@@ -0,0 +1,120 @@
+import importlib
+import json
+import sys
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from gorgias_standin import StandIn, create_app, synthetic_tickets
+
+TICKETS = 450
+
+@pytest.fixture
+def standin():
+    """Stand-in Gorgias API on a free local port"""
+    standin = StandIn(synthetic_tickets(TICKETS, days=30, seed=7), latency_ms=0, jitter_ms=0)
+    server = make_server('127.0.0.1', 0, create_app(standin), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    standin.base_url = f"http://127.0.0.1:{server.server_port}/api"
+    yield standin
+    server.shutdown()
+    thread.join()
+
+@pytest.fixture
+def collector(standin, tmp_path, monkeypatch):
+    """collect_mail_data bound to the stand-in (module settings are read at import)"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('GORGIAS_BASE_URL', standin.base_url)
+    monkeypatch.setenv('COLLECT_RPS', '0')
+    sys.modules.pop('collect_mail_data', None)
+    collector = importlib.import_module('collect_mail_data')
+    yield collector
+    sys.modules.pop('collect_mail_data', None)
+
+def email_ticket_ids(standin):
+    return {str(ticket_id) for ticket_id, ticket in standin.tickets.items() if ticket['channel'] == 'email'}
+
+def collected_ids(path):
+    with open(path, encoding='utf-8') as f:
+        return [str(json.loads(line)['ticket_id']) for line in f]
+
+def fail_after_pages(collector, monkeypatch, pages):
+    """Make the ticket page request after `pages` successful ones fail, like a crash mid-run"""
+    fetch_ticket_page = collector.fetch_ticket_page
+    served = []
+
+    def flaky(*args):
+        if len(served) >= pages:
+            raise RuntimeError('connection lost')
+        served.append(args)
+        return fetch_ticket_page(*args)
+
+    monkeypatch.setattr(collector, 'fetch_ticket_page', flaky)
+
+def collect(collector, **kwargs):
+    return collector.collect_tickets(max_tickets=0, output_format='jsonl', checkpoint_path='checkpoint.json', **kwargs)
+
+def load_run(collector):
+    return collector.load_checkpoint('checkpoint.json')['run']
+
+@pytest.mark.parametrize('use_views', [True, False])
+def test_complete_run_collects_every_email_ticket(collector, standin, use_views):
+    out_path = collect(collector, use_views=use_views)
+
+    ids = collected_ids(out_path)
+    assert len(ids) == len(set(ids))
+    assert set(ids) == email_ticket_ids(standin)
+    assert load_run(collector) is None
+    assert not standin.views
+
+def test_resume_continues_after_last_checkpointed_page(collector, standin, monkeypatch):
+    with monkeypatch.context() as patch:
+        fail_after_pages(collector, patch, pages=2)
+        assert collect(collector, use_views=False) is None
+
+    run = load_run(collector)
+    assert run['cursor'] is not None
+    assert run['tickets_processed'] == 200
+    assert 'fetched_ids' not in run
+    requests_before = standin.counters['gorgias_requests']
+
+    out_path = collect(collector, use_views=False)
+
+    ids = collected_ids(out_path)
+    assert len(ids) == len(set(ids))
+    assert set(ids) == email_ticket_ids(standin)
+    # Pages 1-2 are not requested again: 3 list calls for the rest plus one thread per email ticket on them
+    newest_first = sorted(standin.tickets.values(), key=lambda ticket: ticket['created_datetime'], reverse=True)
+    remaining = [ticket for ticket in newest_first[200:] if ticket['channel'] == 'email']
+    assert standin.counters['gorgias_requests'] - requests_before == 3 + len(remaining)
+    assert load_run(collector) is None
+
+def test_resume_skips_rows_written_after_the_last_checkpoint(collector, standin, monkeypatch):
+    with monkeypatch.context() as patch:
+        fail_after_pages(collector, patch, pages=2)
+        collect(collector, use_views=False)
+
+    # Crash between appending rows and saving the checkpoint: the cursor still points at page 1
+    state = collector.load_checkpoint('checkpoint.json')
+    state['run']['cursor'] = None
+    state['run']['tickets_processed'] = 0
+    collector.save_checkpoint(state, 'checkpoint.json')
+
+    out_path = collect(collector, use_views=False)
+
+    ids = collected_ids(out_path)
+    assert len(ids) == len(set(ids))
+    assert set(ids) == email_ticket_ids(standin)
+
+def test_interrupted_run_with_other_parameters_is_discarded(collector, standin, monkeypatch):
+    with monkeypatch.context() as patch:
+        fail_after_pages(collector, patch, pages=1)
+        collect(collector, use_views=False)
+    assert load_run(collector)['channels'] == ['email']
+
+    out_path = collect(collector, channels=('chat',), use_views=False)
+
+    chat_ids = {str(ticket_id) for ticket_id, ticket in standin.tickets.items() if ticket['channel'] == 'chat'}
+    assert set(collected_ids(out_path)) == chat_ids
@@ -0,0 +1,32 @@
+import random
+
+import pytest
+
+from context_matcher import DEFAULT_LEXICON, ContextMatcher, _scan_naive
+
+@pytest.fixture(scope='module')
+def matcher():
+    return ContextMatcher()
+
+@pytest.mark.parametrize('text, intent', [
+    ('defecterugsturen', 'return'),
+    ('photordernummer', 'order_number_request'),
+    ('fotordernummer klopt niet', 'order_number_denied'),
+])
+def test_overlapping_keywords_are_all_found(matcher, text, intent):
+    assert intent in matcher.scan(text)['intents']
+    assert matcher.scan(text) == _scan_naive(text, DEFAULT_LEXICON)
+
+def test_order_number(matcher):
+    assert matcher.scan('Bestelling 102430110 en 20340520')['order_number'] == '102430110'
+    assert matcher.scan('x1024301101')['order_number'] is None
+
+def test_matches_naive_scan_on_random_keyword_soup(matcher):
+    rng = random.Random(14)
+    words = [word for words in DEFAULT_LEXICON.values() for word in words]
+    pieces = words + [word[:rng.randint(1, len(word))] for word in words] + \
+        [' ', 'a', 'e', '1', '102430110', '20340520', 'X']
+
+    for _ in range(5000):
+        text = ''.join(rng.choice(pieces) for _ in range(rng.randint(1, 8)))
+        assert matcher.scan(text) == _scan_naive(text, DEFAULT_LEXICON), text
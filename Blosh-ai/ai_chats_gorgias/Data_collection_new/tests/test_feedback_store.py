@@ -0,0 +1,76 @@
+import time
+from datetime import datetime
+
+import pytest
+
+import feedback_store
+from feedback_store import FeedbackStore
+
+@pytest.fixture
+def store(tmp_path):
+    return FeedbackStore(path=str(tmp_path / 'feedback.db'), flush_seconds=0.01)
+
+def record_all(store, events):
+    for feedback, kwargs in events:
+        assert store.record(feedback, **kwargs)
+    store.flush()
+
+def test_acceptance_by_brand(store):
+    record_all(store, [
+        ('used', {'brand': 'Freebird Icons', 'quality_score': 90, 'latency_ms': 1000}),
+        ('edited', {'brand': 'Freebird Icons', 'quality_score': 70, 'latency_ms': 3000}),
+        ('ignored', {'brand': 'Freebird Icons', 'quality_score': 50, 'latency_ms': 2000}),
+        ('used', {'brand': 'Other', 'quality_score': 80}),
+    ])
+
+    stats = store.acceptance(by='brand')
+
+    assert list(stats) == ['Freebird Icons', 'Other']
+    assert stats['Freebird Icons'] == {
+        'used': 1, 'edited': 1, 'ignored': 1, 'total': 3,
+        'acceptance_rate': 0.667, 'used_as_is_rate': 0.333,
+        'avg_quality': 70.0, 'avg_latency_ms': 2000.0
+    }
+    assert stats['Other']['acceptance_rate'] == 1.0
+    assert stats['Other']['avg_latency_ms'] == 0.0
+
+def test_acceptance_by_intent_groups_missing_values_as_unknown(store):
+    record_all(store, [
+        ('used', {'intent': 'return'}),
+        ('ignored', {'intent': 'return'}),
+        ('ignored', {}),
+    ])
+
+    stats = store.acceptance(by='intent')
+
+    assert stats['return']['acceptance_rate'] == 0.5
+    assert stats['unknown'] == {
+        'used': 0, 'edited': 0, 'ignored': 1, 'total': 1,
+        'acceptance_rate': 0.0, 'used_as_is_rate': 0.0, 'avg_quality': 0.0, 'avg_latency_ms': 0.0
+    }
+
+def test_acceptance_by_day_counts_every_brand(store):
+    record_all(store, [('used', {'brand': 'A'}), ('edited', {'brand': 'B'})])
+
+    stats = store.acceptance(by='day')
+
+    assert list(stats) == [datetime.now().strftime('%Y-%m-%d')]
+    assert stats[datetime.now().strftime('%Y-%m-%d')]['total'] == 2
+
+def test_acceptance_only_counts_the_requested_days(store, monkeypatch):
+    old = time.time() - 40 * 86400
+    monkeypatch.setattr(feedback_store.time, 'time', lambda: old)
+    record_all(store, [('ignored', {'brand': 'A'})])
+    monkeypatch.undo()
+    record_all(store, [('used', {'brand': 'A'})])
+
+    assert store.acceptance(by='brand', days=30)['A']['total'] == 1
+    assert store.acceptance(by='brand', days=60)['A']['total'] == 2
+
+def test_acceptance_rejects_unknown_dimension(store):
+    with pytest.raises(ValueError):
+        store.acceptance(by='agent')
+
+def test_record_rejects_unknown_feedback(store):
+    with pytest.raises(ValueError):
+        store.record('liked')
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+from generation_strategies import CandidateCancelled, run_strategy, run_strategy_async
+
+CANDIDATES = [{'model': 'fast'}, {'model': 'slow'}]
+
+def finalize(text):
+    return {'response': text, 'approved': text != 'bad', 'quality_score': 90 if text != 'bad' else 40}
+
+def test_race_finalizes_and_remembers_only_the_winner():
+    finalized = []
+    remembered = []
+
+    def complete(candidate, cancel):
+        if candidate['model'] == 'slow':
+            time.sleep(0.1)
+            if cancel.is_set():
+                raise CandidateCancelled()
+        return candidate['model']
+
+    result = run_strategy('race', CANDIDATES, complete,
+                          finalize=lambda text: finalized.append(text) or finalize(text),
+                          remember=lambda text, result: remembered.append(text))
+    time.sleep(0.15)
+
+    assert result['model'] == 'fast'
+    assert finalized == ['fast']
+    assert remembered == ['fast']
+
+def test_race_loser_that_finishes_after_the_winner_is_not_finalized():
+    finalized = []
+
+    def complete(candidate, cancel):
+        if candidate['model'] == 'slow':
+            time.sleep(0.1)  # ignores cancel, like a request that already completed
+        return candidate['model']
+
+    run_strategy('race', CANDIDATES, complete, finalize=lambda text: finalized.append(text) or finalize(text))
+    time.sleep(0.15)
+    assert finalized == ['fast']
+
+def test_fallback_remembers_the_best_attempt_once():
+    remembered = []
+    texts = {'fast': 'bad', 'slow': 'good'}
+
+    result = run_strategy('fallback', CANDIDATES, lambda candidate, cancel: texts[candidate['model']], finalize,
+                          remember=lambda text, result: remembered.append(text))
+
+    assert (result['response'], result['candidates_tried']) == ('good', 2)
+    assert remembered == ['good']
+
+@pytest.mark.parametrize('strategy', ['fallback', 'race'])
+def test_async_strategies_remember_only_the_chosen_result(strategy):
+    remembered = []
+
+    async def complete(candidate):
+        await asyncio.sleep(0.01 if candidate['model'] == 'fast' else 0.05)
+        return candidate['model']
+
+    result = asyncio.run(run_strategy_async(strategy, CANDIDATES, complete, finalize,
+                                            remember=lambda text, result: remembered.append(text)))
+    assert result['model'] == 'fast'
+    assert remembered == ['fast']
@@ -0,0 +1,112 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+import gorgias_client
+from gorgias_client import GorgiasClient, parse_retry_after
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(gorgias_client.time, 'monotonic', clock)
+    return clock
+
+# ============================================================================
+# RETRY-AFTER
+# ============================================================================
+
+@pytest.mark.parametrize('value, expected', [
+    ('5', 5.0),
+    ('0.5', 0.5),
+    ('-3', 0.0),
+    (None, None),
+    ('', None),
+    ('soon', None),
+])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+def test_parse_retry_after_http_date():
+    assert parse_retry_after(formatdate(time.time() + 30, usegmt=True)) == pytest.approx(30, abs=2)
+    assert parse_retry_after(formatdate(time.time() - 30, usegmt=True)) == 0.0
+
+# ============================================================================
+# SHARED REQUEST BUDGET
+# ============================================================================
+
+def test_unlimited_client_never_waits(clock):
+    client = GorgiasClient()
+    assert all(client._reserve_request() == 0.0 for _ in range(100))
+
+def test_token_bucket_allows_burst_then_spaces_requests(clock):
+    client = GorgiasClient(requests_per_second=2, burst=3)
+
+    assert [client._reserve_request() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert client._reserve_request() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert client._reserve_request() == 0.0
+    assert client._reserve_request() == pytest.approx(0.5)
+
+def test_token_bucket_refills_up_to_burst(clock):
+    client = GorgiasClient(requests_per_second=2, burst=3)
+    for _ in range(3):
+        client._reserve_request()
+
+    clock.now += 60
+    assert [client._reserve_request() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert client._reserve_request() > 0
+
+def test_burst_defaults_to_one_second_of_requests(clock):
+    assert GorgiasClient(requests_per_second=5).burst == 5
+    assert GorgiasClient(requests_per_second=0.5).burst == 1
+
+def test_retry_after_pauses_every_caller(clock):
+    client = GorgiasClient()
+    wait = client._retry_wait(429, {'Retry-After': '10'}, attempt=0)
+
+    assert 10 <= wait <= 11
+    assert client._reserve_request() == pytest.approx(10)
+    clock.now += 4
+    assert client._reserve_request() == pytest.approx(6)
+    clock.now += 6
+    assert client._reserve_request() == 0.0
+    assert client.stats()['pauses'] == 1
+    assert client.stats()['rate_limited'] == 1
+
+def test_pause_never_shortens(clock):
+    client = GorgiasClient()
+    client._pause_all(10)
+    client._pause_all(2)
+    assert client._reserve_request() == pytest.approx(10)
+
+def test_429_without_retry_after_backs_off_without_pausing(clock):
+    client = GorgiasClient(backoff_base=1.0, max_backoff=30)
+    assert 0 <= client._retry_wait(429, {}, attempt=2) <= 4
+    assert client._reserve_request() == 0.0
+    assert client.stats()['pauses'] == 0
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+def test_client_settings_from_env(monkeypatch):
+    monkeypatch.setenv('GORGIAS_BASE_URL', 'http://localhost:8900/api/')
+    monkeypatch.setenv('GORGIAS_POOL_SIZE', '3')
+    monkeypatch.setenv('GORGIAS_MAX_RETRIES', '7')
+    monkeypatch.setenv('GORGIAS_DEADLINE', '12')
+    monkeypatch.setenv('GORGIAS_RPS', '2')
+
+    client = GorgiasClient(**gorgias_client.client_settings_from_env())
+
+    assert client.url('tickets/1') == 'http://localhost:8900/api/tickets/1'
+    assert (client.pool_size, client.max_retries, client.deadline) == (3, 7, 12.0)
+    assert (client.requests_per_second, client.burst) == (2.0, 2)
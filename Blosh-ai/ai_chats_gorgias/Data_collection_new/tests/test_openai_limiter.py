@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+
+from openai_limiter import OpenAIRateLimiter
+
+def limiter(max_concurrency):
+    return OpenAIRateLimiter(max_concurrency=max_concurrency, requests_per_minute=100000, tokens_per_minute=10**9)
+
+def test_async_callers_never_exceed_the_concurrency_cap():
+    openai = limiter(2)
+    running = []
+    peak = []
+
+    async def call():
+        async with openai.acquire_async():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    async def run():
+        await asyncio.gather(*[call() for _ in range(20)])
+
+    asyncio.run(run())
+    assert max(peak) == 2
+    assert openai.stats()['calls'] == 20
+    assert (openai.stats()['in_flight'], openai.stats()['queued']) == (0, 0)
+
+def test_waiting_coroutine_wakes_as_soon_as_a_slot_frees():
+    openai = limiter(1)
+
+    async def run():
+        async def hold():
+            async with openai.acquire_async():
+                await asyncio.sleep(0.1)
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        started = time.monotonic()
+        async with openai.acquire_async():
+            return time.monotonic() - started, await holder
+
+    waited, _ = asyncio.run(run())
+    assert 0.09 <= waited < 0.13
+
+def test_cancelled_waiter_does_not_leak_its_slot():
+    openai = limiter(1)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with openai.acquire_async():
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(openai.acquire_async().__aenter__())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await holder
+        async with openai.acquire_async():
+            pass
+
+    asyncio.run(asyncio.wait_for(run(), 2))
+    assert openai.stats()['queued'] == 0
+
+def test_threads_and_coroutines_share_slots():
+    openai = limiter(1)
+    release = threading.Event()
+
+    def hold():
+        with openai.acquire():
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    while openai.stats()['in_flight'] == 0:
+        time.sleep(0.01)
+
+    async def run():
+        threading.Timer(0.1, release.set).start()
+        started = time.monotonic()
+        async with openai.acquire_async():
+            return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.09
+    thread.join()
@@ -0,0 +1,28 @@
+from response_rules import DEFAULT_RULES, build_rules
+
+def rules(brand):
+    return build_rules(brand, DEFAULT_RULES)
+
+def test_brand_signature_replaces_every_wrong_name_in_one_pass():
+    response, applied = rules('Freebird Icons').fix(
+        'Hi Petra,\n\nGroet, Team Simple the Brand / Simple the Brand\n\nMet vriendelijke groet', 'Petra'
+    )
+    assert 'Simple' not in response
+    assert response.count('Team Freebird Icons') == 2
+    assert applied == ['Fixed brand signature']
+
+def test_made_up_discount_code_and_mentions_are_removed():
+    response, applied = rules('Simple the Brand').fix(
+        'Hi Petra,\n\nCode: PETRA10 voor je\nDe kortingscode is geldig\nKORTINGSCODE nogmaals\n'
+        'Met vriendelijke groet', 'Petra'
+    )
+    assert 'PETRA10' not in response
+    assert 'kortingscode' not in response.lower()
+    assert applied == ['Removed made-up discount code']
+
+def test_code_without_the_customer_name_is_kept():
+    response, applied = rules('Simple the Brand').fix(
+        'Hi Petra,\n\nCode: WELKOM10\nMet vriendelijke groet', 'Petra'
+    )
+    assert 'WELKOM10' in response
+    assert applied == []
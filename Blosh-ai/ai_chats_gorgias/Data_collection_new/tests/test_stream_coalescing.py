@@ -0,0 +1,125 @@
+import asyncio
+import importlib
+import sys
+import threading
+import time
+
+import pytest
+
+TICKET = {'message': 'Waar is mijn pakket?', 'customer_name': 'Petra', 'order_number': '', 'subject': ''}
+
+RESULT = {'response': 'Hoi Petra', 'quality_score': 90, 'brand': 'Freebird Icons', 'approved': True,
+          'metrics': {'timings_ms': {'total': 1}}}
+
+def load_server(name, monkeypatch):
+    """Import a server module with a per-process store and no real OpenAI key"""
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setenv('SUGGESTION_STORE', 'memory')
+    monkeypatch.setenv('RESPONSE_MEMO', '0')
+    sys.modules.pop(name, None)
+    return importlib.import_module(name)
+
+@pytest.fixture
+def server(monkeypatch):
+    yield load_server('API_widget_server', monkeypatch)
+    sys.modules.pop('API_widget_server', None)
+
+@pytest.fixture
+def async_server(monkeypatch):
+    pytest.importorskip('quart')
+    yield load_server('API_widget_server_async', monkeypatch)
+    sys.modules.pop('API_widget_server_async', None)
+
+# ============================================================================
+# SYNC SERVER
+# ============================================================================
+
+def test_suggest_waits_for_stream_instead_of_generating(server, monkeypatch):
+    generations = []
+    monkeypatch.setattr(server, 'generate_response', lambda **kw: generations.append(1) or RESULT)
+
+    def stream(**kw):
+        for word in ('Hoi', ' Petra'):
+            time.sleep(0.1)
+            yield 'delta', word
+        yield 'done', RESULT
+    monkeypatch.setattr(server, 'generate_response_stream', stream)
+
+    events = server.stream_suggestion_events('1', dict(TICKET))
+    next(events)  # the stream now leads the generation
+    results = []
+    follower = threading.Thread(target=lambda: results.append(server.get_or_generate_suggestion('1', dict(TICKET))))
+    follower.start()
+    while server.suggestion_flights.stats()['coalesced'] < 1:
+        time.sleep(0.01)
+    list(events)
+    follower.join()
+
+    assert generations == []
+    assert results[0]['suggestion'] == 'Hoi Petra'
+    assert results[0]['cached'] is True
+
+def test_followers_generate_themselves_when_the_stream_is_abandoned(server, monkeypatch):
+    generations = []
+    monkeypatch.setattr(server, 'generate_response', lambda **kw: generations.append(1) or RESULT)
+
+    def stream(**kw):
+        while True:
+            time.sleep(0.05)
+            yield 'delta', 'Hoi'
+    monkeypatch.setattr(server, 'generate_response_stream', stream)
+
+    events = server.stream_suggestion_events('1', dict(TICKET))
+    next(events)
+    results = []
+    followers = [
+        threading.Thread(target=lambda: results.append(server.get_or_generate_suggestion('1', dict(TICKET))))
+        for _ in range(3)
+    ]
+    for follower in followers:
+        follower.start()
+    while server.suggestion_flights.stats()['coalesced'] < 3:
+        time.sleep(0.01)
+    events.close()  # SSE client disconnected
+    for follower in followers:
+        follower.join()
+
+    assert len(results) == 3
+    assert all(result['suggestion'] == 'Hoi Petra' for result in results)
+    assert generations == [1]
+
+# ============================================================================
+# ASYNC SERVER
+# ============================================================================
+
+def test_async_followers_generate_themselves_when_the_stream_fails(async_server, monkeypatch):
+    generations = []
+
+    async def generate(**kw):
+        generations.append(1)
+        await asyncio.sleep(0.05)
+        return RESULT
+    monkeypatch.setattr(async_server, 'generate_response_async', generate)
+
+    async def stream(**kw):
+        yield 'delta', 'Hoi'
+        await asyncio.sleep(0.1)
+        yield 'failed', 'OpenAI down'
+    monkeypatch.setattr(async_server, 'generate_response_stream_async', stream)
+
+    async def run():
+        events = async_server.stream_suggestion_events('1', dict(TICKET))
+        await events.__anext__()
+        followers = [
+            asyncio.ensure_future(async_server.get_or_generate_suggestion('1', dict(TICKET)))
+            for _ in range(3)
+        ]
+        streamed = [event async for event in events]
+        return streamed, await asyncio.gather(*followers)
+
+    streamed, results = asyncio.run(run())
+
+    assert streamed[-1].startswith('event: failed')
+    assert all(result['suggestion'] == 'Hoi Petra' for result in results)
+    assert generations == [1]
+    assert async_server.in_flight == {}
@@ -0,0 +1,212 @@
+import threading
+import time
+
+import pytest
+
+import suggestion_cache
+from suggestion_cache import (
+    InMemorySuggestionStore,
+    SQLiteSuggestionStore,
+    SingleFlight,
+    make_cache_key
+)
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    def make(max_entries=1000, ttl_seconds=3600):
+        if request.param == 'memory':
+            return InMemorySuggestionStore(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        return SQLiteSuggestionStore(path=str(tmp_path / 'store.db'), max_entries=max_entries, ttl_seconds=ttl_seconds)
+    return make
+
+# ============================================================================
+# STORES
+# ============================================================================
+
+def test_cache_key_depends_on_message():
+    assert make_cache_key(1, 'Waar is mijn pakket?') == make_cache_key('1', ' Waar is mijn pakket? ')
+    assert make_cache_key(1, 'Waar is mijn pakket?') != make_cache_key(1, 'Ik wil retourneren')
+    assert make_cache_key(1, 'hoi').startswith('1:')
+
+def test_get_set_and_counters(make_store):
+    store = make_store()
+    assert store.get('1:a') is None
+    store.set('1:a', {'suggestion': 'Hoi'})
+
+    assert store.get('1:a') == {'suggestion': 'Hoi'}
+    assert store.peek('1:a') == {'suggestion': 'Hoi'}
+    stats = store.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+
+def test_least_recently_used_entry_is_evicted(make_store):
+    store = make_store(max_entries=2)
+    store.set('1:a', {'n': 1})
+    time.sleep(0.01)
+    store.set('2:a', {'n': 2})
+    time.sleep(0.01)
+    store.get('1:a')
+    time.sleep(0.01)
+    store.set('3:a', {'n': 3})
+
+    assert store.peek('2:a') is None
+    assert store.peek('1:a') == {'n': 1}
+    assert store.peek('3:a') == {'n': 3}
+    assert store.stats()['evictions'] == 1
+
+def test_entries_expire(make_store, monkeypatch):
+    store = make_store(ttl_seconds=60)
+    store.set('1:a', {'n': 1})
+
+    later = time.monotonic() + 61, time.time() + 61
+    monkeypatch.setattr(suggestion_cache.time, 'monotonic', lambda: later[0])
+    monkeypatch.setattr(suggestion_cache.time, 'time', lambda: later[1])
+
+    assert store.peek('1:a') is None
+    assert store.get('1:a') is None
+    assert store.stats()['expirations'] == 1
+
+def test_invalidate_ticket_only_drops_that_ticket(make_store):
+    store = make_store()
+    store.set('7:a', {'n': 1})
+    store.set('7:b', {'n': 2})
+    store.set('70:a', {'n': 3})
+
+    store.invalidate_ticket(7)
+
+    assert store.peek('7:a') is None
+    assert store.peek('7:b') is None
+    assert store.peek('70:a') == {'n': 3}
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'store.db')
+    SQLiteSuggestionStore(path=path).set('1:a', {'n': 1})
+    assert SQLiteSuggestionStore(path=path).get('1:a') == {'n': 1}
+
+# ============================================================================
+# LEASES
+# ============================================================================
+
+def test_sqlite_lease_is_exclusive_until_released(tmp_path):
+    store = SQLiteSuggestionStore(path=str(tmp_path / 'store.db'))
+    assert store.acquire_lease('1:a', 30)
+    assert store.lease_active('1:a')
+
+    # Another worker (thread with its own connection) can't take it
+    taken = []
+    worker = threading.Thread(target=lambda: taken.append(store.acquire_lease('1:a', 30)))
+    worker.start()
+    worker.join()
+    assert taken == [False]
+
+    store.release_lease('1:a')
+    assert not store.lease_active('1:a')
+    assert store.acquire_lease('1:a', 30)
+
+def test_sqlite_lease_expires(tmp_path):
+    store = SQLiteSuggestionStore(path=str(tmp_path / 'store.db'))
+    assert store.acquire_lease('1:a', 0.05)
+    time.sleep(0.1)
+    assert not store.lease_active('1:a')
+    assert store.acquire_lease('1:a', 30)
+
+def test_wait_for_returns_value_stored_by_lease_holder(tmp_path):
+    store = SQLiteSuggestionStore(path=str(tmp_path / 'store.db'))
+    store.acquire_lease('1:a', 30)
+
+    def finish():
+        time.sleep(0.1)
+        store.set('1:a', {'n': 1})
+        store.release_lease('1:a')
+
+    threading.Thread(target=finish).start()
+    assert store.wait_for('1:a', timeout=5, poll_interval=0.01) == {'n': 1}
+
+def test_wait_for_gives_up_when_lease_is_released_without_value(tmp_path):
+    store = SQLiteSuggestionStore(path=str(tmp_path / 'store.db'))
+    assert store.wait_for('1:a', timeout=5, poll_interval=0.01) is None
+
+# ============================================================================
+# REQUEST COALESCING
+# ============================================================================
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'suggestion': 'Hoi'}
+
+    results = []
+    def call():
+        results.append(flights.do('1:a', generate))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=call) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while flights.stats()['coalesced'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == {'suggestion': 'Hoi'} for result, _ in results)
+    assert flights.stats() == {'in_flight': 0, 'coalesced': 3}
+
+def test_single_flight_followers_get_the_leaders_error():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('OpenAI down')
+
+    errors = []
+    def call():
+        try:
+            flights.do('1:a', fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    while flights.stats()['coalesced'] < 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == ['OpenAI down', 'OpenAI down']
+    assert not flights.in_flight('1:a')
+
+def test_single_flight_lead_blocks_do_until_finish():
+    flights = SingleFlight()
+    call = flights.lead('1:a')
+    assert call is not None
+    assert flights.lead('1:a') is None
+
+    results = []
+    follower = threading.Thread(target=lambda: results.append(flights.do('1:a', lambda: {'generated': True})))
+    follower.start()
+    while flights.stats()['coalesced'] < 1:
+        time.sleep(0.01)
+
+    flights.finish('1:a', call, {'streamed': True})
+    follower.join()
+
+    assert results == [({'streamed': True}, True)]
+    assert not flights.in_flight('1:a')
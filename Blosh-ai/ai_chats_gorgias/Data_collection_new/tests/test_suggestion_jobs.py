@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from suggestion_cache import InMemorySuggestionStore, create_suggestion_store
+from suggestion_jobs import QueueFullError, SuggestionJobQueue, create_job_store, save_job
+
+@pytest.fixture
+def queue():
+    return SuggestionJobQueue(InMemorySuggestionStore(), max_workers=2, max_pending=2)
+
+def wait_for_status(queue, job_id, statuses=('done', 'error')):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job and job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} still {queue.get(job_id)}")
+
+def test_job_runs_and_stores_result(queue):
+    job = queue.submit('1', lambda: {'suggestion': 'Hoi'})
+    assert job['status'] == 'pending'
+
+    done = wait_for_status(queue, job['job_id'])
+    assert done['status'] == 'done'
+    assert done['result'] == {'suggestion': 'Hoi'}
+    assert queue.stats()['completed'] == 1
+
+def test_failed_job_records_error(queue):
+    def fail():
+        raise RuntimeError('OpenAI down')
+
+    job = wait_for_status(queue, queue.submit('1', fail)['job_id'])
+    assert (job['status'], job['error']) == ('error', 'OpenAI down')
+    assert queue.stats()['failed'] == 1
+
+def test_concurrent_submits_for_a_ticket_share_one_job(queue):
+    release = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        release.wait(5)
+        return {}
+
+    jobs = []
+    threads = [threading.Thread(target=lambda: jobs.append(queue.submit('1', generate))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+
+    assert len({job['job_id'] for job in jobs}) == 1
+    wait_for_status(queue, jobs[0]['job_id'])
+    assert len(calls) == 1
+
+def test_finished_job_does_not_block_a_new_one(queue):
+    first = wait_for_status(queue, queue.submit('1', lambda: {})['job_id'])
+    while queue.stats()['active']:
+        time.sleep(0.01)
+
+    second = queue.submit('1', lambda: {})
+    assert second['job_id'] != first['job_id']
+
+def test_full_queue_rejects(queue):
+    release = threading.Event()
+    for ticket_id in range(4):
+        queue.submit(str(ticket_id), release.wait, 5)
+
+    with pytest.raises(QueueFullError):
+        queue.submit('5', lambda: {})
+    assert queue.stats()['rejected'] == 1
+    release.set()
+
+def test_job_store_has_its_own_size_and_ttl(tmp_path, monkeypatch):
+    monkeypatch.setenv('SUGGESTION_JOB_TTL', '120')
+    monkeypatch.setenv('SUGGESTION_JOB_STORE_SIZE', '50')
+    monkeypatch.setenv('SUGGESTION_JOB_STORE_PATH', str(tmp_path / 'jobs.db'))
+    monkeypatch.setenv('SUGGESTION_STORE_PATH', str(tmp_path / 'suggestions.db'))
+
+    jobs = create_job_store()
+    suggestions = create_suggestion_store()
+    save_job(jobs, 'abc', '1', 'pending')
+
+    assert (jobs.ttl_seconds, jobs.max_entries) == (120, 50)
+    assert jobs.peek('abc')['status'] == 'pending'
+    assert suggestions.size() == 0
@@ -0,0 +1,39 @@
+import pytest
+
+import feedback_store
+from feedback_store import FeedbackStore
+from widget_common import feedback_stats, store_feedback
+
+@pytest.fixture(autouse=True)
+def feedback_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(feedback_store, '_store', FeedbackStore(path=str(tmp_path / 'feedback.db'), flush_seconds=0.01))
+
+@pytest.mark.parametrize('body, error', [
+    ({'feedback': 'liked'}, 'feedback must be one of used, edited, ignored'),
+    ({'feedback': 'used', 'quality_score': 'abc'}, 'quality_score must be a number'),
+    ({'feedback': 'used', 'quality_score': True}, 'quality_score must be a number'),
+    ({'feedback': 'used', 'latency_ms': 'nan'}, 'latency_ms must be a number'),
+    ({'feedback': 'used', 'latency_ms': -5}, 'latency_ms must be at least 0'),
+    ({'feedback': 'used', 'warnings': 'too_short'}, 'warnings must be a list'),
+])
+def test_store_feedback_rejects_malformed_fields(body, error):
+    assert store_feedback(body) == ({'error': error}, 400)
+
+def test_store_feedback_coerces_numeric_strings():
+    assert store_feedback({'feedback': 'used', 'brand': 'A', 'quality_score': '84.6', 'latency_ms': '1200'}) == \
+        ({'status': 'success'}, 200)
+    feedback_store.get_feedback_store().flush()
+
+    stats, status = feedback_stats({'by': 'brand'})
+    assert status == 200
+    assert stats['groups']['A']['avg_quality'] == 85.0
+    assert stats['groups']['A']['avg_latency_ms'] == 1200.0
+
+@pytest.mark.parametrize('args, error', [
+    ({'days': 'abc'}, 'days must be a number'),
+    ({'days': ''}, 'days must be a number'),
+    ({'days': '0'}, 'days must be at least 1'),
+    ({'by': 'agent'}, 'Unknown feedback dimension: agent'),
+])
+def test_feedback_stats_rejects_bad_query(args, error):
+    assert feedback_stats(args) == ({'error': error}, 400)
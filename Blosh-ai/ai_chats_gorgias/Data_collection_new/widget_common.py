@@ -0,0 +1,683 @@
+"""
+Widget Common
+Pieces shared by API_widget_server and API_widget_server_async: Gorgias ticket
+parsing, response shaping, SSE formatting, feedback handlers and the widget page.
+Importing this module has no side effects (no app, store, pool or thread).
+"""
+
+import os
+import json
+import logging
+import math
+import uuid
+from datetime import datetime
+from feedback_store import get_feedback_store, FEEDBACK_TYPES
+
+logger = logging.getLogger(__name__)
+
+# How long a worker may hold the generation lease for one suggestion
+GENERATION_LEASE_SECONDS = int(os.getenv('GENERATION_LEASE_SECONDS', 60))
+
+# ============================================================================
+# TICKET PARSING
+# ============================================================================
+
+def merge_ticket_messages(ticket_data, messages_data):
+    """Attach the /messages thread (oldest first) to the ticket"""
+    if not ticket_data:
+        return None
+    
+    # The messages endpoint has the complete thread; the embedded list may be empty or truncated
+    messages = (messages_data or {}).get('data') or []
+    if messages:
+        ticket_data = dict(
+            ticket_data,
+            messages=sorted(messages, key=lambda msg: msg.get('created_datetime') or '')
+        )
+    
+    return ticket_data
+
+def is_customer_message(msg):
+    """True for messages written by the customer"""
+    if 'from_agent' in msg:
+        return not msg['from_agent']
+    return msg.get('source', {}).get('type') == 'customer'
+
+def extract_ticket_info(ticket_data):
+    """Extract relevant info from Gorgias ticket data"""
+    if not ticket_data:
+        return None
+    
+    # Get customer info
+    customer = ticket_data.get('customer', {})
+    customer_name = customer.get('firstname', '') or (customer.get('name', '').split()[0] if customer.get('name') else '')
+    
+    # Get last message from messages endpoint or from ticket data
+    last_customer_message = ''
+    messages = ticket_data.get('messages', [])
+    
+    if messages:
+        for msg in reversed(messages):
+            if is_customer_message(msg) and msg.get('body_text'):
+                last_customer_message = msg['body_text']
+                break
+    
+    # Fallback: try to get from ticket's last_message
+    if not last_customer_message and 'last_message' in ticket_data:
+        last_customer_message = ticket_data.get('last_message', {}).get('body_text', '')
+    
+    # Try to extract order number from tags or subject
+    tags = ticket_data.get('tags', [])
+    order_number = None
+    
+    for tag in tags:
+        if isinstance(tag, dict):
+            tag_name = tag.get('name', '')
+        else:
+            tag_name = str(tag)
+        
+        # Look for order numbers in tags
+        if tag_name.startswith('102') or tag_name.startswith('203'):
+            order_number = tag_name
+            break
+    
+    # Also try to find order number in subject
+    if not order_number:
+        subject = ticket_data.get('subject', '')
+        import re
+        order_match = re.search(r'\b(102\d{6}|203\d{5})\b', subject)
+        if order_match:
+            order_number = order_match.group(1)
+    
+    return {
+        'ticket_id': ticket_data.get('id'),
+        'customer_name': customer_name,
+        'customer_email': customer.get('email', ''),
+        'subject': ticket_data.get('subject', ''),
+        'message': last_customer_message,
+        'order_number': order_number,
+        'channel': ticket_data.get('channel', 'email')
+    }
+
+def update_ticket_input(ticket_input, ticket_data):
+    """Fill ticket input from fetched Gorgias ticket data"""
+    info = extract_ticket_info(ticket_data)
+    if info:
+        ticket_input['customer_name'] = info['customer_name']
+        ticket_input['message'] = info['message']
+        ticket_input['order_number'] = info['order_number'] or ticket_input['order_number']
+        ticket_input['subject'] = info['subject']
+
+# ============================================================================
+# RESPONSES
+# ============================================================================
+
+def build_response_data(ticket_id, result):
+    """Shape a generate_response result for the widget"""
+    return {
+        'ticket_id': ticket_id,
+        'suggestion_id': uuid.uuid4().hex,
+        'suggestion': result['response'],
+        'quality_score': result['quality_score'],
+        'confidence': result['quality_score'],
+        'brand': result['brand'],
+        'intent': result.get('intent'),
+        'warnings': result.get('warnings', []),
+        'approved': result['approved'],
+        'memoized': result.get('memoized', False),
+        'metrics': result.get('metrics'),
+        'timestamp': datetime.now().isoformat(),
+        'cached': False
+    }
+
+def with_request_metrics(response_data, trace):
+    """Response data with this request's trace (a cached suggestion keeps its own copy in the store)"""
+    return dict(response_data, metrics=trace.as_dict())
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# ============================================================================
+# FEEDBACK
+# ============================================================================
+
+def parse_number(value, name, cast=float, minimum=None):
+    """Coerce an optional numeric field (None stays None); raises ValueError with a client-facing message"""
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+        if not math.isfinite(number):
+            raise ValueError
+        number = cast(number)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if minimum is not None and number < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return number
+
+def store_feedback(data):
+    """Validate feedback JSON and queue it for the feedback store; returns (body, status)"""
+    ticket_id = data.get('ticket_id')
+    feedback = data.get('feedback')  # 'used', 'edited', 'ignored'
+    warnings = data.get('warnings')
+    
+    if feedback not in FEEDBACK_TYPES:
+        return {'error': f"feedback must be one of {', '.join(FEEDBACK_TYPES)}"}, 400
+    
+    if warnings is not None and not isinstance(warnings, list):
+        return {'error': 'warnings must be a list'}, 400
+    
+    try:
+        quality_score = parse_number(data.get('quality_score'), 'quality_score', cast=round, minimum=0)
+        latency_ms = parse_number(data.get('latency_ms'), 'latency_ms', minimum=0)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    logger.info(f"Feedback for ticket {ticket_id}: {feedback}")
+    
+    # Queued only - the writer thread flushes batches to SQLite
+    queued = get_feedback_store().record(
+        feedback,
+        ticket_id=ticket_id,
+        suggestion_id=data.get('suggestion_id'),
+        brand=data.get('brand'),
+        intent=data.get('intent'),
+        quality_score=quality_score,
+        warnings=warnings,
+        latency_ms=latency_ms
+    )
+    
+    if not queued:
+        return {'error': 'Feedback queue full'}, 503
+    
+    return {'status': 'success'}, 200
+
+def feedback_stats(args):
+    """Acceptance stats from the feedback counters; returns (body, status)"""
+    by = args.get('by', 'brand')
+    
+    try:
+        days = parse_number(args.get('days', 30), 'days', cast=int, minimum=1)
+        if days is None:
+            raise ValueError('days must be a number')
+        groups = get_feedback_store().acceptance(by=by, days=days)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    return {'by': by, 'days': days, 'groups': groups}, 200
+
+# ============================================================================
+# WIDGET PAGE
+# ============================================================================
+
+WIDGET_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>AI Suggestion</title>
+    <style>
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif;
+            padding: 16px;
+            background: #f8f9fa;
+            font-size: 14px;
+        }
+        .header {
+            display: flex;
+            align-items: center;
+            margin-bottom: 16px;
+            padding-bottom: 12px;
+            border-bottom: 2px solid #e9ecef;
+        }
+        .header h3 {
+            color: #2c3e50;
+            font-size: 16px;
+            flex: 1;
+        }
+        .badge {
+            display: inline-block;
+            padding: 4px 10px;
+            border-radius: 12px;
+            font-size: 11px;
+            font-weight: 600;
+        }
+        .badge-high { background: #d4edda; color: #155724; }
+        .badge-medium { background: #fff3cd; color: #856404; }
+        .badge-low { background: #f8d7da; color: #721c24; }
+        
+        .loading {
+            text-align: center;
+            padding: 40px 20px;
+            color: #6c757d;
+        }
+        .spinner {
+            border: 3px solid #f3f3f3;
+            border-top: 3px solid #2196f3;
+            border-radius: 50%;
+            width: 40px;
+            height: 40px;
+            animation: spin 1s linear infinite;
+            margin: 0 auto 16px;
+        }
+        @keyframes spin {
+            0% { transform: rotate(0deg); }
+            100% { transform: rotate(360deg); }
+        }
+        
+        .suggestion-box {
+            background: white;
+            border: 1px solid #dee2e6;
+            border-radius: 8px;
+            padding: 16px;
+            margin-bottom: 12px;
+        }
+        .suggestion-text {
+            background: #e7f3ff;
+            border-left: 4px solid #2196f3;
+            padding: 12px;
+            border-radius: 4px;
+            white-space: pre-wrap;
+            font-size: 13px;
+            line-height: 1.6;
+            color: #212529;
+            max-height: 400px;
+            overflow-y: auto;
+        }
+        
+        .actions {
+            display: flex;
+            gap: 8px;
+            margin-top: 12px;
+        }
+        .btn {
+            flex: 1;
+            padding: 10px 16px;
+            border: none;
+            border-radius: 6px;
+            cursor: pointer;
+            font-size: 13px;
+            font-weight: 500;
+            transition: all 0.2s;
+        }
+        .btn-primary {
+            background: #2196f3;
+            color: white;
+        }
+        .btn-primary:hover {
+            background: #1976d2;
+            transform: translateY(-1px);
+            box-shadow: 0 2px 8px rgba(33,150,243,0.3);
+        }
+        .btn-secondary {
+            background: #e9ecef;
+            color: #495057;
+        }
+        .btn-secondary:hover {
+            background: #dee2e6;
+        }
+        
+        .info {
+            display: flex;
+            gap: 12px;
+            margin-top: 12px;
+            font-size: 12px;
+            color: #6c757d;
+        }
+        .info-item {
+            display: flex;
+            align-items: center;
+            gap: 4px;
+        }
+        
+        .warning {
+            background: #fff3cd;
+            border-left: 4px solid #ffc107;
+            padding: 12px;
+            margin: 12px 0;
+            font-size: 12px;
+            color: #856404;
+            border-radius: 4px;
+        }
+        .warning-title {
+            font-weight: 600;
+            margin-bottom: 4px;
+        }
+        
+        .error {
+            background: #f8d7da;
+            border-left: 4px solid #dc3545;
+            padding: 12px;
+            color: #721c24;
+            border-radius: 4px;
+        }
+        
+        .feedback {
+            margin-top: 12px;
+            padding-top: 12px;
+            border-top: 1px solid #e9ecef;
+            text-align: center;
+        }
+        .feedback-label {
+            font-size: 12px;
+            color: #6c757d;
+            margin-bottom: 8px;
+        }
+        .feedback-btns {
+            display: flex;
+            gap: 6px;
+            justify-content: center;
+        }
+        .feedback-btn {
+            padding: 6px 12px;
+            font-size: 12px;
+            background: #f8f9fa;
+            border: 1px solid #dee2e6;
+            border-radius: 4px;
+            cursor: pointer;
+            transition: all 0.2s;
+        }
+        .feedback-btn:hover {
+            background: #e9ecef;
+        }
+        .feedback-btn.active {
+            background: #2196f3;
+            color: white;
+            border-color: #2196f3;
+        }
+        
+        .brand-tag {
+            display: inline-block;
+            background: #e3f2fd;
+            color: #1976d2;
+            padding: 3px 8px;
+            border-radius: 4px;
+            font-size: 11px;
+            font-weight: 500;
+        }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h3>🤖 AI Suggestion</h3>
+    </div>
+    
+    <div id="content">
+        <div class="loading">
+            <div class="spinner"></div>
+            <div>Generating suggestion...</div>
+        </div>
+    </div>
+
+    <script>
+        const TICKET_ID = "{{ ticket_id }}";
+        const API_URL = window.location.origin;
+        
+        let currentSuggestion = null;
+        let suggestionLatencyMs = null;
+        
+        const POLL_INTERVAL_MS = 1000;
+        const POLL_TIMEOUT_MS = 120000;
+        
+        async function fetchJson(url, options) {
+            const response = await fetch(url, options);
+            
+            if (!response.ok) {
+                const errorText = await response.text();
+                throw new Error(`HTTP ${response.status}: ${errorText || response.statusText}`);
+            }
+            
+            const data = await response.json();
+            
+            if (data.error) {
+                throw new Error(data.error);
+            }
+            
+            return data;
+        }
+        
+        async function waitForJob(statusUrl) {
+            const deadline = Date.now() + POLL_TIMEOUT_MS;
+            
+            while (Date.now() < deadline) {
+                const job = await fetchJson(`${API_URL}${statusUrl}`);
+                
+                if (job.status === 'done') return job.result;
+                if (job.status === 'error') throw new Error(job.error || 'Failed to generate response');
+                
+                await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+            }
+            
+            throw new Error('Timed out waiting for suggestion');
+        }
+        
+        async function pollSuggestion() {
+            // Queue generation (or reuse the cached suggestion) and poll for the result
+            const job = await fetchJson(`${API_URL}/api/suggest/jobs`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    ticket_id: TICKET_ID
+                })
+            });
+            
+            return waitForJob(job.status_url);
+        }
+        
+        function streamSuggestion() {
+            // Show tokens as they arrive; resolves with the final validated suggestion
+            return new Promise((resolve, reject) => {
+                const source = new EventSource(`${API_URL}/api/suggest/stream/${encodeURIComponent(TICKET_ID)}`);
+                let text = '';
+                
+                source.addEventListener('delta', event => {
+                    text += JSON.parse(event.data).text;
+                    displayPartial(text);
+                });
+                source.addEventListener('done', event => {
+                    source.close();
+                    resolve(JSON.parse(event.data));
+                });
+                source.addEventListener('failed', event => {
+                    source.close();
+                    const error = new Error(JSON.parse(event.data).error);
+                    error.fromServer = true;
+                    reject(error);
+                });
+                source.onerror = () => {
+                    source.close();
+                    reject(new Error('Stream interrupted'));
+                };
+            });
+        }
+        
+        async function loadSuggestion() {
+            try {
+                let data;
+                
+                if (window.EventSource) {
+                    try {
+                        data = await streamSuggestion();
+                    } catch (error) {
+                        if (error.fromServer) throw error;
+                        console.warn('Streaming failed, falling back to polling:', error);
+                        data = await pollSuggestion();
+                    }
+                } else {
+                    data = await pollSuggestion();
+                }
+                
+                currentSuggestion = data;
+                displaySuggestion(data);
+                // Time the agent waited since the widget opened
+                suggestionLatencyMs = Math.round(performance.now());
+                
+            } catch (error) {
+                console.error('Error loading suggestion:', error);
+                displayError(error.message || 'Failed to load suggestion');
+            }
+        }
+        
+        function displaySuggestion(data) {
+            const qualityScore = data.quality_score || data.confidence || 0;
+            const confidenceBadge = qualityScore >= 70 ? 'badge-high' : qualityScore >= 50 ? 'badge-medium' : 'badge-low';
+            const confidenceText = qualityScore >= 70 ? 'High' : qualityScore >= 50 ? 'Medium' : 'Low';
+            
+            const warnings = data.warnings || [];
+            const warningHtml = warnings.length > 0 ? `
+                <div class="warning">
+                    <div class="warning-title">⚠️ Review Needed:</div>
+                    ${warnings.map(w => `<div>• ${w}</div>`).join('')}
+                </div>
+            ` : '';
+            
+            document.getElementById('content').innerHTML = `
+                <div class="suggestion-box">
+                    <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 12px;">
+                        <span class="brand-tag">${data.brand || 'Freebird Icons'}</span>
+                        <span class="badge ${confidenceBadge}">${confidenceText} Quality (${qualityScore}%)</span>
+                    </div>
+                    
+                    ${warningHtml}
+                    
+                    <div class="suggestion-text">${escapeHtml(data.suggestion)}</div>
+                    
+                    <div class="actions">
+                        <button class="btn btn-primary" onclick="useSuggestion()">
+                            ✓ Use Response
+                        </button>
+                        <button class="btn btn-secondary" onclick="copySuggestion()">
+                            📋 Copy
+                        </button>
+                    </div>
+                    
+                    <div class="info">
+                        <div class="info-item">
+                            <span>🎯</span>
+                            <span>Ticket #${TICKET_ID}</span>
+                        </div>
+                        ${data.cached ? '<div class="info-item"><span>💾</span><span>Cached</span></div>' : ''}
+                    </div>
+                </div>
+                
+                <div class="feedback">
+                    <div class="feedback-label">Was this helpful?</div>
+                    <div class="feedback-btns">
+                        <button class="feedback-btn" onclick="sendFeedback('used')">👍 Used It</button>
+                        <button class="feedback-btn" onclick="sendFeedback('edited')">✏️ Edited</button>
+                        <button class="feedback-btn" onclick="sendFeedback('ignored')">👎 Ignored</button>
+                    </div>
+                </div>
+            `;
+        }
+        
+        function displayPartial(text) {
+            let box = document.getElementById('partial-suggestion');
+            
+            if (!box) {
+                document.getElementById('content').innerHTML = `
+                    <div class="suggestion-box">
+                        <div class="suggestion-text" id="partial-suggestion"></div>
+                    </div>
+                `;
+                box = document.getElementById('partial-suggestion');
+            }
+            
+            box.textContent = text;
+        }
+        
+        function displayError(message) {
+            document.getElementById('content').innerHTML = `
+                <div class="error">
+                    <strong>Error:</strong> ${escapeHtml(message)}
+                    <br><br>
+                    <button class="btn btn-secondary" onclick="loadSuggestion()">Try Again</button>
+                </div>
+            `;
+        }
+        
+        function escapeHtml(text) {
+            const div = document.createElement('div');
+            div.textContent = text;
+            return div.innerHTML;
+        }
+        
+        async function useSuggestion() {
+            if (!currentSuggestion) return;
+            
+            // Copy to clipboard
+            await navigator.clipboard.writeText(currentSuggestion.suggestion);
+            
+            // Visual feedback
+            const btn = event.target;
+            const originalText = btn.innerHTML;
+            btn.innerHTML = '✓ Copied!';
+            btn.style.background = '#4caf50';
+            
+            setTimeout(() => {
+                btn.innerHTML = originalText;
+                btn.style.background = '';
+            }, 2000);
+            
+            // Record feedback
+            sendFeedback('used');
+            
+            alert('Response copied to clipboard! Paste it into your reply field.');
+        }
+        
+        async function copySuggestion() {
+            if (!currentSuggestion) return;
+            
+            await navigator.clipboard.writeText(currentSuggestion.suggestion);
+            
+            const btn = event.target;
+            const originalText = btn.innerHTML;
+            btn.innerHTML = '✓ Copied';
+            
+            setTimeout(() => {
+                btn.innerHTML = originalText;
+            }, 2000);
+        }
+        
+        async function sendFeedback(type) {
+            try {
+                await fetch(`${API_URL}/api/feedback`, {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({
+                        ticket_id: TICKET_ID,
+                        feedback: type,
+                        suggestion_id: currentSuggestion && currentSuggestion.suggestion_id,
+                        brand: currentSuggestion && currentSuggestion.brand,
+                        intent: currentSuggestion && currentSuggestion.intent,
+                        quality_score: currentSuggestion && currentSuggestion.quality_score,
+                        warnings: currentSuggestion ? currentSuggestion.warnings : [],
+                        latency_ms: suggestionLatencyMs
+                    })
+                });
+                
+                // Visual feedback
+                document.querySelectorAll('.feedback-btn').forEach(btn => {
+                    btn.classList.remove('active');
+                });
+                event.target.classList.add('active');
+                
+            } catch (error) {
+                console.error('Error sending feedback:', error);
+            }
+        }
+        
+        // Auto-load on page load
+        window.addEventListener('load', loadSuggestion);
+    </script>
+</body>
+</html>
+"""
@@ -8,7 +8,7 @@ import sys
 # Configuration - SET BEFORE IMPORTS
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GORGIAS_AUTH = os.getenv('GORGIAS_AUTH')
-GORGIAS_BASE_URL = 'https://freebirdicons.gorgias.com/api'
+GORGIAS_BASE_URL = os.getenv('GORGIAS_BASE_URL', 'https://freebirdicons.gorgias.com/api')
 
 # Set environment variable BEFORE importing
 os.environ['OPENAI_API_KEY'] = OPENAI_API_KEY
@@ -21,7 +21,7 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import logging
 from improved_response_generator import generate_response
-import requests
+from gorgias_client import GorgiasClient, client_settings_from_env
 import re
 
 app = Flask(__name__)
@@ -32,13 +32,13 @@ logger = logging.getLogger(__name__)
 
 cache = {}
 
+# Pooled keep-alive session with 429 Retry-After handling (pool, retries and deadline from GORGIAS_* env vars)
+gorgias = GorgiasClient(**dict(client_settings_from_env(), base_url=GORGIAS_BASE_URL, auth=GORGIAS_AUTH))
+
 def get_ticket_info(ticket_id):
     """Fetch ticket from Gorgias API"""
     try:
-        url = f"{GORGIAS_BASE_URL}/tickets/{ticket_id}"
-        headers = {'authorization': GORGIAS_AUTH}
-        
-        response = requests.get(url, headers=headers, timeout=10)
+        response = gorgias.get(f"tickets/{ticket_id}")
         
         if response.status_code == 200:
             data = response.json()